@@ -0,0 +1,4 @@
+@echo off
+call "C:\SamplePro\VirtualEnv\Scripts\activate.bat"
+python "C:\SamplePro\Source\EmailOwnersReviewDates.py"
+call "C:\SamplePro\VirtualEnv\Scripts\deactivate.bat"
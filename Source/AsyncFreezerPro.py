@@ -0,0 +1,161 @@
+#! python3
+""" asyncio client for the FreezerPro API
+Mirrors the FreezerPro module functions (post, retrieve, get_sample, get_vials, ...) as coroutines so that
+many independent api calls (e.g. one get_sample and one get_vials per sample) can be awaited together
+instead of one after another.
+
+Calls are made with FreezerPro.freezerpro_post on a thread pool, so they share the pooled http session,
+authorization token and active RunCache of the FreezerPro module. At most `concurrency` calls are in flight at once
+(async_concurrency in config.ini [FreezerPro], default 8 - keep <= pool_maxsize).
+
+Sync facade (for scripts that are not written with asyncio):
+    samples = fetch_many('get_sample', sample_ids)  # list of results in order of sample_ids
+    results = run(coroutine)
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import FreezerPro
+from FreezerPro import freezerpro_post, settings, PAGE_LIMIT
+
+
+class AsyncFreezerPro:
+    """ asyncio version of the FreezerPro api wrappers
+    :param concurrency: maximum number of api calls in flight at once (default async_concurrency in config.ini)
+    """
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or settings.ASYNC_CONCURRENCY
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphores = {}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _semaphore(self):
+        # semaphore must be created in (and is only valid for) the running event loop
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    async def post(self, params):
+        """ asyncio version of freezerpro_post
+        """
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, freezerpro_post, params)
+
+    async def retrieve(self, params, resultName):
+        """ asyncio version of freezerpro_retrieve (pages after the first are requested together)
+        """
+        params = dict(params)
+        params['limit'] = PAGE_LIMIT
+        params['dir'] = 'ASC'
+        data = await self.post(dict(params))
+        results = data[resultName]
+        total = data['Total']
+        page_size = len(results) or PAGE_LIMIT
+        pages = await asyncio.gather(*[self.post(dict(params, start=start))
+                                       for start in range(len(results), total, page_size)])
+        for page in pages:
+            if len(page[resultName]) == 0:
+                break
+            results.extend(page[resultName])
+        if len(results) < total:
+            print('AsyncFreezerPro.retrieve: All results not returned method={} Total={} Returned={}'
+                  .format(params.get('method'), total, len(results)))
+        return results
+
+    async def get_users(self):
+        return await self.retrieve({'method': 'users'}, 'Users')
+
+    async def _run_cached(self, name, object_id, coroutine_function):
+        """ Use active FreezerPro.RunCache (if any) for coroutine_function(object_id)
+        """
+        cache = FreezerPro.run_cache
+        if cache is None:
+            return await coroutine_function(object_id)
+        found, result = cache.lookup(name, object_id)
+        if not found:
+            result = await coroutine_function(object_id)
+            cache.store(name, object_id, result)
+        return result
+
+    async def get_sample(self, sample_id):
+        return await self._run_cached('get_sample', sample_id, 
+                                      lambda sample_id: self.post({'method': 'sample_info', 'id': sample_id}))
+
+    async def get_sample_userfields(self, sample_id):
+        return await self._run_cached('get_sample_userfields', sample_id, 
+                                      lambda sample_id: self.post({'method': 'sample_userfields', 'id': sample_id}))
+
+    async def get_location(self, location_id):
+        return await self._run_cached('get_location', location_id, 
+                                      lambda location_id: self.post({'method': 'location_info', 'id': location_id}))
+
+    async def get_vials(self, sample_id):
+        return await self._run_cached('get_vials', sample_id, 
+                                      lambda sample_id: self.retrieve({'method': 'vials_sample', 'sample_id': sample_id}, 'Locations'))
+
+    async def get_sampletypes(self):
+        sampletypes = await self.retrieve({'method': 'sample_types'}, 'SampleTypes')
+        for sampletype in sampletypes:
+            sampletype['fieldlist'] = sampletype['fields'].split('<br>')
+        return sampletypes
+
+    async def get_audit(self, date_flag):
+        return await self.retrieve({'method': 'audit', 'date_flag': date_flag}, 'AuditRec')
+
+    async def get_locations_in_state(self, state, sdfs=[]):
+        """ asyncio version of FreezerPro.get_locations_in_state (udfs in sdfs are added with hydrate_samples)
+        """
+        locations = await self.retrieve({'method': 'vials_sample', 'vial_state_type_id': state}, 'Locations')
+        if sdfs and locations:
+            async with self._semaphore():
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.executor, FreezerPro.hydrate_samples, locations, [], sdfs)
+        return locations
+
+    async def map(self, method_name, args):
+        """ Await method_name(arg) for every arg together
+        :param method_name: name of AsyncFreezerPro method e.g. 'get_sample'
+        :param args: iterable of single arguments e.g. sample ids
+        :return: list of results in order of args
+        """
+        method = getattr(self, method_name)
+        return await asyncio.gather(*[method(arg) for arg in args])
+
+
+def run(coroutine):
+    """ Run coroutine to completion in a new event loop (for use from synchronous code)
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def fetch_many(method_name, args, concurrency=None):
+    """ Synchronous facade: call AsyncFreezerPro method_name for every arg concurrently
+    e.g. samples = fetch_many('get_sample', sample_ids)
+    :param method_name: name of AsyncFreezerPro method e.g. 'get_sample', 'get_vials'
+    :param args: iterable of single arguments
+    :param concurrency: maximum number of api calls in flight at once (default async_concurrency in config.ini)
+    :return: list of results in order of args
+    """
+    args = list(args)
+    if not args:
+        return []
+    client = AsyncFreezerPro(concurrency)
+    try:
+        return run(client.map(method_name, args))
+    finally:
+        client.close()
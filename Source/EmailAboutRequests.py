@@ -0,0 +1,51 @@
+#! python3
+""" Send the request reports of EmailOperationsOfficersAboutRequests, EmailVeritecAboutRequests and
+EmailApprovalContactAboutRequests from one RequestSnapshot
+The vials in all the states the reports need (with the owner, sample type and Approval Contact of their samples) and
+today's and yesterday's state changes are fetched once, instead of once per report. 
+The number of api calls made for the snapshot and by each report is printed.
+Each report is sent even if another fails; the errors of all failed reports are emailed to support in one email.
+
+Usage:
+    python EmailAboutRequests.py
+Can replace the separate report tasks, e.g. in [Schedule] of config.ini for Scheduler.py:
+    EmailAboutRequests = 30 8-15 * * *
+    EmailOperationsOfficersAboutRequests = off
+    EmailApprovalContactAboutRequests = off
+"""
+
+import traceback
+import EmailOperationsOfficersAboutRequests
+import EmailVeritecAboutRequests
+import EmailApprovalContactAboutRequests
+from FreezerPro import RequestSnapshot, MailDispatcher, api_call_count, email_Support
+
+REPORTS = [EmailOperationsOfficersAboutRequests, EmailVeritecAboutRequests, EmailApprovalContactAboutRequests]
+
+
+def main():
+    states = [state for report in REPORTS for state in report.STATES]
+    failures = []
+    with RequestSnapshot(states, udfs=[EmailApprovalContactAboutRequests.USER_UDF]) as snapshot, MailDispatcher.active():
+        for report in REPORTS:
+            started_calls = api_call_count()
+            try:
+                report.main()
+            except Exception as err:
+                traceback.print_exc()
+                failures.append((report.__name__, err))
+            print('{}: {} api calls'.format(report.__name__, api_call_count() - started_calls))
+        print('EmailAboutRequests: snapshot {} api calls'.format(snapshot.api_calls))
+    if failures:
+        # raised (and emailed to support once by the caller) after the other reports have been sent
+        raise RuntimeError('Reports failed: {}\n\n'.format(', '.join(name for name, err in failures)) + 
+                           '\n'.join('{}:\n{}'.format(name, ''.join(traceback.format_exception(type(err), err, err.__traceback__)))
+                                     for name, err in failures))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        # print(err)
+        email_Support('SamplePro error in EmailAboutRequests', err )
@@ -6,8 +6,8 @@ Date: August 2018
 
 """
 
-from FreezerPro import send_html, dict_to_html, email_OperationsOfficer, email_Support, Vial_States, STATE_NAME,\
-    get_locations_in_state, get_users_by_fullname, get_users_by_username, get_sample, SUPPORT_EMAIL
+from FreezerPro import MailDispatcher, send_html, dict_to_html, compose_tables, email_OperationsOfficer, email_Support, Vial_States, STATE_NAME,\
+    get_locations_in_state_of_samples, get_users_by_fullname, get_users_by_username
 
 
 def email_sample_udf_about_state_change(user_udf, state):
@@ -17,18 +17,17 @@ def email_sample_udf_about_state_change(user_udf, state):
     :param states: Vial_States
     :return: True if email sent else False if no locations in specified states
     """
-    locations = get_locations_in_state(state.value, [user_udf])
+    locations = get_locations_in_state_of_samples(state, ['owner', 'sample_type'], [user_udf])
     if not locations:
         return None
-    for location in locations:
-        sample = get_sample(location['sample_id'])
-        location['owner'] = sample['owner']
-        location['sample_type'] = sample['sample_type']
 
-    udf_usernames = set([location[user_udf] for location in locations])
+    tables = compose_tables(locations, user_udf,
+                            ['sample_id', 'barcode_tag', 'sample_type', 'owner'], 
+                            ['Sample Id', 'Barcode', 'Sample Type', 'Owner'])
+    udf_usernames = set(tables)
     users = get_users_by_fullname(udf_usernames)  # will ignore locations without valid user_udf
     users = list(filter(None, users))
-    valid_usernames = [user['fullname'] for user in users]
+    valid_usernames = set(user['fullname'] for user in users)
     invalid_udf_locations = [location for location in locations if location[user_udf] not in valid_usernames]
     if invalid_udf_locations:  # there are samples in specified state where user_udf does not contain valid user
         msg = []
@@ -41,42 +40,45 @@ def email_sample_udf_about_state_change(user_udf, state):
         email_OperationsOfficer('Invalid {}'.format(user_udf), '<br>\r\n'.join(msg))
 
         # also email owner when user_udf is not valid
-        owner_usernames = set([location['owner'] for location in invalid_udf_locations])
+        invalid_tables = compose_tables(invalid_udf_locations, 'owner',
+                                        ['sample_id', 'barcode_tag', 'sample_type', 'owner', user_udf], 
+                                        ['Sample Id', 'Barcode', 'Sample Type', 'Owner', user_udf])
+        owner_usernames = set(invalid_tables)
         owners = get_users_by_username(owner_usernames)
         for owner in owners:
-            invalid_of_owner = [location for location in invalid_udf_locations if location['owner'] == owner['username']]
-            if invalid_of_owner:
-                msg = []
-                msg.append('These samples with status {} do not have a valid {}:'
-                           .format(STATE_NAME[state], user_udf))
-                html = dict_to_html(invalid_of_owner, 
-                                    ['sample_id', 'barcode_tag', 'sample_type', 'owner', user_udf], 
-                                    ['Sample Id', 'Barcode', 'Sample Type', 'Owner', user_udf])
-                msg.append(html)
-                send_html(owner['fullname'], [owner['email']], 'SamplePro: Invalid {}'.format(user_udf), '<br>\r\n'.join(msg))
+            msg = []
+            msg.append('These samples with status {} do not have a valid {}:'
+                       .format(STATE_NAME[state], user_udf))
+            msg.append(invalid_tables[owner['username']])
+            send_html(owner['fullname'], [owner['email']], 'SamplePro: Invalid {}'.format(user_udf), '<br>\r\n'.join(msg))
 
     for user in users:
-        locations_of_user = [location for location in locations if location[user_udf] == user['fullname']]
         msg = []
         # print('Location fields', locations[0].keys())
         msg.append('These samples (with {}={}) currently have status {}:'
                    .format(user_udf, user['fullname'], STATE_NAME[state]))
-        html = dict_to_html(locations_of_user, 
-                            ['sample_id', 'barcode_tag', 'sample_type', 'owner'], 
-                            ['Sample Id', 'Barcode', 'Sample Type', 'Owner'])
-        msg.append(html)
+        msg.append(tables[user['fullname']])
         send_html(user['fullname'], [user['email']], 'SamplePro: sample requests', '<br>\r\n'.join(msg))
     return users
 
 
+USER_UDF = 'Approval Contact'
+STATES = (Vial_States.ApprovalRequested,)
+
+
+def main():
+    with MailDispatcher.active():
+        users_emailed = email_sample_udf_about_state_change(USER_UDF, Vial_States.ApprovalRequested)
+    if users_emailed:
+        emails = [user['email'] for user in users_emailed]
+        print('Emails sent to ', emails)
+    else:
+        print('No samples have Approval Requested with Approval Contact set')
+
+
 if __name__ == '__main__':
     try:
-        users_emailed = email_sample_udf_about_state_change('Approval Contact', Vial_States.ApprovalRequested)
-        if users_emailed:
-            emails = [user['email'] for user in users_emailed]
-            print('Emails sent to ', emails)
-        else:
-            print('No samples have Approval Requested with Approval Contact set')
+        main()
     except Exception as err:
         # print(err)
         email_Support('SamplePro error in EmailApprovalContactAboutRequests', err )
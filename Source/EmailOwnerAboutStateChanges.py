@@ -5,40 +5,30 @@ Author: Wayne Schou
 Date: August 2018
 
 """
-from FreezerPro import send_html, dict_to_html, email_Support, get_users_by_fullname, get_users_by_username,\
-    samples_with_state_changes, get_sample, SUPPORT_EMAIL
+from FreezerPro import MailDispatcher, send_html, compose_tables, email_Support, get_user_directory, get_users_by_username,\
+    samples_with_state_changes, hydrate_samples
 
 
 def email_owner_about_state_change(date_flag):
     sample_state_changes = samples_with_state_changes(date_flag)
     # remove state changes generated by owner of sample (sample has username, statechange uses fullname as user_name)
-    modified_by = set([state_change['user_name'] for state_change in sample_state_changes])
-    modifying_users = get_users_by_fullname(modified_by)
-    for state_change in sample_state_changes[:]:
-        modifying_user = next((user['username'] for user in modifying_users if user['fullname'] == state_change['user_name']), None)
-        state_change['modified_by'] = modifying_user
-    for state_change in sample_state_changes[:]:
-        # print(state_change['date'], state_change['type'], 'for sample', state_change['sample_id'], 'by', state_change['user_name'])
-        sample = get_sample(state_change['sample_id'])
-        if (sample['owner'] == state_change['modified_by']):
-            sample_state_changes.remove(state_change)
-        else:
-            #state_change['sample_name'] = sample['name']
-            state_change['owner'] = sample['owner']
-            state_change['sample_type'] = sample['sample_type']
-            # vials = get_vials(state_change['sample_id'])
-
-    sample_state_changes.sort(key=lambda x: x['sample_type']+x['sample_id']+x['date'])
-    affected_usernames = set([state_change['owner'] for state_change in sample_state_changes])
+    users_by_fullname = get_user_directory().by_fullname
+    for state_change in sample_state_changes:
+        modifying_user = users_by_fullname.get(state_change['user_name'])
+        state_change['modified_by'] = modifying_user['username'] if modifying_user else None
+    hydrate_samples(sample_state_changes, ['owner', 'sample_type'])
+    sample_state_changes = [state_change for state_change in sample_state_changes 
+                            if state_change['owner'] != state_change['modified_by']]
+
+    tables = compose_tables(sample_state_changes, 'owner',
+                            ['date', 'sample_id', 'sample_type', 'vial_location', 'from_state', 'to_state', 'user_name', 'comments'],  
+                            ['Date', 'Sample Id', 'Sample Type', 'Location', 'From State', 'To State', 'Changed by', 'Comments'],
+                            sort_key=lambda x: x['sample_type']+x['sample_id']+x['date'])
+    affected_usernames = set(tables)
     owners = get_users_by_username(affected_usernames)
     for user in owners:
-        user_state_changes = [state_change for state_change in sample_state_changes if state_change['owner'] == user['username']]
         msg = ['The state of the following samples owned by you has been changed by someone else:']
-
-        html = dict_to_html(user_state_changes, 
-                            ['date', 'sample_id', 'sample_type', 'vial_location', 'from_state', 'to_state', 'user_name', 'comments'],  
-                            ['Date', 'Sample Id', 'Sample Type', 'Location', 'From State', 'To State', 'Changed by', 'Comments'])
-        msg.append(html)
+        msg.append(tables[user['username']])
         #print(user['fullname'], '[', user['email'], ']')
         #print('\n'.join(msg))
 
@@ -46,13 +36,18 @@ def email_owner_about_state_change(date_flag):
     return owners
 
 
+def main():
+    with MailDispatcher.active():
+        owners = email_owner_about_state_change('today')  
+    #owners = email_owner_about_state_change('yesterday')  
+    # temp for testing      
+    # owners = email_owner_about_state_change('7/8/2018,8/8/2018')
+    print('Email sent to', owners)
+
+
 if __name__ == '__main__':
     try:
-        owners = email_owner_about_state_change('today')  
-        #owners = email_owner_about_state_change('yesterday')  
-        # temp for testing      
-        # owners = email_owner_about_state_change('7/8/2018,8/8/2018')
-        print('Email sent to', owners)
+        main()
     except Exception as err:
         # print(err)
         email_Support('SamplePro error in EmailOwnerAboutStateChanges', err )
@@ -0,0 +1,44 @@
+#! python3
+""" Send the review date reminders of EmailOwnersSamplesReviewDateOverdue and EmailOwnersSamplesNearingReviewDate
+from a single retrieval of samples (ReviewDates.review_date_buckets)
+Each reminder is sent even if the other fails; the errors of failed reminders are emailed to support in one email.
+
+Usage:
+    python EmailOwnersReviewDates.py
+Replaces the separate review date tasks: Scheduler.py runs it by default (instead of the two scripts), and
+ScheduleTasks/EmailOwnersReviewDates.xml replaces the EmailOwnersSamplesReviewDateOverdue and
+EmailOwnersSamplesNearingReviewDate Windows tasks.
+"""
+
+import traceback
+import EmailOwnersSamplesReviewDateOverdue
+import EmailOwnersSamplesNearingReviewDate
+from FreezerPro import MailDispatcher, email_Support
+from ReviewDates import review_date_buckets
+
+REMINDERS = [EmailOwnersSamplesReviewDateOverdue, EmailOwnersSamplesNearingReviewDate]
+
+
+def main():
+    buckets = review_date_buckets()
+    failures = []
+    with MailDispatcher.active():
+        for reminder in REMINDERS:
+            try:
+                reminder.main(buckets)
+            except Exception as err:
+                traceback.print_exc()
+                failures.append((reminder.__name__, err))
+    if failures:
+        # raised (and emailed to support once by the caller) after the other reminder has been sent
+        raise RuntimeError('Reminders failed: {}\n\n'.format(', '.join(name for name, err in failures)) + 
+                           '\n'.join('{}:\n{}'.format(name, ''.join(traceback.format_exception(type(err), err, err.__traceback__)))
+                                     for name, err in failures))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        # print(err)
+        email_Support('SamplePro error in EmailOwnersReviewDates', err )
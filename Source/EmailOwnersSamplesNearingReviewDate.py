@@ -3,31 +3,26 @@
 Will not report on samples where ANY sample vial/location has a Disposed, Dispose Request, Returned, ReturnToSource state
 """
 
-from FreezerPro import samples_nearing_reviewdate, dict_to_html, send_html, email_Support, get_users_by_id, SUPPORT_EMAIL, \
-                       DAYS_TO_REVIEW_NORMAL, DAYS_TO_REVIEW_SHORT, SHORT_REVIEW_REMINDER
-from datetime import datetime
+from FreezerPro import MailDispatcher, compose_tables, send_html, email_Support, get_users_by_id, settings
+from ReviewDates import review_date_buckets
 
 
-def email_owners_longterm_samples_nearing_reviewdate(days):
-    samples = samples_nearing_reviewdate(days)
-    samples = [sample for sample in samples 
-               if (datetime.strptime( sample['Review Date'], '%d/%m/%Y') - datetime.strptime(sample['created_at'], '%d/%m/%Y')).days 
-                   > SHORT_REVIEW_REMINDER
-              ]
+def email_owners_samples_nearing_reviewdate(samples, days):
+    """
+    :param samples: samples nearing review date (bucket near_long or near_short of review_date_buckets)
+    :param days: days to review date given in email
+    """
     # print(samples)
-    # users = get_users()
-    sample_owner_ids = set([sample['owner_id'] for sample in samples])
+    tables = compose_tables(samples, 'owner_id',
+                            ['id', 'Review Date', 'location'], 
+                            ['Sample Id', 'Review Date', 'Location'],
+                            sort_key=lambda x: x['Review Date'] + x['location'] + str(x['id']).zfill(10))
+    sample_owner_ids = set(tables)
     sample_owners = get_users_by_id(sample_owner_ids)
     # print(sample_owners)
     for user in sample_owners:
-        samples_of_owner = [sample for sample in samples if sample['owner_id'] == user['id']]
-        # print('Samples of owner', samples_of_owner)
         msg = ['The following samples owned by you require review within the next <b>{}</b> days'.format(days)]
-        samples.sort(key=lambda x: x['Review Date'] + x['location'] + str(x['id']).zfill(10))
-        html = dict_to_html(samples_of_owner, 
-                            ['id', 'Review Date', 'location'], 
-                            ['Sample Id', 'Review Date', 'Location'])
-        msg.append(html)
+        msg.append(tables[user['id']])
 
         #print(user['fullname'], '[', user['email'], ']')
         #print('\n'.join(msg))
@@ -36,40 +31,19 @@ def email_owners_longterm_samples_nearing_reviewdate(days):
     return sample_owners
 
 
-def email_owners_shortterm_samples_nearing_reviewdate(days):
-    samples = samples_nearing_reviewdate(days)
-    samples = [sample for sample in samples 
-               if (datetime.strptime( sample['Review Date'], '%d/%m/%Y') - datetime.strptime(sample['created_at'], '%d/%m/%Y')).days 
-                    <= SHORT_REVIEW_REMINDER
-              ]
-    # print(samples)
-    # users = get_users()
-    sample_owner_ids = set([sample['owner_id'] for sample in samples])
-    sample_owners = get_users_by_id(sample_owner_ids)
-    # print(sample_owners)
-    for user in sample_owners:
-        samples_of_owner = [sample for sample in samples if sample['owner_id'] == user['id']]
-        # print('Samples of owner', samples_of_owner)
-        msg = ['The following samples owned by you require review within the next <b>{}</b> days'.format(days)]
-        samples.sort(key=lambda x: x['Review Date'] + x['location'] + str(x['id']).zfill(10))
-        html = dict_to_html(samples_of_owner, 
-                            ['id', 'Review Date', 'location'], 
-                            ['Sample Id', 'Review Date', 'Location'])
-        msg.append(html)
-
-        #print(user['fullname'], '[', user['email'], ']')
-        #print('\n'.join(msg))
-
-        send_html(user['fullname'], [user['email']], 'SamplePro: Review dates near', '<br>\r\n'.join(msg))
-    return sample_owners
+def main(buckets=None):
+    """ :param buckets: review_date_buckets() (near buckets are retrieved if not given) """
+    buckets = buckets or review_date_buckets(buckets=['near_long', 'near_short'])
+    with MailDispatcher.active():
+        email_sent = email_owners_samples_nearing_reviewdate(buckets['near_long'], settings.DAYS_TO_REVIEW_NORMAL)
+        print('Normal term sample emails sent to', email_sent)
+        email_sent = email_owners_samples_nearing_reviewdate(buckets['near_short'], settings.DAYS_TO_REVIEW_SHORT)
+        print('Short term sample emails sent to', email_sent)    
 
 
 if __name__ == '__main__':
     try:
-        email_sent = email_owners_longterm_samples_nearing_reviewdate(DAYS_TO_REVIEW_NORMAL)
-        print('Normal term sample emails sent to', email_sent)
-        email_sent = email_owners_shortterm_samples_nearing_reviewdate(DAYS_TO_REVIEW_SHORT)
-        print('Short term sample emails sent to', email_sent)    
+        main()
     except Exception as err:
         print(err)
         email_Support('SamplePro error in EmailOwnersSampleNearingReviewDate', err )
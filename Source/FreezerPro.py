@@ -3,13 +3,15 @@
 Author: Wayne Schou
 Date: August 2018
 
-Constants:
-   There are a number of constants defined at the top of the file that should be setup correctly
+Settings:
+   Settings are read from config.ini (see get_config.py) when first used, not when the module is imported.
+   They are attributes of `settings` and, for existing code, of the module (e.g. FreezerPro.API_URL)
    API_URL: url of freezerpro system
    USER_NAME: username to use to log into freezerpro
    SMTPServer: ip address of SMTP server
    SMTPPort: port of SMTP server
    SUPPORT_EMAIL: email address to send any exceptions to.
+   POOL_CONNECTIONS, POOL_MAXSIZE, KEEP_ALIVE: connection pooling of the shared http session (see get_session)
 
 Security:
     The module uses package keyring to safely hold the password for user_name (stored under service=FreezerPro)
@@ -21,27 +23,30 @@ Security:
 
     The module requests an authorization token (will omit multiple "API Session Created" and "API Session Removed" entries in the audit log)
     The autorization token is only valid for 10 minutes after generation or last use.
+    TokenManager refreshes the token before it lapses and shares a still valid token between processes
+    through a locked cache file (token_cache_file), so scheduled scripts avoid keyring lookups and gen_token calls.
 """
 
-import requests
-import urllib3
-from urllib3.exceptions import InsecureRequestWarning
+# requests, keyring, smtplib and email are imported where first needed to keep importing this module fast
 import json
 from enum import IntEnum, unique
-import smtplib
-from email.mime.text import MIMEText
-import keyring
 from datetime import datetime, date, timedelta
 import re
 import traceback
-import pandas as pd
 import get_config
 import time
-
-try:
-    config = get_config.get_config()
-except RuntimeError as err:
-    # ultimate fallback when config.ini not correct
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict, Counter
+import functools
+import contextlib
+from itertools import islice
+
+def config_failed(err):
+    """ ultimate fallback when config.ini not correct, email hardcoded support address """
+    import smtplib
     s = smtplib.SMTP('163.7.18.150', 25)
     SUPPORT_EMAIL = 'wayne.schou@scionresearch.com'
     msg = "From: SamplePro <donotreply@scionresearch.com>\r\n"\
@@ -54,21 +59,101 @@ except RuntimeError as err:
     s.quit()
     #SUPPORT_EMAIL = 'wayne.schou@scionreesarch.com'  # need to specify email to use with config errors
     #email_Support('SamplePro error in Config', RuntimeError('Failed to load {}. Default config.ini can be created with create_configini.py'.format(get_config.config_filename())) )
-    raise
-API_URL = config['FreezerPro']['api_url']
-USER_NAME = config['FreezerPro']['Username']
-SMTPServer = config['MailServer']['SMTPServer']
-SMTPPort = config['MailServer']['SMTPPort']
-SEND_EMAIL_FROM = config['System'].get('send_email_from', fallback='SamplePro <donotreply@scionresearch.com>')
-SUPPORT_EMAIL = config['System']['Support_Email']
-OPERATION_OFFICER_EMAIL = config['System'].get('operation_officer_email', fallback='Operations.Officer@scionresearch.com')
-VERITEC_EMAIL = config['System'].get('veritec_email', fallback='Veritec@scionresearch.com')
-MEDIA_EMAIL = config['System'].get('media_email', fallback='TreePropagation@scionresearch.com')
-EMAIL_SUPPORT_ONLY = config['System'].getboolean('EMAIL_SUPPORT_ONLY', fallback=False)
-EMAIL_SUPPORT_ALSO = config['System'].getboolean('EMAIL_SUPPORT_ALSO', fallback=False)
-DAYS_TO_REVIEW_NORMAL = config['System'].getint('days_to_review_normal', fallback=30)
-DAYS_TO_REVIEW_SHORT = config['System'].getint('days_to_review_short', fallback=7)
-SHORT_REVIEW_REMINDER = config['System'].getint('short_review_reminder', fallback=365)
+
+
+# settings read from config.ini: name -> function(config) returning value
+SETTINGS = {
+    'API_URL': lambda config: config['FreezerPro']['api_url'],
+    'USER_NAME': lambda config: config['FreezerPro']['Username'],
+    'SMTPServer': lambda config: config['MailServer']['SMTPServer'],
+    'SMTPPort': lambda config: config['MailServer']['SMTPPort'],
+    'SEND_EMAIL_FROM': lambda config: config['System'].get('send_email_from', fallback='SamplePro <donotreply@scionresearch.com>'),
+    'SUPPORT_EMAIL': lambda config: config['System']['Support_Email'],
+    'OPERATION_OFFICER_EMAIL': lambda config: config['System'].get('operation_officer_email', fallback='Operations.Officer@scionresearch.com'),
+    'VERITEC_EMAIL': lambda config: config['System'].get('veritec_email', fallback='Veritec@scionresearch.com'),
+    'MEDIA_EMAIL': lambda config: config['System'].get('media_email', fallback='TreePropagation@scionresearch.com'),
+    'EMAIL_SUPPORT_ONLY': lambda config: config['System'].getboolean('EMAIL_SUPPORT_ONLY', fallback=False),
+    'EMAIL_SUPPORT_ALSO': lambda config: config['System'].getboolean('EMAIL_SUPPORT_ALSO', fallback=False),
+    'DAYS_TO_REVIEW_NORMAL': lambda config: config['System'].getint('days_to_review_normal', fallback=30),
+    'DAYS_TO_REVIEW_SHORT': lambda config: config['System'].getint('days_to_review_short', fallback=7),
+    'SHORT_REVIEW_REMINDER': lambda config: config['System'].getint('short_review_reminder', fallback=365),
+    'MIRROR_FILE': lambda config: config['System'].get('mirror_file', fallback=None),
+    'MIRROR_MAX_AGE': lambda config: config['System'].getint('mirror_max_age', fallback=3600),
+    'POOL_CONNECTIONS': lambda config: config['FreezerPro'].getint('pool_connections', fallback=1),
+    'POOL_MAXSIZE': lambda config: config['FreezerPro'].getint('pool_maxsize', fallback=10),
+    'KEEP_ALIVE': lambda config: config['FreezerPro'].getboolean('keep_alive', fallback=True),
+    'USER_DIRECTORY_TTL': lambda config: config['FreezerPro'].getint('user_directory_ttl', fallback=3600),
+    'RUN_CACHE_SIZE': lambda config: config['FreezerPro'].getint('run_cache_size', fallback=10000),
+    'BULK_SEARCH_IDS': lambda config: config['FreezerPro'].getint('bulk_search_ids', fallback=500),
+    'VIALS_BULK_THRESHOLD': lambda config: config['FreezerPro'].getint('vials_bulk_threshold', fallback=500),
+    'RETRIEVE_WORKERS': lambda config: config['FreezerPro'].getint('retrieve_workers', fallback=1),
+    'ASYNC_CONCURRENCY': lambda config: config['FreezerPro'].getint('async_concurrency', fallback=8),
+    'TOKEN_LIFETIME': lambda config: config['FreezerPro'].getint('token_lifetime', fallback=600),
+    'TOKEN_REFRESH_MARGIN': lambda config: config['FreezerPro'].getint('token_refresh_margin', fallback=60),
+    'TOKEN_CACHE_FILE': lambda config: config['FreezerPro'].get('token_cache_file', 
+                                                                fallback=os.path.join(tempfile.gettempdir(), 'SamplePro_token.json')),
+    'SMTP_CONNECTIONS': lambda config: config['MailServer'].getint('smtp_connections', fallback=1),
+    'OUTBOX_DIR': lambda config: config['MailServer'].get('outbox_dir', fallback=None),
+    'JOB_TIMEOUT': lambda config: config['FreezerPro'].getint('job_timeout', fallback=3600),
+    'JOB_POLL_MAX': lambda config: config['FreezerPro'].getfloat('job_poll_max', fallback=10),
+    # UpdateSampleStateUDF.py
+    'CHECKPOINT_FILE': lambda config: config['System'].get('checkpoint_file', 
+                                                           fallback=os.path.join(os.path.dirname(get_config.config_filename()), 
+                                                                                 'UpdateSampleStateUDF_checkpoint.json')),
+    'CHECKPOINT_OVERLAP': lambda config: config['System'].getint('checkpoint_overlap', fallback=60),
+    'UPDATE_WORKERS': lambda config: config['FreezerPro'].getint('update_workers', fallback=4),
+    'UPDATE_SPLIT_SIZE': lambda config: config['FreezerPro'].getint('update_split_size', fallback=2000),
+    'UPDATE_CHUNK_RECORDS': lambda config: config['FreezerPro'].getint('update_chunk_records', fallback=1000),
+    'UPDATE_CHUNK_BYTES': lambda config: config['FreezerPro'].getint('update_chunk_bytes', fallback=1000000),
+    'UPDATE_CHUNKS_IN_FLIGHT': lambda config: config['FreezerPro'].getint('update_chunks_in_flight', fallback=2),
+    'UPDATE_RETRIES': lambda config: config['FreezerPro'].getint('update_retries', fallback=2),
+    'UPDATE_RETRY_DELAY': lambda config: config['FreezerPro'].getfloat('update_retry_delay', fallback=10),
+    # MailOutbox.py
+    'OUTBOX_WORKERS': lambda config: config['MailServer'].getint('outbox_workers', fallback=4),
+    'OUTBOX_MAX_ATTEMPTS': lambda config: config['MailServer'].getint('outbox_max_attempts', fallback=10),
+    'OUTBOX_RETRY_DELAY': lambda config: config['MailServer'].getint('outbox_retry_delay', fallback=60),
+}
+
+
+class Settings:
+    """ Settings from config.ini, which is only read when a setting is first used
+    e.g. settings.API_URL, settings.config (ConfigParser of config.ini)
+    A setting can be overridden (e.g. in tests) by assigning it, before or after config.ini is read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # only called for settings that have not been loaded yet
+        if name.startswith('_') or (name not in SETTINGS and name != 'config'):
+            raise AttributeError(name)
+        self.load()
+        return self.__dict__[name]
+
+    def load(self):
+        with self._lock:
+            if 'config' in self.__dict__:
+                return
+            try:
+                config = get_config.get_config()
+            except RuntimeError as err:
+                config_failed(err)
+                raise
+            for name, read in SETTINGS.items():
+                self.__dict__.setdefault(name, read(config))
+            self.__dict__['config'] = config
+
+
+settings = Settings()
+
+
+def __getattr__(name):
+    """ Settings are also module attributes (e.g. from FreezerPro import SUPPORT_EMAIL), read from config.ini when first used
+    """
+    if name in SETTINGS or name == 'config':
+        return getattr(settings, name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 ## Constants:
 #API_URL = 'https://freezerpro.scionresearch.com/api'  # Production database
@@ -124,18 +209,52 @@ STATE_NAME = {
     Vial_States.SampleUnused:'Sample - Unused',
     Vial_States.SampleDestroyed:'Sample - Destroyed'
     }
+STATE_ID = {name: state for state, name in STATE_NAME.items()}  # Vial_States of state_info
+
+# samples where all vials are in these states are excluded from review date reminders
+VIAL_STATES_GONE = (Vial_States.Disposed, 
+                    Vial_States.DisposeRequest,
+                    Vial_States.Returned,
+                    Vial_States.ReturnToSource,
+                    Vial_States.SampleDestroyed,
+                    Vial_States.SampleFinished)
+
+session = None
+
 
-auth_token = None
+def get_session():
+    """ Get shared http session used for all FreezerPro api calls
+    Connections are pooled (pool_connections/pool_maxsize in config.ini) and kept alive between calls
+    so that each api call does not pay for a new TCP/TLS handshake.
+    :return: requests.Session
+    """
+    global session
+    if not session:
+        import requests
+        from requests.adapters import HTTPAdapter
+        import urllib3
+        from urllib3.exceptions import InsecureRequestWarning
+        urllib3.disable_warnings(category=InsecureRequestWarning)
+        new_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=settings.POOL_CONNECTIONS, pool_maxsize=settings.POOL_MAXSIZE)
+        new_session.mount('https://', adapter)
+        new_session.mount('http://', adapter)
+        new_session.verify = False
+        if not settings.KEEP_ALIVE:
+            new_session.headers['Connection'] = 'close'
+        session = new_session
+    return session
 
 
 def get_token():
-    """ Get Authorization token
+    """ Generate new Authorization token (token_manager.token() will reuse a valid token)
     """
+    import keyring
     password = None
     n_attempts = 1
     while n_attempts < 6:
         try:
-            password = keyring.get_password('FreezerPro', USER_NAME)
+            password = keyring.get_password('FreezerPro', settings.USER_NAME)
         except keyring.errors.KeyringError as e:
             raise RuntimeError('Error retrieving password') from e
         if password:
@@ -143,11 +262,10 @@ def get_token():
         time.sleep(10)
         n_attempts += 1
     if not password:
-        raise RuntimeError('Password for {} has not been stored. Use set_password.py.'.format(USER_NAME))
-    urllib3.disable_warnings(category=InsecureRequestWarning)
-    r = requests.post(API_URL,
-                      data={'method': 'gen_token' },
-                      auth=(USER_NAME, password), verify=False)
+        raise RuntimeError('Password for {} has not been stored. Use set_password.py.'.format(settings.USER_NAME))
+    r = get_session().post(settings.API_URL,
+                           data={'method': 'gen_token' },
+                           auth=(settings.USER_NAME, password))
     r.raise_for_status()
     data = r.json()
     # print(json.dumps(data, indent=4, sort_keys=True))
@@ -160,66 +278,536 @@ def get_token():
         raise RuntimeError('Unexpected result returned: {}'.format(data))
 
 
+TOKEN_ERROR = re.compile(r'token|authenticat', re.IGNORECASE)
+
+
+class TokenManager:
+    """ Keeps the FreezerPro authorization token valid
+    The token expires TOKEN_LIFETIME seconds after it was generated or last used, so it is renewed once it
+    comes within TOKEN_REFRESH_MARGIN seconds of expiring.
+    Tokens are shared with other processes through cache_file (default token_cache_file in config.ini), access to which
+    is serialized with a lock file.
+    """
+
+    def __init__(self, cache_file=None):
+        self._cache_file = cache_file
+        self.auth_token = None
+        self.rejected_token = None
+        self.last_used = 0
+        self.last_saved = 0
+        self.lock = threading.Lock()
+
+    @property
+    def cache_file(self):
+        return self._cache_file or settings.TOKEN_CACHE_FILE
+
+    def expired(self):
+        return time.time() > self.last_used + settings.TOKEN_LIFETIME - settings.TOKEN_REFRESH_MARGIN
+
+    def token(self):
+        """ Return a valid token (from this process, cache_file or gen_token - in that order)
+        """
+        with self.lock:
+            if self.auth_token and not self.expired():
+                return self.auth_token
+            with self._locked_cache():
+                cached = self._read_cache()
+                if cached and cached['auth_token'] != self.rejected_token \
+                        and time.time() < cached['last_used'] + settings.TOKEN_LIFETIME - settings.TOKEN_REFRESH_MARGIN:
+                    self.auth_token = cached['auth_token']
+                    self.last_used = cached['last_used']
+                else:
+                    self.auth_token = get_token()
+                    self.last_used = time.time()
+                    self._write_cache()
+            return self.auth_token
+
+    def touch(self):
+        """ Record use of the token (extends its life on the server)
+        cache_file is only rewritten every TOKEN_REFRESH_MARGIN seconds
+        """
+        with self.lock:
+            self.last_used = time.time()
+            if self.last_used - self.last_saved < settings.TOKEN_REFRESH_MARGIN:
+                return
+            with self._locked_cache():
+                cached = self._read_cache()
+                if cached is None or cached['auth_token'] == self.auth_token:
+                    self._write_cache()
+
+    def invalidate(self, auth_token):
+        """ Discard auth_token (rejected by server) so that the next call to token() generates a new one
+        """
+        with self.lock:
+            self.rejected_token = auth_token
+            if self.auth_token == auth_token:
+                self.auth_token = None
+                self.last_used = 0
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('api_url') != settings.API_URL or cached.get('username') != settings.USER_NAME or not cached.get('auth_token'):
+            return None
+        return cached
+
+    def _write_cache(self):
+        cached = {'api_url': settings.API_URL, 'username': settings.USER_NAME, 'auth_token': self.auth_token, 'last_used': self.last_used}
+        try:
+            fd = os.open(self.cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cached, f)
+            self.last_saved = self.last_used
+        except OSError as err:
+            print('TokenManager: unable to save token to {}: {}'.format(self.cache_file, err))
+
+    def _locked_cache(self):
+        return _FileLock(self.cache_file + '.lock')
+
+
+class _FileLock:
+    """ Exclusive lock (across processes) held on lock_filename while in context
+    """
+
+    def __init__(self, lock_filename):
+        self.lock_filename = lock_filename
+        self.f = None
+
+    def __enter__(self):
+        try:
+            self.f = open(self.lock_filename, 'a+')
+        except OSError as err:
+            print('Unable to open lock file {}: {}'.format(self.lock_filename, err))
+            return self
+        if os.name == 'nt':
+            import msvcrt
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after 10 seconds
+        else:
+            import fcntl
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if not self.f:
+            return
+        if os.name == 'nt':
+            import msvcrt
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        self.f.close()
+        self.f = None
+
+
+token_manager = TokenManager()  # cache file is token_cache_file in config.ini
+
+
 def freezerpro_post(params, file={}):
     """ 
     Wrapper for posting to FreezerPro api using authorization token
-    Token will be requested if needed
+    Token will be requested if needed, and renewed (with the call retried once) if it has expired
     :param params: dictionary of parameters
     :return: dictionary of results
     """
-    global auth_token
-    if not auth_token:
-        auth_token = get_token()
-    params['username'] = USER_NAME
-    params['auth_token'] = auth_token
-    urllib3.disable_warnings(category=InsecureRequestWarning)
-    r = requests.post(API_URL, 
-                      headers={'Content-Type': 'application/json'},
-                      # data=json.dumps(params), 
-                      json=params,
-                      files=file,
-                      verify=False )
-    r.raise_for_status()
-    data = r.json()
+    params['username'] = settings.USER_NAME
+    params['auth_token'] = token_manager.token()
+    data = _post(params, file)
+    if 'error' in data and TOKEN_ERROR.search(str(data.get('message', ''))):
+        token_manager.invalidate(params['auth_token'])
+        params['auth_token'] = token_manager.token()
+        data = _post(params, file)
     if 'error' in data:
         if 'message' in data:
             raise RuntimeError('{}'.format(data['message']))
         else:
             raise RuntimeError('Unexpected result returned: {}'.format(data))
+    token_manager.touch()
     return data
 
 
-def freezerpro_retrieve(params, resultName):
+api_calls = Counter()  # number of api calls made by freezerpro_post, by method
+_api_calls_lock = threading.Lock()
+
+
+def api_call_count():
+    """ :return: total number of api calls made by freezerpro_post (e.g. compare before and after a report) """
+    with _api_calls_lock:
+        return sum(api_calls.values())
+
+
+def _post(params, file):
+    with _api_calls_lock:
+        api_calls[params.get('method')] += 1
+    r = get_session().post(settings.API_URL, 
+                           headers={'Content-Type': 'application/json'},
+                           # data=json.dumps(params), 
+                           json=params,
+                           files=file)
+    r.raise_for_status()
+    return r.json()
+
+
+PAGE_LIMIT = 1000  # maximum number of results FreezerPro returns in one call
+
+
+def freezerpro_retrieve(params, resultName, workers=None):
     """ 
     Wrapper for retrieving data from freezerpro where results could exceed hard limit of 1000 values
     Need to use limit and start parameters to make multiple calls
     :param params: dictionary of parameters
     :param resultName: key value that is returned from call (typically Total and one other key)
+    :param workers: number of pages to request at once (default retrieve_workers in config.ini, 1 is serial)
     :return: list of results
     """
-    params['limit'] = 1000
-    data = freezerpro_post(params)
-    results = data[resultName]
+    results = []
+    for page in iter_pages(params, resultName, workers):
+        results.extend(page)
+    return results
+
+
+def iter_retrieve(params, resultName, workers=None):
+    """ 
+    Generator version of freezerpro_retrieve, results are yielded one at a time as pages arrive
+    so only a few pages are held in memory at once
+    :param params: dictionary of parameters
+    :param resultName: key value that is returned from call (typically Total and one other key)
+    :param workers: number of pages to request at once (default retrieve_workers in config.ini, 1 is serial)
+    :return: iterator of results
+    """
+    for page in iter_pages(params, resultName, workers):
+        yield from page
+
+
+def iter_pages(params, resultName, workers=None):
+    """ 
+    Yield pages (lists of up to 1000 results) in order
+    The first call establishes Total, remaining pages are then requested concurrently by up to workers threads
+    (no more than workers pages are requested ahead of the page being yielded)
+    Stops at the first empty page and prints a message if fewer than Total results were returned
+    :param params: dictionary of parameters
+    :param resultName: key value that is returned from call (typically Total and one other key)
+    :param workers: number of pages to request at once (default retrieve_workers in config.ini, 1 is serial)
+    :return: iterator of lists of results
+    """
+    params = dict(params)
+    params['limit'] = PAGE_LIMIT
+    params['dir'] = 'ASC'
+    data = freezerpro_post(dict(params))
+    page = data[resultName]
     total = data['Total']
-    while len(results) < total:
-        params['start'] = len(results)
-        params['dir'] = 'ASC'
-        more = freezerpro_post(params)
-        if (len(more[resultName]) == 0):
-            print('freezerpro_retrieve: All results not returned Total={} Returned={}'.format(total, len(results)))
-            break
-        results.extend(more[resultName])
-    return results    
+    del data
+    returned = len(page)
+    page_size = returned or PAGE_LIMIT
+    yield page
+    page = None
+    starts = iter(range(returned, total, page_size))
+    workers = workers or settings.RETRIEVE_WORKERS
+    if returned >= total:
+        return
+    elif workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque(executor.submit(_retrieve_page, params, resultName, start) 
+                            for start in islice(starts, workers))
+            while pending:
+                page = pending.popleft().result()
+                if len(page) == 0:
+                    for future in pending:
+                        future.cancel()
+                    break
+                start = next(starts, None)
+                if start is not None:
+                    pending.append(executor.submit(_retrieve_page, params, resultName, start))
+                returned += len(page)
+                yield page
+                page = None
+    else:
+        for start in starts:
+            page = _retrieve_page(params, resultName, start)
+            if len(page) == 0:
+                break
+            returned += len(page)
+            yield page
+            page = None
+    if returned < total:
+        print('freezerpro_retrieve: All results not returned method={} Total={} Returned={}'.format(params.get('method'), total, returned))
+
+
+def _retrieve_page(params, resultName, start):
+    page_params = dict(params)
+    page_params['start'] = start
+    return freezerpro_post(page_params)[resultName]
+
+
+JOB_FAILED = 1
+JOB_RUNNING = 3
+JOB_STATUS_NAME = {JOB_FAILED: 'failed', 2: 'completed', JOB_RUNNING: 'running'}
+JOB_TIMED_OUT = 'timed out'
+JOB_POLL_FIRST = 0.25  # seconds before first get_job_status
+JOB_POLL_GROWTH = 1.5  # poll interval is multiplied by this after every get_job_status while job is running
+
+
+class JobManager:
+    """ Submit FreezerPro background jobs and wait for them together
+    jobs = JobManager()
+    jobs.submit({'method': 'update_samples', 'json': ...}, 'update_samples')
+    jobs.submit(...)
+    jobs.wait()  # returns when every job has finished, failed or timed out
+    Each job is polled with get_job_status, first after JOB_POLL_FIRST seconds then at intervals growing by
+    JOB_POLL_GROWTH up to poll_max seconds, so short jobs return quickly and long jobs are not polled every second.
+    :param timeout: seconds a job may run before it is reported as timed out (default job_timeout in config.ini)
+    :param poll_max: maximum seconds between get_job_status of a job (default job_poll_max in config.ini)
+    """
+
+    def __init__(self, timeout=None, poll_max=None):
+        self.timeout = timeout or settings.JOB_TIMEOUT
+        self.poll_max = poll_max or settings.JOB_POLL_MAX
+        self.jobs = []
+
+    def submit(self, params, name=None, timeout=None):
+        """ Start background job
+        :param params: parameters of api call (background_job is added)
+        :param name: name used in reports (default method)
+        :param timeout: seconds job may run (default timeout of JobManager)
+        :return: job (dictionary of job_id, name, status, msg, seconds), updated by wait
+        """
+        params = dict(params)
+        params['background_job'] = 'true'
+        response = freezerpro_post(params)
+        now = time.time()
+        job = {'job_id': response['job_id'],
+               'name': name or params.get('method'),
+               'status': JOB_RUNNING,
+               'msg': '',
+               'seconds': None,
+               'submitted': now,
+               'deadline': now + (timeout or self.timeout),
+               'interval': JOB_POLL_FIRST,
+               'next_poll': now + JOB_POLL_FIRST}
+        self.jobs.append(job)
+        return job
+
+    def pending(self):
+        return [job for job in self.jobs if job['status'] == JOB_RUNNING]
+
+    def poll(self, job):
+        """ get_job_status of job, and schedule next poll if still running """
+        response = freezerpro_post({'method': 'get_job_status', 'job_id': job['job_id']})
+        now = time.time()
+        if response['status'] != JOB_RUNNING:
+            job['status'] = response['status']
+            job['msg'] = response.get('msg', '')
+            job['seconds'] = now - job['submitted']
+            print('Job {} {} {} in {:.1f}s'.format(job['name'], job['job_id'], self.status_name(job), job['seconds']))
+        elif now >= job['deadline']:
+            job['status'] = JOB_TIMED_OUT
+            job['msg'] = 'Job did not complete within {:.1f}s'.format(job['deadline'] - job['submitted'])
+            job['seconds'] = now - job['submitted']
+            print('Job {} {} {} after {:.1f}s'.format(job['name'], job['job_id'], self.status_name(job), job['seconds']))
+        else:
+            job['interval'] = min(job['interval'] * JOB_POLL_GROWTH, self.poll_max)
+            job['next_poll'] = min(now + job['interval'], job['deadline'])
+
+    def wait(self, max_running=0):
+        """ Poll jobs until no more than max_running are running
+        :param max_running: 0 waits for all jobs, n - 1 (when n jobs are running) returns as soon as one finishes
+        :return: list of jobs that finished while waiting
+        """
+        finished = []
+        while True:
+            pending = self.pending()
+            if len(pending) <= max_running:
+                return finished
+            job = min(pending, key=lambda job: job['next_poll'])
+            delay = job['next_poll'] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.poll(job)
+            if job['status'] != JOB_RUNNING:
+                finished.append(job)
+
+    @staticmethod
+    def status_name(job):
+        return JOB_STATUS_NAME.get(job['status'], job['status'])
+
+    def failures(self):
+        """ :return: jobs that failed or timed out """
+        return [job for job in self.jobs if job['status'] in (JOB_FAILED, JOB_TIMED_OUT)]
+
+    def report(self):
+        """ :return: text of name, job id, final status and duration of each job """
+        return '\n'.join('{} {}: {} {}'.format(job['name'], job['job_id'], self.status_name(job),
+                                               '{:.1f}s'.format(job['seconds']) if job['seconds'] is not None else '')
+                         + (' - {}'.format(job['msg']) if job['msg'] else '')
+                         for job in self.jobs)
+
+
+def run_job(params, name=None):
+    """ Run background job and wait for it to complete
+    :param params: parameters of api call (background_job is added)
+    :return: job_id
+    raises RuntimeError if job fails or times out
+    """
+    jobs = JobManager()
+    job = jobs.submit(params, name)
+    jobs.wait()
+    if job['status'] in (JOB_FAILED, JOB_TIMED_OUT):
+        raise RuntimeError(job['msg'] or 'Job {} {}'.format(job['job_id'], jobs.status_name(job)))
+    return job['job_id']
+
+
+class RunCache:
+    """ Memoization of get_sample, get_vials, get_sample_userfields and get_location for the duration of a run
+    with RunCache() as cache:
+        ...  # repeated lookups of the same id are served from cache
+        print(cache.stats())
+    Least recently used entries are evicted once maxsize entries are held (run_cache_size in config.ini).
+    Entries for a sample are discarded by invalidate_samples (called by update_samples).
+    Cached results are shared, so treat them as read-only.
+    """
+    SAMPLE_LOOKUPS = ('get_sample', 'get_vials', 'get_sample_userfields')
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or settings.RUN_CACHE_SIZE
+        self.entries = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.lock = threading.Lock()
+        self.previous = None
+
+    def __enter__(self):
+        global run_cache
+        self.previous = run_cache
+        run_cache = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global run_cache
+        run_cache = self.previous
+        self.previous = None
+
+    def lookup(self, name, object_id):
+        """ :return: (True, cached result) or (False, None) if not cached
+        """
+        key = (name, str(object_id))
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits[name] += 1
+                return True, self.entries[key]
+            self.misses[name] += 1
+            return False, None
+
+    def store(self, name, object_id, result):
+        with self.lock:
+            self.entries[(name, str(object_id))] = result
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate_samples(self, sample_ids):
+        ids = set(str(sample_id) for sample_id in sample_ids)
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in self.SAMPLE_LOOKUPS and key[1] in ids]:
+                del self.entries[key]
+
+    def stats(self):
+        return ', '.join('{} hits={} misses={}'.format(name, self.hits[name], self.misses[name])
+                         for name in sorted(set(self.hits) | set(self.misses)))
+
+
+run_cache = None
+
+
+def run_cached(func):
+    """ Decorator: use active RunCache (if any) for func(object_id)
+    """
+    @functools.wraps(func)
+    def wrapper(object_id):
+        cache = run_cache
+        if cache is None:
+            return func(object_id)
+        found, result = cache.lookup(func.__name__, object_id)
+        if not found:
+            result = func(object_id)
+            cache.store(func.__name__, object_id, result)
+        return result
+    return wrapper
+
+
+def invalidate_samples(sample_ids):
+    """ Discard cached lookups of samples that have been changed
+    """
+    if run_cache is not None:
+        run_cache.invalidate_samples(sample_ids)
 
 
 def get_users():
-    data = freezerpro_post({'method': 'users'})
-    users = data['Users']
-    if data['Total'] != len(users):
-        raise RuntimeError('get_users: not all users retrieved')
+    users = freezerpro_retrieve({'method': 'users'}, 'Users')
     return users
 
 
+class UserDirectory:
+    """ FreezerPro users indexed by id, username and fullname, with user_groups membership
+    Users are retrieved once (all pages) when created, groups when first needed.
+    Where users share a username or fullname the first user returned is used (as for a linear search).
+    """
+
+    def __init__(self):
+        self.users = get_users()
+        self.by_id = {}
+        self.by_username = {}
+        self.by_fullname = {}
+        for user in self.users:
+            self.by_id.setdefault(user['id'], user)
+            self.by_username.setdefault(user['username'], user)
+            self.by_fullname.setdefault(user['fullname'], user)
+        self.loaded_at = time.time()
+        self._group_userids = None
+
+    def group_userids(self, group_name):
+        """
+        :param group_name: name of a existing FreezerPro user_group
+        :return: list of user_ids
+        """
+        if self._group_userids is None:
+            data = freezerpro_post({'method': 'user_groups'})
+            self._group_userids = {group['name']: [group_user['id'] for group_user in group['users']] 
+                                   for group in reversed(data['Groups'])}
+        if group_name not in self._group_userids:
+            raise RuntimeError('No such user_group {}'.format(group_name))
+        return self._group_userids[group_name]
+
+    def users_by_group(self, group_name):
+        return [self.by_id.get(userid) for userid in self.group_userids(group_name)]
+
+
+user_directory = None
+user_directory_lock = threading.Lock()
+
+
+def get_user_directory(refresh=False):
+    """
+    Shared UserDirectory, reloaded when older than user_directory_ttl seconds (config.ini) or refresh is True
+    :return: UserDirectory
+    """
+    global user_directory
+    with user_directory_lock:
+        if refresh or user_directory is None or time.time() - user_directory.loaded_at > settings.USER_DIRECTORY_TTL:
+            user_directory = UserDirectory()
+        return user_directory
+
+
+@run_cached
 def get_sample(sample_id):
     """
     'name':
@@ -244,12 +832,87 @@ def get_sample(sample_id):
     return sample
 
 
+@run_cached
 def get_sample_userfields(sample_id):
     udfs = freezerpro_post({'method': 'sample_userfields',
                             'id': sample_id})
     return udfs
 
 
+# advanced_search system field names for sample_info keys (where different)
+SEARCH_SDFS = {'owner': 'owner_username',
+              }
+
+
+def get_samples_bulk(sample_ids, sdfs=[], udfs=[], fallback=True):
+    """
+    Get system fields and udfs of many samples using a few paginated advanced_search calls
+    (sample ids are deduplicated and searched BULK_SEARCH_IDS at a time) instead of a get_sample call per sample
+    Only samples that were asked for and returned with every sdf are used from the search. The others (e.g. if the server
+    did not search by the list of ids, or did not return a field) are retrieved with get_sample and get_sample_userfields,
+    so a sample is never returned with fields missing.
+    :param sample_ids: iterable of sample ids (duplicates allowed)
+    :param sdfs: list of sample_info keys to return e.g. ['owner', 'sample_type']
+    :param udfs: list of udfs to return e.g. ['Approval Contact'] (None if sample does not have udf)
+    :param fallback: False to leave out samples not returned by the search instead of retrieving them one at a time
+    :return: dictionary of str(sample_id): {sdf/udf: value}
+    """
+    ids = sorted(set(str(sample_id) for sample_id in sample_ids if sample_id is not None))
+    search_sdfs = [SEARCH_SDFS.get(sdf, sdf) for sdf in sdfs]
+    samples = {}
+    for i in range(0, len(ids), settings.BULK_SEARCH_IDS):
+        chunk = ids[i:i + settings.BULK_SEARCH_IDS]
+        found = freezerpro_retrieve({'method': 'advanced_search',
+                                     'query': [{'type': 'sdf',
+                                                'field': 'id',
+                                                'op': 'eq',
+                                                'value': chunk
+                                               },
+                                              ],
+                                     'sdfs': ['id'] + search_sdfs,
+                                     'udfs': list(udfs),
+                                    },
+                                    'Samples')
+        chunk = set(chunk)
+        for sample in found:
+            if str(sample.get('id')) not in chunk or any(sdf not in sample for sdf in search_sdfs):
+                continue
+            fields = {sdf: sample[search_sdf] for sdf, search_sdf in zip(sdfs, search_sdfs)}
+            sample_udfs = sample.get('udfs') or {}
+            fields.update({udf: sample_udfs.get(udf) for udf in udfs})
+            samples[str(sample['id'])] = fields
+    missing = [sample_id for sample_id in ids if sample_id not in samples]
+    if missing and fallback:
+        print('get_samples_bulk: {} of {} samples not returned by advanced_search, retrieving them one at a time'
+              .format(len(missing), len(ids)))
+        from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+        infos = fetch_many('get_sample', missing) if sdfs else [{}] * len(missing)
+        userfields = fetch_many('get_sample_userfields', missing) if udfs else [{}] * len(missing)
+        for sample_id, info, sample_udfs in zip(missing, infos, userfields):
+            fields = {sdf: info.get(sdf) for sdf in sdfs}
+            fields.update({udf: sample_udfs.get(udf) for udf in udfs})
+            samples[sample_id] = fields
+    return samples
+
+
+def hydrate_samples(rows, sdfs=[], udfs=[], key='sample_id'):
+    """
+    Add sample system fields and udfs to each row (e.g. locations or state changes) using get_samples_bulk
+    (raises RuntimeError if a sample cannot be retrieved, rather than adding None fields)
+    :param rows: list of dictionaries containing sample id in key
+    :param sdfs: list of sample_info keys to add e.g. ['owner', 'sample_type']
+    :param udfs: list of udfs to add (set to None if not present)
+    :param key: dictionary key holding sample id
+    :return: rows
+    """
+    samples = get_samples_bulk([row[key] for row in rows], sdfs, udfs)
+    no_sample = dict.fromkeys(list(sdfs) + list(udfs))
+    for row in rows:
+        row.update(samples[str(row[key])] if row[key] is not None else no_sample)
+    return rows
+
+
+@run_cached
 def get_location(location_id):
     location = freezerpro_post({'method': 'location_info',
                             'id': location_id,
@@ -257,6 +920,7 @@ def get_location(location_id):
     return location
 
 
+@run_cached
 def get_vials(sample_id):
     vials = freezerpro_retrieve({'method': 'vials_sample',
                                  'sample_id': sample_id,
@@ -265,6 +929,96 @@ def get_vials(sample_id):
     return vials
 
 
+def get_vials_bulk(sample_ids, threshold=None):
+    """
+    States of the vials of many samples, the same as get_vials for each sample but with fewer api calls
+    When it takes fewer calls (see vials_by_state) the vials in each of Vial_States are retrieved (paginated vials_sample 
+    calls per state, requested concurrently) and grouped by sample. Samples with more vials (locations_count from 
+    get_samples_bulk) than were found in Vial_States, i.e. vials without a state or in a state not in Vial_States, 
+    and all samples when there are too few samples to retrieve by state, are retrieved with get_vials (concurrently).
+    :param sample_ids: iterable of sample ids
+    :param threshold: see vials_by_state
+    :return: dictionary of sample_id: list of vial state_info (None or '' if vial does not have a state)
+    """
+    sample_ids = list(dict.fromkeys(sample_ids))
+    vial_states = {}
+    by_sample = sample_ids
+    if vials_by_state(len(sample_ids), threshold):
+        vial_states_by_sample = get_vial_states_by_sample()
+        samples = get_samples_bulk(sample_ids, ['locations_count'], fallback=False)
+        by_sample = []
+        for sample_id in sample_ids:
+            states = vial_states_by_sample.get(str(sample_id), [])
+            # samples not returned by the search (vial count unknown) are retrieved with get_vials
+            locations_count = (samples.get(str(sample_id)) or {}).get('locations_count')
+            if locations_count is None or len(states) < int(locations_count):
+                by_sample.append(sample_id)
+            else:
+                vial_states[sample_id] = states
+    from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+    for sample_id, vials in zip(by_sample, fetch_many('get_vials', by_sample)):
+        vial_states[sample_id] = [vial.get('state_info') for vial in vials]
+    return {sample_id: vial_states[sample_id] for sample_id in sample_ids}
+
+
+def vials_by_state(sample_count, threshold=None):
+    """
+    Whether get_vials_bulk retrieves the vials of sample_count samples by state
+    That is when the vials of all Vial_States are already held by the active RunCache, or there are more samples than
+    pages of vials in Vial_States (the size of the inventory, see get_vial_state_pages) plus pages of get_samples_bulk.
+    The inventory is only checked from threshold samples.
+    :param threshold: default vials_bulk_threshold in config.ini
+    :return: True if vials are retrieved by state, False if by sample
+    """
+    threshold = threshold if threshold is not None else settings.VIALS_BULK_THRESHOLD
+    if sample_count < threshold:
+        return False
+    if run_cache is not None and run_cache.lookup('vial_states_by_sample', '')[0]:
+        return True
+    return sample_count > get_vial_state_pages() + -(-sample_count // settings.BULK_SEARCH_IDS)
+
+
+def get_vial_state_pages():
+    """
+    Number of vials_sample calls needed to retrieve the vials in all Vial_States 
+    (the Total of each state is requested with one call per state, concurrently)
+    Held by the active RunCache (if any) for the rest of the run
+    :return: number of pages
+    """
+    cache = run_cache
+    if cache is not None:
+        found, pages = cache.lookup('vial_state_pages', '')
+        if found:
+            return pages
+    from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+    totals = [data['Total'] for data in fetch_many('post', [{'method': 'vials_sample', 'vial_state_type_id': state.value, 'limit': 1}
+                                                            for state in Vial_States])]
+    pages = sum(max(1, -(-int(total) // PAGE_LIMIT)) for total in totals)
+    if cache is not None:
+        cache.store('vial_state_pages', '', pages)
+    return pages
+
+
+def get_vial_states_by_sample():
+    """
+    State of every vial in one of Vial_States, retrieved by state (see get_vials_bulk)
+    Held by the active RunCache (if any) for the rest of the run
+    :return: dictionary of str(sample_id): list of state_info
+    """
+    cache = run_cache
+    if cache is not None:
+        found, vial_states_by_sample = cache.lookup('vial_states_by_sample', '')
+        if found:
+            return vial_states_by_sample
+    vial_states_by_sample = {}
+    for state, locations in zip(Vial_States, get_locations_in_states(Vial_States)):
+        for location in locations:
+            vial_states_by_sample.setdefault(str(location['sample_id']), []).append(location.get('state_info') or STATE_NAME.get(state))
+    if cache is not None:
+        cache.store('vial_states_by_sample', '', vial_states_by_sample)
+    return vial_states_by_sample
+
+
 def get_sampletypes():
     sampletypes = freezerpro_retrieve({'method': 'sample_types'}, 'SampleTypes')
     for sampletype in sampletypes:
@@ -273,25 +1027,19 @@ def get_sampletypes():
 
 
 def get_audit(date_flag):
-    data = freezerpro_post({'method': 'audit',
-                            'date_flag': date_flag,
-                            'dir': 'ASC',
-                            'limit': 1000,  #1000 is maximum that can be returned
-                            })
-    audits = data['AuditRec']
-    total = data['Total']
-    while len(audits) < total:
-        more = freezerpro_post({'method': 'audit',
-                            'date_flag': date_flag,
-                            'limit': 1000,  #1000 is maximum that can be returned
-                            'start': len(audits),
-                            'dir': 'ASC',
-                            })
-        if (len(more['AuditRec']) == 0):
-            print('get_audit: All audits not returned Total={} Returned={}'.format(total, len(audits)))
-            break
-        audits.extend(more['AuditRec'])
-    return audits
+    return list(iter_audit(date_flag))
+
+
+def iter_audit(date_flag):
+    """
+    Generator version of get_audit (audits are yielded as each page is returned)
+    :param date_flag: all/today/yesterday/week/month/'date_from,date_to'
+    :return: iterator of audit records
+    """
+    return iter_retrieve({'method': 'audit',
+                          'date_flag': date_flag,
+                         },
+                         'AuditRec')
 
 
 def get_locations_in_state(state, sdfs=[]):
@@ -301,35 +1049,35 @@ def get_locations_in_state(state, sdfs=[]):
     :param sdfs: optional list of udfs that will be appended to locations (set to None if not present)
     :return: list of locations
     """
-    data = freezerpro_post({'method': 'vials_sample',
-                            'vial_state_type_id': state,
-                            'dir': 'ASC',
-                            'limit':1000,
-                           })
-    # print(json.dumps(data, indent=4, sort_keys=True))
-    locations = data['Locations']
-    total = data['Total']
-    while len(locations) < total:
-        more = freezerpro_post({'method': 'vials_sample',
-                                'vial_state_type_id': state,
-                                'limit':1000,
-                                'start':len(locations),
-                                'dir': 'ASC'})
-        if len(more['Locations']) == 0:
-            print('get_audit: All locations not returned Total={} Returned={}'.format(total, len(locations)))
-            break
-        locations.extend(more['Locations'])
-    # print('Locations =', data['Total'])    
-    if sdfs:
-        for location in locations:
-            udfs = freezerpro_post({'method': 'sample_userfields',
-                                    'id': location['sample_id']})
-            for udf in sdfs:
-                if udf in udfs:
-                    location[udf] = udfs[udf]
-                else:
-                    location[udf] = None    
-    return locations
+    return list(iter_locations_in_state(state, sdfs))
+
+
+def iter_locations_in_state(state, sdfs=[]):
+    """
+    Generator version of get_locations_in_state (locations are yielded as each page is returned)
+    :param state: vial_state_type_id
+    :param sdfs: optional list of udfs that will be appended to locations (set to None if not present)
+    :return: iterator of locations
+    """
+    pages = iter_pages({'method': 'vials_sample',
+                        'vial_state_type_id': state,
+                       },
+                       'Locations')
+    for locations in pages:
+        if sdfs:
+            hydrate_samples(locations, udfs=sdfs)
+        yield from locations
+
+
+def get_locations_in_states(states):
+    """
+    get_locations_in_state for several states, requested concurrently (see AsyncFreezerPro)
+    so the time taken is that of the slowest state rather than the sum of all of them
+    :param states: iterable of Vial_States
+    :return: list of lists of locations, in order of states
+    """
+    from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+    return fetch_many('get_locations_in_state', [state.value for state in states])
 
 
 def get_group_userids(group_name):
@@ -338,91 +1086,234 @@ def get_group_userids(group_name):
     :param group_name: name of a existing FreezerPro user_group
     :return: list of user_ids
     """
-    data = freezerpro_post({'method': 'user_groups'})
-    groups = data['Groups']
-    # print('Groups: ', [group['name'] for group in groups])
-    # print()
-    group = next((group for group in groups if group['name'] == group_name), None)
-    if not group:
-        raise RuntimeError('No such user_group {}'.format(group_name))
-    users = group['users']
-    ids = [group_user['id'] for group_user in users]
-    return ids
+    return get_user_directory().group_userids(group_name)
 
 
 def get_users_by_group(group_name):
-    userids = get_group_userids(group_name)
-    users = get_users_by_id(userids)
-    return users
+    return get_user_directory().users_by_group(group_name)
 
 
 def get_users_by_fullname(usernames):
-    allusers = get_users()
-    users = [next((u for u in allusers if u['fullname'] == user_name), None) for user_name in usernames]
+    by_fullname = get_user_directory().by_fullname
+    users = [by_fullname.get(user_name) for user_name in usernames]
     return users
 
 
 def get_users_by_username(usernames):
-    allusers = get_users()
-    users = [next((u for u in allusers if u['username'] == user_name), None) for user_name in usernames]
+    by_username = get_user_directory().by_username
+    users = [by_username.get(user_name) for user_name in usernames]
     return users
 
 
 def get_users_by_id(userids):
-    allusers = get_users()
-    users = [next((u for u in allusers if u['id'] == userid), None) for userid in userids]
+    by_id = get_user_directory().by_id
+    users = [by_id.get(userid) for userid in userids]
     return users
 
 
 def dict_to_html(data, keys, headers):
     """ Create html table from list of dictionaries
+    Same layout as pandas DataFrame.to_html(escape=False, index=False), rows are rendered one at a time
     :param data: list of dictionaries
     :param keys: list of dictionary keys to use in presentation order
     :param header: list of strings to use for column headers (must match keys)
-    return: html text for populated table
+    return: html text for populated table (missing keys and None are shown as empty cells, values are not escaped)
+    """
+    return ''.join(iter_html_table(data, keys, headers))
+
+
+def iter_html_table(data, keys, headers):
+    """ Generator version of dict_to_html, yields html a row at a time """
+    yield '<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n'
+    for header in headers:
+        yield '      <th>{}</th>\n'.format(header)
+    yield '    </tr>\n  </thead>\n  <tbody>\n'
+    for row in data:
+        yield '    <tr>\n'
+        for key in keys:
+            value = row.get(key)
+            yield '      <td>{}</td>\n'.format('' if value is None else value)
+        yield '    </tr>\n'
+    yield '  </tbody>\n</table>'
+
+
+def group_rows(rows, recipient_key, sort_key=None):
+    """ Partition rows by recipient in one pass
+    :param rows: list of dictionaries
+    :param recipient_key: dictionary key identifying recipient of row e.g. 'owner_id'
+    :param sort_key: function to sort rows (rows are sorted once, before partitioning), None to keep order of rows
+    :return: OrderedDict of recipient: list of rows of recipient (in order of first row of each recipient)
+    """
+    if sort_key:
+        rows = sorted(rows, key=sort_key)
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(row[recipient_key], []).append(row)
+    return groups
+
+
+def compose_tables(rows, recipient_key, keys, headers, sort_key=None):
+    """ Html table (see dict_to_html) of the rows of each recipient
+        tables = compose_tables(samples, 'owner_id', ['id', 'location'], ['Sample Id', 'Location'])
+        for user in get_users_by_id(tables):
+            send_html(user['fullname'], [user['email']], subject, tables[user['id']])
+    :param recipient_key, sort_key: see group_rows
+    :return: OrderedDict of recipient: html table
+    """
+    return OrderedDict((recipient, dict_to_html(group, keys, headers))
+                       for recipient, group in group_rows(rows, recipient_key, sort_key).items())
+
+
+class MailDispatcher:
+    """ Send emails over persistent SMTP connections instead of one connection per email
+    with MailDispatcher():  # send and send_html use the dispatcher while it is active
+        for user in users:
+            send_html(...)
+    Connections are opened when first needed and reused; a connection that has been dropped by the server is reopened 
+    and the email sent again. Up to `connections` threads can send at once.
+    :param server: SMTP server (default smtpserver in config.ini)
+    :param port: SMTP port (default smtpport in config.ini)
+    :param connections: maximum number of SMTP connections (default smtp_connections in config.ini)
     """
-    pd.set_option('display.max_colwidth',999)
-    df = pd.DataFrame(data)[keys]
-    df.columns = headers
-    html = df.to_html(escape=False, index=False)
-    return html
 
+    def __init__(self, server=None, port=None, connections=None):
+        self.server = server or settings.SMTPServer
+        self.port = int(port or settings.SMTPPort)
+        self.connections = connections or settings.SMTP_CONNECTIONS
+        self.idle = []
+        self.semaphore = threading.BoundedSemaphore(self.connections)
+        self.lock = threading.Lock()
+        self.previous = None
+        self.sent = 0
+        self.opened = 0
+
+    @classmethod
+    def active(cls):
+        """ Context manager for the active dispatcher if there is one (e.g. held by Scheduler.py for several jobs), 
+        else for a new dispatcher
+        with MailDispatcher.active():
+            send_html(...)
+        """
+        return contextlib.nullcontext(mail_dispatcher) if mail_dispatcher else cls()
+
+    def __enter__(self):
+        global mail_dispatcher
+        self.previous = mail_dispatcher
+        mail_dispatcher = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global mail_dispatcher
+        mail_dispatcher = self.previous
+        self.close()
+
+    def connect(self):
+        import smtplib
+        connection = smtplib.SMTP(self.server, self.port)
+        with self.lock:
+            self.opened += 1
+        return connection
+
+    def close(self):
+        """ Quit all idle connections """
+        import smtplib
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """ smtplib.SMTP.sendmail over a pooled connection (sent again on a new connection if connection was dropped) """
+        import smtplib
+        with self.semaphore:
+            with self.lock:
+                connection = self.idle.pop() if self.idle else None
+            try:
+                if connection is None:
+                    connection = self.connect()
+                try:
+                    connection.sendmail(from_addr, to_addrs, msg)
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # e.g. server closed idle connection
+                    connection.close()
+                    connection = None
+                    connection = self.connect()
+                    connection.sendmail(from_addr, to_addrs, msg)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException):
+                # message refused by server, connection can still be used
+                self._release(connection)
+                raise
+            except Exception:
+                if connection is not None:
+                    connection.close()
+                raise
+            with self.lock:
+                self.idle.append(connection)
+                self.sent += 1
+
+    def _release(self, connection):
+        if connection is not None:
+            with self.lock:
+                self.idle.append(connection)
+
+    def stats(self):
+        return {'sent': self.sent, 'connections opened': self.opened}
+
+
+mail_dispatcher = None
+
+
+def deliver(from_addr, email_addresses, msg_full):
+    """ Send message to email_addresses (or only support when email_support_only, and also support when email_support_also)
+    When outbox_dir is set in config.ini the message is written to the outbox and sent later by MailOutbox.py,
+    otherwise it is sent with the active MailDispatcher (or a connection opened for this message)
+    """
+    if settings.EMAIL_SUPPORT_ONLY:
+        email_addresses = [settings.SUPPORT_EMAIL]
+    recipients = [(from_addr, email_addresses)]
+    if settings.EMAIL_SUPPORT_ALSO and not settings.EMAIL_SUPPORT_ONLY:
+        recipients.append(('donotreply@scionresearch.com', [settings.SUPPORT_EMAIL]))
+    if settings.OUTBOX_DIR:
+        from MailOutbox import MailOutbox  # imported here as MailOutbox imports this module
+        outbox = MailOutbox()
+        for from_addr, email_addresses in recipients:
+            outbox.enqueue(from_addr, email_addresses, msg_full)
+        return
+    dispatcher = mail_dispatcher or MailDispatcher()
+    try:
+        for from_addr, email_addresses in recipients:
+            dispatcher.sendmail(from_addr, email_addresses, msg_full)
+    finally:
+        if dispatcher is not mail_dispatcher:
+            dispatcher.close()
 
-def send_html(to, email_addresses, subject, msg):
-    s = smtplib.SMTP(SMTPServer, SMTPPort)
 
+def send_html(to, email_addresses, subject, msg):
+    from email.mime.text import MIMEText
     message = MIMEText(msg, 'html', 'utf-8')
 
-    message['From'] = SEND_EMAIL_FROM
+    message['From'] = settings.SEND_EMAIL_FROM
     message['To'] = to
     message['Subject'] = subject
 
     msg_full = message.as_string()
-    if EMAIL_SUPPORT_ONLY:
-        email_addresses = [SUPPORT_EMAIL]
-    s.sendmail('donotreply@scionresearch.com', email_addresses, msg_full)
-    if EMAIL_SUPPORT_ALSO and not EMAIL_SUPPORT_ONLY:
-        s.sendmail('donotreply@scionresearch.com', [SUPPORT_EMAIL], msg_full)
-    s.quit()
+    deliver('donotreply@scionresearch.com', email_addresses, msg_full)
 
 
 def send(to, email_addresses, subject, msg):
-    s = smtplib.SMTP(SMTPServer, SMTPPort)
-
+    from email.mime.text import MIMEText
     if isinstance(msg, Exception):
         msg = str(msg) +'\n\n' + ''.join(traceback.format_exception(type(msg), msg, msg.__traceback__))
     message = MIMEText(msg, 'plain')
-    message['From'] = SEND_EMAIL_FROM
+    message['From'] = settings.SEND_EMAIL_FROM
     message['To'] = to
     message['Subject'] = subject
 
     msg_full = message.as_string()
-    if EMAIL_SUPPORT_ONLY:
-        email_addresses = [SUPPORT_EMAIL]
-    s.sendmail('<donotreply@scionresearch.com>', email_addresses, msg_full)
-    if EMAIL_SUPPORT_ALSO and not EMAIL_SUPPORT_ONLY:
-        s.sendmail('donotreply@scionresearch.com', [SUPPORT_EMAIL], msg_full)
-    s.quit()
+    deliver('<donotreply@scionresearch.com>', email_addresses, msg_full)
 
 
 def email_group(group_to_email, subject, msg):
@@ -437,19 +1328,19 @@ def email_group(group_to_email, subject, msg):
 
 def email_OperationsOfficer(subject, msg):
     # email_group('Operations Officer', subject, msg)
-    send_html('Operation Officer', [OPERATION_OFFICER_EMAIL], subject, msg)
+    send_html('Operation Officer', [settings.OPERATION_OFFICER_EMAIL], subject, msg)
 
 
 def email_Veritec(subject, msg):
-    send_html('Veritec', [VERITEC_EMAIL], subject, msg)
+    send_html('Veritec', [settings.VERITEC_EMAIL], subject, msg)
 
 
 def email_MediaRequests(subject, msg):
-    send_html('Tree Propagation', [MEDIA_EMAIL], subject, msg)
+    send_html('Tree Propagation', [settings.MEDIA_EMAIL], subject, msg)
 
 
 def email_Support(subject, msg):
-    send('SamplePro Support', [SUPPORT_EMAIL], subject, msg )
+    send('SamplePro Support', [settings.SUPPORT_EMAIL], subject, msg )
 
 
 def samples_with_state_changes(date_flag, states=None):
@@ -459,37 +1350,96 @@ def samples_with_state_changes(date_flag, states=None):
      ("Store Request", "Retrieve Request", "Dispose Request", "Approval Requested", "Stored", 
       "Retrieved", "With Owner", "Disposed", "Return to Source", "Store Request Approved", "Awaiting Delivery")
     """
-    audits = get_audit(date_flag)
-    #for audit in audits:
-    #    print(audit)
+    return list(iter_samples_with_state_changes(date_flag, states))
+
+
+def iter_samples_with_state_changes(date_flag, states=None, unmatched=None):
+    """ Generator version of samples_with_state_changes
+    Audits are parsed a page at a time so that the full audit list is never held in memory
+    :param unmatched: optional list, audits with a state change message that could not be parsed are appended
+    """
     #obj_names = set([audit['obj_name'] for audit in audits])
     #print(obj_names)
     # states = ['Store Request', 'Retrieve Request', 'Dispose Request']
-    # mm = [audit for audit in audits if audit['obj_name'] in states]
     if not states:
         states = STATE_NAME.values()
-    state_changes = [{'type': audit['obj_name'], 
-                        'date': audit['created_at'],
-                        'user_name': audit['user_name'],
-                        'message': audit['message'],  
-                        'comments': audit['comments']} 
-                        for audit in audits if audit['obj_name'] in states]
-    #extract sample_id from message and add as distinct key
-    for m in state_changes:
-        pattern = 'State for vial <u>"(.*?)"<\/u>(?:.*?) ID: <u>(\d+)<\/u> changed from "(.*?)" to "(.*?)"'
-        # pattern = 'State for vial <u>"(.*?)"<\/u>(?:.*?) ID: <u>(\d+)<\/u>(?:.*)'
-        match = re.match(pattern, m['message'])
-        m['vial_location'] = match.groups()[0]
-        m['sample_id'] = match.groups()[1]
-        m['from_state'] = match.groups()[2]
-        m['to_state'] = match.groups()[3]
-        # print(m['date'], m['type'], 'for sample', m['sample_id'], 'by', m['user_name'])
-    return state_changes
+    states = set(states)
+    for audits in iter_pages({'method': 'audit', 'date_flag': date_flag}, 'AuditRec'):
+        (state_changes, page_unmatched) = parse_state_changes(audits, states)
+        if page_unmatched:
+            print('samples_with_state_changes: {} audit messages not recognised e.g. {}'.format(len(page_unmatched), 
+                                                                                                page_unmatched[0]['message']))
+            if unmatched is not None:
+                unmatched.extend(page_unmatched)
+        yield from state_changes
+
+
+def samples_with_state_changes_by_day(date_flags=('today', 'yesterday'), states=None):
+    """
+    samples_with_state_changes for each of date_flags, the audits of all periods are requested concurrently
+    (each period is requested with its own date_flag, so state changes are not split by parsing audit dates)
+    :param date_flags: iterable of date_flag e.g. ('today', 'yesterday')
+    :return: dictionary of date_flag: list of state changes in that period
+    """
+    from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+    date_flags = list(date_flags)
+    states = set(states or STATE_NAME.values())
+    state_changes_by_day = {}
+    for date_flag, audits in zip(date_flags, fetch_many('get_audit', date_flags)):
+        (state_changes, unmatched) = parse_state_changes(audits, states)
+        if unmatched:
+            print('samples_with_state_changes: {} audit messages not recognised e.g. {}'.format(len(unmatched), 
+                                                                                                unmatched[0]['message']))
+        state_changes_by_day[date_flag] = state_changes
+    return state_changes_by_day
+
+
+STATE_CHANGE_PATTERN = re.compile(r'State for vial <u>"(.*?)"<\/u>(?:.*?) ID: <u>(\d+)<\/u> changed from "(.*?)" to "(.*?)"')
+
+
+def parse_state_changes(audits, states=None):
+    """
+    Parse vial state change audits a page at a time
+    The precompiled pattern is mapped over all messages of the page at once, messages that do not match are returned 
+    rather than raising an error.
+    :param audits: list of audit records
+    :param states: optional iterable of states (audit obj_name) to keep, default all
+    :return: (state_changes, unmatched) list of state change dicts 
+             (type, audit_id, date, user_name, message, comments, vial_location, sample_id, from_state, to_state)
+             and list of audits in states whose message is not a vial state change
+    """
+    if states is not None:
+        states = set(states)
+        audits = [audit for audit in audits if audit['obj_name'] in states]
+    state_changes = []
+    unmatched = []
+    for audit, match in zip(audits, map(STATE_CHANGE_PATTERN.match, [audit['message'] or '' for audit in audits])):
+        if match is None:
+            unmatched.append(audit)
+            continue
+        (vial_location, sample_id, from_state, to_state) = match.groups()
+        state_changes.append({'type': audit['obj_name'],
+                              'audit_id': audit.get('id'),
+                              'date': audit['created_at'],
+                              'user_name': audit['user_name'],
+                              'message': audit['message'],
+                              'comments': audit['comments'],
+                              'vial_location': vial_location,
+                              'sample_id': sample_id,
+                              'from_state': from_state,
+                              'to_state': to_state})
+    return (state_changes, unmatched)
 
 
 def samples_nearing_reviewdate(days):
     """Will exclude samples that have been disposed, disposerequest, returned or returntosource
+    Answered from SampleMirror when mirror_file is set in config.ini
     """
+    if settings.MIRROR_FILE:
+        from SampleMirror import SampleMirror  # imported here as SampleMirror imports this module
+        with SampleMirror() as mirror:
+            mirror.ensure_fresh()
+            return mirror.samples_nearing_reviewdate(days)
     today = date.today()
     before_date = today + timedelta(days=days+1)
     after_date = today - timedelta(days=1)
@@ -511,20 +1461,19 @@ def samples_nearing_reviewdate(days):
     samples = data['Samples']
     if data['Total'] != len(samples):
         raise RuntimeError('Not all returned')
+    # sample records are requested concurrently, vial states in bulk
+    from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+    sample_ids = [sample['id'] for sample in samples]
+    sample_recs = dict(zip(sample_ids, fetch_many('get_sample', sample_ids)))
+    vial_states = get_vials_bulk(sample_ids)
     for sample in samples[:]:
         sample['Review Date'] = sample['udfs']['Review Date']
-        sample_rec = get_sample(sample['id'])
+        sample_rec = sample_recs[sample['id']]
         sample['location'] = sample_rec['location']  # add location result
         # exclude samples where all vials in state DisposeRequested, Disposed, Returned, or ReturnToSource
-        vials = get_vials(sample['id'])
         b_all_gone = True
-        for vial in vials:
-            if vial['state_info'] not in [STATE_NAME[Vial_States.Disposed], 
-                                      STATE_NAME[Vial_States.DisposeRequest],
-                                      STATE_NAME[Vial_States.Returned],
-                                      STATE_NAME[Vial_States.ReturnToSource],
-                                      STATE_NAME[Vial_States.SampleDestroyed],
-                                      STATE_NAME[Vial_States.SampleFinished]]:
+        for vial_state in vial_states[sample['id']]:
+            if vial_state not in [STATE_NAME[state] for state in VIAL_STATES_GONE]:
                 b_all_gone = False
                 break
         if b_all_gone:
@@ -534,7 +1483,13 @@ def samples_nearing_reviewdate(days):
 
 def samples_reviewdate_overdue():
     """Will exclude samples that have been disposed, disposerequest, returned or returntosource
+    Answered from SampleMirror when mirror_file is set in config.ini
     """
+    if settings.MIRROR_FILE:
+        from SampleMirror import SampleMirror  # imported here as SampleMirror imports this module
+        with SampleMirror() as mirror:
+            mirror.ensure_fresh()
+            return mirror.samples_reviewdate_overdue()
     today = date.today()
     data = freezerpro_post({'method': 'advanced_search',
                             'query': [{'type': 'udf',
@@ -549,21 +1504,20 @@ def samples_reviewdate_overdue():
     samples = data['Samples']
     if data['Total'] != len(samples):
         raise RuntimeError('Not all returned')
+    # sample records are requested concurrently, vial states in bulk
+    from AsyncFreezerPro import fetch_many  # imported here as AsyncFreezerPro imports this module
+    sample_ids = [sample['id'] for sample in samples]
+    sample_recs = dict(zip(sample_ids, fetch_many('get_sample', sample_ids)))
+    vial_states = get_vials_bulk(sample_ids)
     for sample in samples[:]:
         sample['Review Date'] = sample['udfs']['Review Date']
         sample['Approval Contact'] = sample['udfs']['Approval Contact']
-        sample_rec = get_sample(sample['id'])
+        sample_rec = sample_recs[sample['id']]
         sample['location'] = sample_rec['location']
         # exclude samples where all vials in state DisposeRequested, Disposed, Returned, or ReturnToSource
-        vials = get_vials(sample['id'])
         b_all_gone = True
-        for vial in vials:
-            if vial['state_info'] not in [STATE_NAME[Vial_States.Disposed], 
-                                      STATE_NAME[Vial_States.DisposeRequest],
-                                      STATE_NAME[Vial_States.Returned],
-                                      STATE_NAME[Vial_States.ReturnToSource],
-                                      STATE_NAME[Vial_States.SampleDestroyed],
-                                      STATE_NAME[Vial_States.SampleFinished]]:
+        for vial_state in vial_states[sample['id']]:
+            if vial_state not in [STATE_NAME[state] for state in VIAL_STATES_GONE]:
                 b_all_gone = False
                 break
         if b_all_gone:
@@ -571,25 +1525,130 @@ def samples_reviewdate_overdue():
     return samples
 
 
+class RequestSnapshot:
+    """ Vials in request states (with fields of their samples) and today's and yesterday's state changes to those states,
+    fetched once and shared by the request reports while the snapshot is active
+    with RequestSnapshot(states, udfs=['Approval Contact']) as snapshot:
+        msg = create_html_msg_about_states(*states)  # no further api calls
+        print(snapshot.api_calls)
+    Reports needing states or fields that are not in the snapshot fetch them as usual.
+    Rows are copied when taken from the snapshot, so reports may change them.
+    :param states: iterable of Vial_States
+    :param sdfs: sample fields added to vials and state changes
+    :param udfs: sample udfs added to vials
+    """
+    DATE_FLAGS = ('today', 'yesterday')
+
+    def __init__(self, states, sdfs=('owner', 'sample_type'), udfs=()):
+        self.states = list(dict.fromkeys(states))
+        self.sdfs = list(sdfs)
+        self.udfs = list(udfs)
+        self.vials = {}
+        self.state_changes = {}
+        self.api_calls = 0
+        self.previous = None
+
+    def __enter__(self):
+        global request_snapshot
+        if not self.vials:
+            self.load()
+        self.previous = request_snapshot
+        request_snapshot = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global request_snapshot
+        request_snapshot = self.previous
+        self.previous = None
+
+    def load(self):
+        """ Fetch vials of all states concurrently, and yesterday's and today's audit concurrently,
+        then add sample fields to vials and state changes with one get_samples_bulk
+        (when no vials are in the states the audit is not read, as the reports only list state changes of vials in the states)
+        """
+        started_calls = api_call_count()
+        self.vials = dict(zip(self.states, get_locations_in_states(self.states)))
+        self.state_changes = {date_flag: [] for date_flag in self.DATE_FLAGS}
+        if not any(self.vials.values()):  # nothing to report, so state changes and sample fields are not needed
+            self.api_calls = api_call_count() - started_calls
+            print('RequestSnapshot: no vials in {} states, {} api calls'.format(len(self.states), self.api_calls))
+            return
+        state_changes_by_day = samples_with_state_changes_by_day(self.DATE_FLAGS)
+        for date_flag in self.DATE_FLAGS:
+            self.state_changes[date_flag] = state_changes_to_states(state_changes_by_day[date_flag], self.states)
+        hydrate_samples([vial for vials in self.vials.values() for vial in vials] + 
+                        [state_change for state_changes in self.state_changes.values() for state_change in state_changes],
+                        self.sdfs, self.udfs)
+        self.api_calls = api_call_count() - started_calls
+        print('RequestSnapshot: {} vials in {} states, {} state changes, {} api calls'
+              .format(sum(len(vials) for vials in self.vials.values()), len(self.states), 
+                      sum(len(state_changes) for state_changes in self.state_changes.values()), self.api_calls))
+
+    def has(self, states, sdfs=[], udfs=[]):
+        return set(states) <= set(self.vials) and set(sdfs) <= set(self.sdfs) and set(udfs) <= set(self.udfs)
+
+    def locations_in_state(self, state):
+        return [dict(vial) for vial in self.vials[state]]
+
+    def samples_with_state_changes(self, date_flag):
+        return [dict(state_change) for state_change in self.state_changes[date_flag]]
+
+
+request_snapshot = None
+
+
+def state_changes_to_states(state_changes, states):
+    """ :return: state changes whose to_state is one of states (Vial_States) """
+    vial_state_names = set("'"+STATE_NAME[state]+"'" for state in states)
+    return [state_change for state_change in state_changes if state_change['to_state'] in vial_state_names]
+
+
+def get_locations_in_state_of_samples(state, sdfs=[], udfs=[]):
+    """
+    get_locations_in_state with sample fields and udfs added, from active RequestSnapshot if it has them
+    :param state: Vial_States
+    :return: list of locations
+    """
+    if request_snapshot is not None and request_snapshot.has([state], sdfs, udfs):
+        return request_snapshot.locations_in_state(state)
+    locations = get_locations_in_state(state.value)
+    return hydrate_samples(locations, sdfs, udfs)
+
+
+def get_state_changes_to_states(date_flag, states, sdfs=[]):
+    """
+    State changes in date_flag period to one of states with sample fields added, from active RequestSnapshot if it has them
+    :param date_flag: today/yesterday (other periods are always fetched)
+    :param states: iterable of Vial_States
+    :return: list of state changes
+    """
+    if request_snapshot is not None and date_flag in request_snapshot.state_changes and request_snapshot.has(states, sdfs):
+        return state_changes_to_states(request_snapshot.samples_with_state_changes(date_flag), states)
+    return hydrate_samples(state_changes_to_states(samples_with_state_changes(date_flag), states), sdfs)
+
+
 def create_html_msg_about_states(*states):
     """
     Create msg ready for email whenever locations are in any of the states specified
+    Uses the active RequestSnapshot, else a RequestSnapshot of states is made for this message 
+    (states and the audits of yesterday and today are requested concurrently)
     :param *states: iterable of Vial_States
     :return: html msg else None if no samples in specified states
     """
+    if request_snapshot is None or not request_snapshot.has(states, ['owner', 'sample_type']):
+        with RequestSnapshot(states):
+            return create_html_msg_about_states(*states)
     sampleids_by_currentstate = {"'"+state+"'":set() for state in STATE_NAME.values()}
     msg = []
     bSend_email = False
     for state in states:
-        locations = get_locations_in_state(state.value)
+        locations = get_locations_in_state_of_samples(state, ['owner'])
         if not locations:
             msg.append('No samples have status <b>{}</b>.'.format(STATE_NAME[state]))
             msg.append('')
             continue
         bSend_email = True
         for location in locations:
-            sample = get_sample(location['sample_id'])
-            location['owner'] = sample['owner']
             sampleids_by_currentstate["'"+STATE_NAME[state]+"'"].add(str(location['sample_id']))
         # print('Location fields', locations[0].keys())
         msg.append('These samples currently have status <b>{}</b>:'.format(STATE_NAME[state]))
@@ -602,23 +1661,12 @@ def create_html_msg_about_states(*states):
     if not bSend_email:  # no samples in states
         return None
 
-    # retreive names for selected vial state id
-    vial_state_names = ["'"+STATE_NAME[state_id]+"'" for state_id in states]
-
-    sample_state_changes = samples_with_state_changes('today')
-    # remove state changes not in states
+    sample_state_changes = get_state_changes_to_states('today', states, ['owner', 'sample_type'])
+    # remove state changes of samples no longer in state
     for state_change in sample_state_changes[:]:
-        if state_change['to_state'] not in vial_state_names: 
-            sample_state_changes.remove(state_change)
-        elif state_change['sample_id'] not in sampleids_by_currentstate[state_change['to_state']]:
+        if state_change['sample_id'] not in sampleids_by_currentstate[state_change['to_state']]:
             print("Remove sample not currently in state", state_change)
             sample_state_changes.remove(state_change)
-        else:
-            # print(state_change['date'], state_change['type'], 'for sample', state_change['sample_id'], 'by', state_change['user_name'])
-            sample = get_sample(state_change['sample_id'])
-            #state_change['sample_name'] = sample['name']
-            state_change['owner'] = sample['owner']
-            state_change['sample_type'] = sample['sample_type']
 
     if sample_state_changes:
         msg.append('Further details about samples changed today: {:%d/%m/%Y}'.format(datetime.now()))
@@ -628,20 +1676,12 @@ def create_html_msg_about_states(*states):
         msg.append(html)
         msg.append('')
 
-    sample_state_changes = samples_with_state_changes('yesterday')
-    # remove state changes not in states
+    sample_state_changes = get_state_changes_to_states('yesterday', states, ['owner', 'sample_type'])
+    # remove state changes of samples no longer in state
     for state_change in sample_state_changes[:]:
-        if state_change['to_state'] not in vial_state_names: 
-            sample_state_changes.remove(state_change)
-        elif state_change['sample_id'] not in sampleids_by_currentstate[state_change['to_state']]:
+        if state_change['sample_id'] not in sampleids_by_currentstate[state_change['to_state']]:
             print("Remove sample not currently in state", state_change)
             sample_state_changes.remove(state_change)
-        else:
-            # print(state_change['date'], state_change['type'], 'for sample', state_change['sample_id'], 'by', state_change['user_name'])
-            sample = get_sample(state_change['sample_id'])
-            #state_change['sample_name'] = sample['name']
-            state_change['owner'] = sample['owner']
-            state_change['sample_type'] = sample['sample_type']
 
     if sample_state_changes:
         msg.append('Further details about samples changed yesterday: {:%d/%m/%Y}'.format(datetime.now() - timedelta(days=1)))
@@ -0,0 +1,260 @@
+#! python3
+""" On-disk outbox for outgoing email
+When outbox_dir is set in config.ini, send and send_html write each rendered message to the outbox folder
+instead of connecting to the SMTP server, so report scripts finish without waiting for (or failing with) the mail server.
+The outbox is delivered by flush() (python MailOutbox.py, run after the report scripts or on a schedule):
+    - messages are sent in parallel over outbox_workers SMTP connections
+    - a message that fails is retried by later flushes, waiting outbox_retry_delay seconds doubled after each attempt
+      (at most an hour)
+    - after outbox_max_attempts (or when the message file cannot be read) the message is moved to the failed subfolder
+      and support is emailed directly (not through the outbox), again by later flushes until the email is sent
+Each message is a json file {from_addr, to_addrs, message, created, attempts, next_attempt, error} written atomically.
+A flush claims a message by renaming it to .sending (touched first, so the claim is dated from when it was made),
+so flushes running at the same time do not send it twice; messages left claimed by a flush that did not finish are
+returned to the outbox an hour after they were claimed.
+Scheduler.py runs MailOutbox every 5 minutes when outbox_dir is set (see OUTBOX_SCHEDULE there), otherwise
+run it on a schedule of its own (ScheduleTasks/RunMailOutbox.bat).
+
+Config.ini:
+    MailServer | outbox_dir: outbox folder (must be set to use the outbox)
+    MailServer | outbox_workers: number of messages sent at once (default 4)
+    MailServer | outbox_max_attempts: attempts before message is moved to failed (default 10)
+    MailServer | outbox_retry_delay: seconds before first retry (default 60)
+
+Usage:
+    python MailOutbox.py                # send messages that are due
+    python MailOutbox.py --watch 30     # keep sending, checking the outbox every 30 seconds
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from FreezerPro import settings, MailDispatcher
+
+MAX_RETRY_DELAY = 3600
+STALE_CLAIM = 3600  # seconds after which a claimed (.sending) message is returned to the outbox
+
+
+class MailOutbox:
+    """ Folder of messages waiting to be sent
+    :param directory: outbox folder (default outbox_dir in config.ini)
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.OUTBOX_DIR
+        if not self.directory:
+            raise RuntimeError('Must define outbox_dir in config.ini [MailServer] to use MailOutbox')
+        self.failed_directory = os.path.join(self.directory, 'failed')
+        os.makedirs(self.failed_directory, exist_ok=True)
+
+    def enqueue(self, from_addr, to_addrs, message):
+        """ Write rendered message to outbox
+        :return: filename of message
+        """
+        now = time.time()
+        name = '{:%Y%m%d%H%M%S}-{}-{}.json'.format(datetime.fromtimestamp(now), os.getpid(), uuid.uuid4().hex[:8])
+        self._write(os.path.join(self.directory, name), {'from_addr': from_addr,
+                                                         'to_addrs': list(to_addrs),
+                                                         'message': message,
+                                                         'created': now,
+                                                         'attempts': 0,
+                                                         'next_attempt': now,
+                                                         'error': None})
+        return name
+
+    @staticmethod
+    def _write(path, record):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def waiting(self):
+        """ :return: names of messages in outbox (oldest first) """
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def failed(self):
+        """ :return: names of messages that could not be sent """
+        return sorted(name for name in os.listdir(self.failed_directory) if name.endswith('.json'))
+
+    def reclaim_stale(self):
+        """ Return messages claimed by a flush that did not finish to the outbox """
+        for name in os.listdir(self.directory):
+            if not name.endswith('.sending'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_CLAIM:
+                    os.replace(path, path[:-len('.sending')])
+            except FileNotFoundError:
+                pass  # finished by the flush that claimed it
+
+    def _claim(self, name):
+        """ :return: path of claimed message, None if claimed by another flush """
+        path = os.path.join(self.directory, name)
+        try:
+            # os.replace keeps the modification time, reclaim_stale must see when the message was claimed
+            os.utime(path)
+            os.replace(path, path + '.sending')
+        except FileNotFoundError:
+            return None
+        return path + '.sending'
+
+    @staticmethod
+    def _unclaim(sending_path):
+        """ Remove claimed message once it has been sent, retried or failed """
+        try:
+            os.remove(sending_path)
+        except FileNotFoundError:
+            print('MailOutbox: claim {} was removed by another flush'.format(os.path.basename(sending_path)))
+
+    def _send(self, dispatcher, name, max_attempts, retry_delay):
+        """ Send message name
+        :return: 'sent', 'retry' or 'failed'
+        """
+        sending_path = self._claim(name)
+        if sending_path is None:
+            return None
+        try:
+            record = self._read(sending_path)
+        except (OSError, ValueError) as err:
+            # keep the unreadable file beside a record of the error, so it is reported with the other failed messages
+            os.replace(sending_path, os.path.join(self.failed_directory, name + '.unreadable'))
+            self._write(os.path.join(self.failed_directory, name), 
+                        {'from_addr': None, 'to_addrs': [], 'message': None, 'created': time.time(), 'attempts': 0, 
+                         'next_attempt': None, 'error': 'Unable to read message: {}: {}'.format(type(err).__name__, err)})
+            print('MailOutbox: unable to read {}, moved to failed: {}'.format(name, err))
+            return 'failed'
+        try:
+            dispatcher.sendmail(record['from_addr'], record['to_addrs'], record['message'])
+        except Exception as err:
+            record['attempts'] += 1
+            record['error'] = '{}: {}'.format(type(err).__name__, err)
+            if record['attempts'] >= max_attempts:
+                self._write(os.path.join(self.failed_directory, name), record)
+                self._unclaim(sending_path)
+                print('MailOutbox: failed to send {} to {} after {} attempts: {}'
+                      .format(name, record['to_addrs'], record['attempts'], record['error']))
+                return 'failed'
+            record['next_attempt'] = time.time() + min(retry_delay * 2 ** (record['attempts'] - 1), MAX_RETRY_DELAY)
+            self._write(os.path.join(self.directory, name), record)
+            self._unclaim(sending_path)
+            return 'retry'
+        self._unclaim(sending_path)
+        return 'sent'
+
+    def report_failed(self, dispatcher):
+        """ Email support about messages in the failed folder that support has not been told about
+        The alert is sent with dispatcher (not through the outbox). If it cannot be sent the messages are reported 
+        by a later flush.
+        :return: number of messages reported
+        """
+        unreported = []
+        for name in self.failed():
+            path = os.path.join(self.failed_directory, name)
+            try:
+                record = self._read(path)
+            except (OSError, ValueError) as err:
+                record = {'to_addrs': [], 'attempts': 0, 'error': 'Unable to read failed message: {}'.format(err)}
+            if not record.get('reported'):
+                unreported.append((path, name, record))
+        if not unreported:
+            return 0
+        from email.mime.text import MIMEText
+        lines = ['{} emails could not be sent and have been moved to {}:'.format(len(unreported), self.failed_directory), '']
+        for (path, name, record) in unreported:
+            lines.append('{} to {} after {} attempts: {}'.format(name, ', '.join(record.get('to_addrs') or []), 
+                                                                record.get('attempts'), record.get('error')))
+        message = MIMEText('\r\n'.join(lines), 'plain', 'utf-8')
+        message['From'] = settings.SEND_EMAIL_FROM
+        message['To'] = 'SamplePro Support'
+        message['Subject'] = 'SamplePro emails could not be sent'
+        try:
+            dispatcher.sendmail('donotreply@scionresearch.com', [settings.SUPPORT_EMAIL], message.as_string())
+        except Exception as err:
+            print('MailOutbox: unable to tell support about {} failed messages: {}'.format(len(unreported), err))
+            return 0
+        for (path, name, record) in unreported:
+            record['reported'] = time.time()
+            try:
+                self._write(path, record)
+            except OSError as err:
+                print('MailOutbox: unable to mark {} as reported: {}'.format(name, err))
+        return len(unreported)
+
+    def flush(self, workers=None, max_attempts=None, retry_delay=None):
+        """ Send messages that are due
+        :param workers: number of messages sent at once (default outbox_workers in config.ini)
+        :param max_attempts: default outbox_max_attempts in config.ini
+        :param retry_delay: seconds before first retry (default outbox_retry_delay in config.ini)
+        :return: dictionary of counts of messages sent, retry, failed, waiting (not yet due) and 
+                 reported (failed messages support was told about, see report_failed)
+        """
+        workers = workers or settings.OUTBOX_WORKERS
+        max_attempts = max_attempts or settings.OUTBOX_MAX_ATTEMPTS
+        retry_delay = retry_delay if retry_delay is not None else settings.OUTBOX_RETRY_DELAY
+        started = time.time()
+        self.reclaim_stale()
+        due = []
+        waiting = 0
+        for name in self.waiting():
+            try:
+                record = self._read(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue  # sent by another flush
+            except ValueError:
+                due.append(name)  # unreadable, moved to failed by _send
+                continue
+            if record['next_attempt'] <= started:
+                due.append(name)
+            else:
+                waiting += 1
+        counts = {'sent': 0, 'retry': 0, 'failed': 0, 'waiting': waiting}
+        dispatcher = MailDispatcher(connections=workers)
+        try:
+            if due:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = {executor.submit(self._send, dispatcher, name, max_attempts, retry_delay): name for name in due}
+                    for future in as_completed(futures):
+                        try:
+                            result = future.result()
+                        except Exception as err:
+                            # message is left claimed and returned to the outbox by reclaim_stale
+                            print('MailOutbox: error sending {}: {}: {}'.format(futures[future], type(err).__name__, err))
+                            continue
+                        if result:
+                            counts[result] += 1
+            counts['reported'] = self.report_failed(dispatcher)
+        finally:
+            dispatcher.close()
+        print('MailOutbox: {sent} sent, {retry} to retry, {failed} failed, {waiting} waiting, {reported} failed reported'
+              .format(**counts) +
+              ' in {:.1f}s'.format(time.time() - started))
+        return counts
+
+
+def main():
+    MailOutbox().flush()
+
+
+if __name__ == '__main__':
+    outbox = MailOutbox()
+    if '--watch' in sys.argv:
+        index = sys.argv.index('--watch')
+        interval = float(sys.argv[index + 1]) if len(sys.argv) > index + 1 else 30
+        while True:
+            outbox.flush()
+            time.sleep(interval)
+    else:
+        outbox.flush()
@@ -0,0 +1,141 @@
+#! python3
+""" Review date reminders from a single pass over the samples
+Samples with a Review Date up to days_to_review_normal days from today (which includes overdue samples) are retrieved
+once, and each sample is put in one of the buckets
+(vial states and locations are then retrieved once for the samples in the buckets):
+    overdue     Review Date before today
+    near_long   Review Date within days_to_review_normal days and more than short_review_reminder days after created_at
+                (or created_at not known)
+    near_short  Review Date within days_to_review_short days and at most short_review_reminder days after created_at
+As for samples_nearing_reviewdate and samples_reviewdate_overdue, samples where all vials are in VIAL_STATES_GONE are
+excluded, and samples are answered from SampleMirror when mirror_file is set in config.ini.
+
+    buckets = review_date_buckets()
+    email_owners_reviewdate_overdue(buckets['overdue'])
+"""
+
+import functools
+from datetime import date, timedelta
+from FreezerPro import settings, freezerpro_retrieve, get_vials_bulk, STATE_NAME, VIAL_STATES_GONE
+
+BUCKETS = ('overdue', 'near_short', 'near_long')
+
+
+def review_date_candidates(first_date, last_date):
+    """
+    Samples with Review Date from first_date to last_date
+    :param first_date: date, None to include all overdue samples
+    :param last_date: date
+    :return: list of samples (id, sample_type, owner_id, created_at, Review Date, Approval Contact, udfs)
+    """
+    query = [{'type': 'udf',
+              'field': 'Review Date',
+              'op': 'lt',
+              'value': (last_date + timedelta(days=1)).strftime('%d/%m/%Y')
+             },
+            ]
+    if first_date:
+        query.append({'type': 'udf',
+                      'field': 'Review Date',
+                      'op': 'gt',
+                      'value': (first_date - timedelta(days=1)).strftime('%d/%m/%Y')
+                     })
+    samples = freezerpro_retrieve({'method': 'advanced_search',
+                                   'query': query,
+                                   'sdfs': ['id', 'sample_type', 'owner_id', 'created_at'],
+                                   'udfs': ['Review Date', 'Approval Contact'],
+                                  },
+                                  'Samples')
+    for sample in samples:
+        sample['Review Date'] = sample['udfs'].get('Review Date')
+        sample['Approval Contact'] = sample['udfs'].get('Approval Contact')
+    return samples
+
+
+def current_samples_with_location(samples):
+    """
+    Exclude samples where all vials are in VIAL_STATES_GONE and add location to the others
+    (vial states of all samples are retrieved together, sample records concurrently)
+    :return: list of samples
+    """
+    from AsyncFreezerPro import fetch_many
+    gone = set(STATE_NAME[state] for state in VIAL_STATES_GONE)
+    vial_states = get_vials_bulk([sample['id'] for sample in samples])
+    samples = [sample for sample in samples if not all(vial_state in gone for vial_state in vial_states[sample['id']])]
+    for sample, sample_rec in zip(samples, fetch_many('get_sample', [sample['id'] for sample in samples])):
+        sample['location'] = sample_rec['location']
+    return samples
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date(text):
+    """ :return: date of dd/mm/yyyy text, None if not a date (samples share dates, so each date is only parsed once) """
+    try:
+        (day, month, year) = text.split('/')
+        return date(int(year), int(month), int(day))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def classify_review_dates(samples, today=None, days_long=None, days_short=None, short_term=None):
+    """
+    Bucket samples by review date
+    :param samples: list of samples with Review Date and created_at (dd/mm/yyyy)
+    :param today: date (default today)
+    :param days_long: days_to_review_normal in config.ini by default
+    :param days_short: days_to_review_short in config.ini by default
+    :param short_term: short_review_reminder in config.ini by default
+    :return: dictionary of bucket name (BUCKETS): list of samples (in order of samples)
+    """
+    today = today or date.today()
+    days_long = days_long if days_long is not None else settings.DAYS_TO_REVIEW_NORMAL
+    days_short = days_short if days_short is not None else settings.DAYS_TO_REVIEW_SHORT
+    short_term = short_term if short_term is not None else settings.SHORT_REVIEW_REMINDER
+    buckets = {bucket: [] for bucket in BUCKETS}
+    ignored = 0
+    for sample in samples:
+        review_date = parse_date(sample.get('Review Date'))
+        if review_date is None:
+            ignored += 1
+            continue
+        days_to_review = (review_date - today).days
+        created_at = parse_date(sample.get('created_at'))
+        short = created_at is not None and (review_date - created_at).days <= short_term
+        if days_to_review < 0:
+            buckets['overdue'].append(sample)
+        elif short and days_to_review <= days_short:
+            buckets['near_short'].append(sample)
+        elif not short and days_to_review <= days_long:
+            buckets['near_long'].append(sample)
+    if ignored:
+        print('classify_review_dates: {} samples with Review Date not dd/mm/yyyy ignored'.format(ignored))
+    return buckets
+
+
+def review_date_buckets(today=None, buckets=BUCKETS):
+    """
+    Overdue and nearing review date samples from a single retrieval of samples
+    Only samples with a review date in the range of the buckets are retrieved, and vial states and locations are 
+    only retrieved for samples in the buckets.
+    :param buckets: names of buckets wanted (default all of BUCKETS)
+    :return: dictionary of bucket name: list of samples (see classify_review_dates)
+    """
+    today = today or date.today()
+    days = {'overdue': -1, 'near_short': settings.DAYS_TO_REVIEW_SHORT, 'near_long': settings.DAYS_TO_REVIEW_NORMAL}
+    if settings.MIRROR_FILE:
+        from SampleMirror import SampleMirror  # mirror excludes gone samples and adds location
+        with SampleMirror() as mirror:
+            mirror.ensure_fresh()
+            samples = mirror.samples_reviewdate_until(today + timedelta(days=max(days[bucket] for bucket in buckets)))
+        classified = classify_review_dates(samples, today)
+    else:
+        samples = review_date_candidates(None if 'overdue' in buckets else today, 
+                                         today + timedelta(days=max(days[bucket] for bucket in buckets)))
+        classified = classify_review_dates(samples, today)
+        wanted = {sample['id']: sample for bucket in buckets for sample in classified[bucket]}
+        current = set(sample['id'] for sample in current_samples_with_location(list(wanted.values())))
+        classified = {bucket: [sample for sample in classified[bucket] if sample['id'] in current] for bucket in BUCKETS}
+    classified = {bucket: classified[bucket] for bucket in buckets}
+    print('review_date_buckets: {} samples, '.format(len(samples)) +
+          ', '.join('{} {}'.format(bucket, len(classified[bucket])) for bucket in buckets))
+    return classified
@@ -0,0 +1,251 @@
+#! python3
+""" Local SQLite mirror of FreezerPro samples and vials
+Review date reports can be answered from the mirror in milliseconds instead of thousands of api calls.
+
+Scope: only the review date reports (samples_nearing_reviewdate, samples_reviewdate_overdue and ReviewDates) read
+the mirror. The Operations Officer lists and SampleState reconciliation act on the vial states at the time they run,
+so they stay on the live api. Users are not mirrored, as the reports get them from the UserDirectory
+(get_user_directory) that is already cached in a file.
+
+The mirror is seeded by a bulk load:
+    samples - advanced_search of all sample types (id, owner, sample type, Review Date, Approval Contact, SampleState)
+    vials   - vials_sample for each Vial_States (state_info, location, barcode_tag)
+and kept fresh by refresh(): only the vials of samples with a state change in the audit log (of today, and
+yesterday when last refreshed yesterday) are retrieved again; a mirror last refreshed before yesterday is seeded again.
+Samples are reloaded in full (a call per 1000 samples) as edits of Review Date and Approval Contact are not
+state changes in the audit log, and the api gives no way of asking for samples changed since a time.
+Vials without a state are not mirrored, and vials added without a state change are only picked up by seed(),
+so the mirror should be reseeded periodically (e.g. weekly).
+
+Config.ini:
+    System | mirror_file: path of SQLite database. When set, samples_nearing_reviewdate and samples_reviewdate_overdue
+                          are answered from the mirror.
+    System | mirror_max_age: seconds after which mirror is refreshed before being queried (default 3600)
+
+Usage:
+    python SampleMirror.py          # refresh mirror (seeds when empty)
+    python SampleMirror.py --seed   # reload mirror from scratch
+"""
+
+import sqlite3
+import sys
+import time
+from datetime import datetime, date, timedelta
+from FreezerPro import settings, get_sampletypes, freezerpro_retrieve, iter_locations_in_state, \
+    samples_with_state_changes_by_day, email_Support, Vial_States, VIAL_STATES_GONE, STATE_NAME
+from AsyncFreezerPro import fetch_many
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    sample_type TEXT,
+    owner TEXT,
+    owner_id INTEGER,
+    created_at TEXT,
+    review_date TEXT,          -- as entered (dd/mm/yyyy)
+    review_date_iso TEXT,      -- yyyy-mm-dd for range queries
+    approval_contact TEXT,
+    sample_state TEXT,
+    locations_count INTEGER,
+    location TEXT              -- from sample_info, filled when first needed
+);
+CREATE INDEX IF NOT EXISTS samples_review_date_iso ON samples (review_date_iso);
+CREATE TABLE IF NOT EXISTS vials (
+    sample_id INTEGER,
+    state_info TEXT,
+    barcode_tag TEXT,
+    sampletype_name TEXT,
+    location TEXT,
+    position
+);
+CREATE INDEX IF NOT EXISTS vials_sample_id ON vials (sample_id);
+CREATE INDEX IF NOT EXISTS vials_state_info ON vials (state_info);
+DROP TABLE IF EXISTS users;   -- no longer mirrored
+CREATE TABLE IF NOT EXISTS mirror_info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SAMPLE_SDFS = ['id', 'sample_type', 'owner_username', 'owner_id', 'created_at', 'locations_count']
+SAMPLE_UDFS = ['Review Date', 'Approval Contact', 'SampleState']
+VIAL_COLUMNS = ['sample_id', 'state_info', 'barcode_tag', 'sampletype_name', 'location', 'position']
+
+
+def iso_date(ddmmyyyy):
+    """ convert dd/mm/yyyy to yyyy-mm-dd (None if not a valid date) """
+    try:
+        return datetime.strptime(ddmmyyyy, '%d/%m/%Y').date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+class SampleMirror:
+    """ SQLite mirror of FreezerPro samples and vials
+    with SampleMirror() as mirror:
+        samples = mirror.samples_nearing_reviewdate(30)
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or settings.MIRROR_FILE
+        if not self.filename:
+            raise RuntimeError('Must define mirror_file in config.ini to use SampleMirror')
+        self.db = sqlite3.connect(self.filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def get_info(self, key):
+        row = self.db.execute('SELECT value FROM mirror_info WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_info(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO mirror_info (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def last_refresh(self):
+        """ :return: time (seconds since epoch) of last seed or refresh, else None if never loaded """
+        value = self.get_info('last_refresh')
+        return float(value) if value else None
+
+    # loading
+
+    def seed(self):
+        """ Reload all samples and vials """
+        started = time.time()
+        with self.db:
+            self.db.execute('DELETE FROM samples')
+            self.db.execute('DELETE FROM vials')
+            self.load_samples()
+            for state in Vial_States:
+                self.db.executemany('INSERT INTO vials ({}) VALUES ({})'.format(', '.join(VIAL_COLUMNS), ', '.join('?' * len(VIAL_COLUMNS))),
+                                    ([location.get(column) for column in VIAL_COLUMNS] for location in iter_locations_in_state(state.value)))
+            self.set_info('last_refresh', started)
+        print('SampleMirror: seeded {} samples, {} vials in {:.1f}s'.format(self.count('samples'), self.count('vials'), time.time() - started))
+
+    def refresh(self):
+        """ Reload samples, and vials of samples with state changes since last refresh 
+        (seed if never loaded, or last refreshed before yesterday)
+        """
+        last_refresh = self.last_refresh()
+        if last_refresh is None:
+            return self.seed()
+        started = time.time()
+        # audits are requested with the today and yesterday date_flags, older changes are not requested by date range
+        date_flags = {0: ['today'], 1: ['today', 'yesterday']}.get((date.today() - datetime.fromtimestamp(last_refresh).date()).days)
+        if date_flags is None:
+            return self.seed()
+        changed_ids = sorted(set(int(state_change['sample_id']) 
+                                 for state_changes in samples_with_state_changes_by_day(date_flags).values()
+                                 for state_change in state_changes))
+        vials_of_samples = fetch_many('get_vials', changed_ids)
+        with self.db:
+            self.load_samples()
+            for sample_id, vials in zip(changed_ids, vials_of_samples):
+                self.load_vials(sample_id, vials)
+                self.db.execute('UPDATE samples SET location = NULL WHERE id = ?', (sample_id,))
+            self.set_info('last_refresh', started)
+        print('SampleMirror: refreshed vials of {} samples in {:.1f}s'.format(len(changed_ids), time.time() - started))
+
+    def ensure_fresh(self, max_age=None):
+        """ refresh mirror if not refreshed within max_age seconds (default mirror_max_age in config.ini) """
+        last_refresh = self.last_refresh()
+        if last_refresh is None or time.time() - last_refresh > (max_age if max_age is not None else settings.MIRROR_MAX_AGE):
+            self.refresh()
+
+    def load_samples(self):
+        sampletype_names = [sampletype['name'] for sampletype in get_sampletypes()]
+        if not sampletype_names:
+            return
+        samples = freezerpro_retrieve({'method': 'advanced_search',
+                                       'query': [{'type': 'sdf',
+                                                  'field': 'sample_type_name',
+                                                  'op': 'eq',
+                                                  'value': sampletype_names
+                                                 },
+                                                ],
+                                       'sdfs': SAMPLE_SDFS,
+                                       'udfs': SAMPLE_UDFS,
+                                      },
+                                      'Samples')
+        locations = {row['id']: row['location'] for row in self.db.execute('SELECT id, location FROM samples')}
+        self.db.execute('DELETE FROM samples')
+        self.db.executemany('INSERT INTO samples (id, sample_type, owner, owner_id, created_at, review_date, review_date_iso, '
+                            'approval_contact, sample_state, locations_count, location) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            ((sample['id'], sample.get('sample_type'), sample.get('owner_username'), sample.get('owner_id'),
+                              sample.get('created_at'), sample['udfs'].get('Review Date'), iso_date(sample['udfs'].get('Review Date')),
+                              sample['udfs'].get('Approval Contact'), sample['udfs'].get('SampleState'), sample.get('locations_count'),
+                              locations.get(int(sample['id'])))
+                             for sample in samples))
+
+    def load_vials(self, sample_id, vials):
+        self.db.execute('DELETE FROM vials WHERE sample_id = ?', (sample_id,))
+        self.db.executemany('INSERT INTO vials ({}) VALUES ({})'.format(', '.join(VIAL_COLUMNS), ', '.join('?' * len(VIAL_COLUMNS))),
+                            ([vial.get(column) for column in VIAL_COLUMNS] for vial in vials if vial.get('state_info')))
+
+    def count(self, table):
+        return self.db.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+
+    # queries
+
+    def samples_nearing_reviewdate(self, days):
+        """ mirror version of FreezerPro.samples_nearing_reviewdate """
+        today = date.today()
+        return self._review_samples('review_date_iso BETWEEN ? AND ?', (today.isoformat(), (today + timedelta(days=days)).isoformat()))
+
+    def samples_reviewdate_overdue(self):
+        """ mirror version of FreezerPro.samples_reviewdate_overdue """
+        return self._review_samples('review_date_iso < ?', (date.today().isoformat(),))
+
+    def samples_reviewdate_until(self, last_date):
+        """ mirror version of ReviewDates.review_date_candidates (overdue samples and samples with review date up to last_date) """
+        return self._review_samples('review_date_iso <= ?', (last_date.isoformat(),))
+
+    def _review_samples(self, where, parameters):
+        """ samples matching where, excluding samples where all vials are in VIAL_STATES_GONE
+        (vials without a state are not mirrored, locations_count shows if a sample has any)
+        """
+        gone = [STATE_NAME[state] for state in VIAL_STATES_GONE]
+        rows = self.db.execute('SELECT samples.*, '
+                               ' SUM(vials.state_info IS NOT NULL) AS vial_count, '
+                               ' SUM(vials.state_info NOT IN ({})) AS current_count '
+                               'FROM samples LEFT JOIN vials ON vials.sample_id = samples.id '
+                               'WHERE {} GROUP BY samples.id ORDER BY samples.id'.format(', '.join('?' * len(gone)), where),
+                               gone + list(parameters)).fetchall()
+        rows = [row for row in rows if row['current_count'] or (row['locations_count'] or 0) > row['vial_count']]
+        missing_location = [row['id'] for row in rows if row['location'] is None]
+        locations = {}
+        if missing_location:
+            samples = fetch_many('get_sample', missing_location)
+            locations = {sample_id: sample['location'] for sample, sample_id in zip(samples, missing_location)}
+            with self.db:
+                self.db.executemany('UPDATE samples SET location = ? WHERE id = ?',
+                                    ((location, sample_id) for sample_id, location in locations.items()))
+        return [{'id': row['id'],
+                 'sample_type': row['sample_type'],
+                 'owner_id': row['owner_id'],
+                 'created_at': row['created_at'],
+                 'Review Date': row['review_date'],
+                 'Approval Contact': row['approval_contact'],
+                 'location': locations.get(row['id'], row['location']),
+                 'udfs': {'Review Date': row['review_date'], 'Approval Contact': row['approval_contact']},
+                } for row in rows]
+
+
+if __name__ == '__main__':
+    try:
+        with SampleMirror() as mirror:
+            if '--seed' in sys.argv:
+                mirror.seed()
+            else:
+                mirror.refresh()
+    except Exception as err:
+        # print(err)
+        email_Support('SamplePro error in SampleMirror', err )
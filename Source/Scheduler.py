@@ -0,0 +1,233 @@
+#! python3
+""" Run the SamplePro scripts on cron-like schedules in one long-running process
+Replaces the Windows Task Scheduler tasks in ScheduleTasks (one new python process per run). Jobs run one at a time
+in this process, so they share the http session, authorization token, user directory and SMTP connections of the
+FreezerPro module instead of setting them up again for every run. Runs on Windows and Linux.
+
+A job is the main() function of a script in this folder. Each run is timed and logged, and a job that fails is
+reported to support (as when the script is run on its own) without stopping the other jobs.
+When a run takes longer than the time to its next run, the missed runs are skipped (not run late).
+
+Config.ini:
+    [Schedule]
+    ScriptName = minute hour day month weekday   # e.g. EmailOwnerAboutStateChanges = 0 8-15 * * *
+    Fields are as for cron: * (any), numbers, ranges (8-15), lists (0,30) and steps (*/15, 8-16/2).
+    Weekday is 0-6 with 0 (or 7) Sunday. As for cron, when both day and weekday are given either can match.
+    An empty schedule (or off) disables a job. Jobs not in config.ini use DEFAULT_SCHEDULE (times of the
+    Windows tasks in ScheduleTasks, with both review date reminders sent by EmailOwnersReviewDates), plus MailOutbox on OUTBOX_SCHEDULE when outbox_dir is set in config.ini
+    (so queued emails are sent).
+
+Usage:
+    python Scheduler.py                 # run jobs until stopped (Ctrl-C or SIGTERM)
+    python Scheduler.py --list          # show jobs and time of next run
+    python Scheduler.py --run ScriptName  # run job now
+"""
+
+import importlib
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from FreezerPro import settings, email_Support, MailDispatcher
+
+DEFAULT_SCHEDULE = {
+    'EmailOwnerAboutStateChanges': '0 8-15 * * *',
+    'EmailApprovalContactAboutRequests': '5 8-15 * * *',
+    'EmailOwnersReviewDates': '25 8-15 * * *',  # EmailOwnersSamplesReviewDateOverdue and EmailOwnersSamplesNearingReviewDate
+    'EmailOperationsOfficersAboutRequests': '30 8-15 * * *',
+}
+OUTBOX_SCHEDULE = '*/5 * * * *'  # MailOutbox, when outbox_dir is set
+MAX_SLEEP = 60  # seconds, so clock changes and stop requests are noticed
+
+
+class CronSchedule:
+    """ Times matching a cron expression 'minute hour day month weekday'
+    :param expression: e.g. '0 8-15 * * *', '*/15 * * * 1-5'
+    """
+
+    FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(self.FIELDS):
+            raise RuntimeError('Schedule "{}" must have 5 fields: minute hour day month weekday'.format(expression))
+        values = [self.parse_field(field, name, low, high) for field, (name, low, high) in zip(fields, self.FIELDS)]
+        (self.minutes, self.hours, self.days, self.months, weekdays) = values
+        self.weekdays = set(weekday % 7 for weekday in weekdays)  # 7 is also Sunday
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def parse_field(field, name, low, high):
+        """ :return: set of values matching cron field e.g. '*/15', '8-15', '0,30' """
+        values = set()
+        for part in field.split(','):
+            (part, _, step) = part.partition('/')
+            try:
+                step = int(step) if step else 1
+                if part == '*':
+                    (first, last) = (low, high)
+                elif '-' in part:
+                    (first, last) = (int(value) for value in part.split('-', 1))
+                else:
+                    first = int(part)
+                    last = high if step > 1 else first
+            except ValueError:
+                raise RuntimeError('Invalid {} "{}" in schedule'.format(name, field))
+            if not low <= first <= last <= high or step < 1:
+                raise RuntimeError('Invalid {} "{}" in schedule (must be {}-{})'.format(name, field, low, high))
+            values.update(range(first, last + 1, step))
+        return values
+
+    def day_matches(self, moment):
+        weekday = moment.isoweekday() % 7  # cron weekday, 0 is Sunday
+        if self.any_day or self.any_weekday:
+            return moment.day in self.days and weekday in self.weekdays
+        return moment.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """ :return: first time (whole minute) after moment that matches schedule """
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self.day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise RuntimeError('Schedule "{}" never matches'.format(self.expression))
+
+
+class ScheduledJob:
+    """ main() of script `name` run on `schedule` """
+
+    def __init__(self, name, schedule):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.last_seconds = None
+
+    def function(self):
+        return importlib.import_module(self.name).main
+
+    def plan(self, now):
+        self.next_run = self.schedule.next_after(now)
+
+    def run(self):
+        """ Run job, reporting any error to support
+        :return: True if job succeeded
+        """
+        log('starting {}'.format(self.name))
+        started = time.time()
+        self.runs += 1
+        try:
+            self.function()()
+            succeeded = True
+        except Exception as err:
+            self.failures += 1
+            succeeded = False
+            traceback.print_exc()
+            try:
+                email_Support('SamplePro error in {}'.format(self.name), err)
+            except Exception:
+                traceback.print_exc()
+        self.last_seconds = time.time() - started
+        log('{} {} in {:.1f}s ({} runs, {} failed)'.format(self.name, 'finished' if succeeded else 'FAILED',
+                                                           self.last_seconds, self.runs, self.failures))
+        return succeeded
+
+
+def log(message):
+    print('{:%Y-%m-%d %H:%M:%S} Scheduler: {}'.format(datetime.now(), message), flush=True)
+
+
+def script_names():
+    """ :return: dictionary of lowercase name: name of scripts in this folder (config.ini keys are lowercase) """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    return {name[:-3].lower(): name[:-3] for name in os.listdir(folder) if name.endswith('.py')}
+
+
+def scheduled_jobs():
+    """ :return: list of ScheduledJob from DEFAULT_SCHEDULE (and MailOutbox if outbox_dir is set) and [Schedule] in config.ini """
+    schedules = {name.lower(): (name, schedule) for name, schedule in DEFAULT_SCHEDULE.items()}
+    if settings.OUTBOX_DIR:
+        schedules['mailoutbox'] = ('MailOutbox', OUTBOX_SCHEDULE)
+    if settings.config.has_section('Schedule'):
+        scripts = script_names()
+        for key, schedule in settings.config['Schedule'].items():
+            if key not in scripts:
+                raise RuntimeError('[Schedule] {}: no script {}.py'.format(key, key))
+            schedules[key] = (scripts[key], schedule.strip())
+    return [ScheduledJob(name, schedule) for name, schedule in sorted(schedules.values())
+            if schedule and schedule.lower() != 'off']
+
+
+class Scheduler:
+    """ Run jobs when due until stop() is called
+    :param jobs: list of ScheduledJob (default scheduled_jobs())
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs if jobs is not None else scheduled_jobs()
+        self.stopping = threading.Event()
+
+    def stop(self, *args):
+        log('stopping')
+        self.stopping.set()
+
+    def run_pending(self, now):
+        """ Run jobs due at now (sharing SMTP connections), then plan their next run """
+        due = [job for job in self.jobs if job.next_run <= now]
+        if due:
+            with MailDispatcher():
+                for job in due:
+                    if self.stopping.is_set():
+                        break
+                    job.run()
+                    job.plan(max(now, datetime.now()))
+
+    def run_forever(self):
+        now = datetime.now()
+        for job in self.jobs:
+            job.plan(now)
+            log('{} next run {:%Y-%m-%d %H:%M} ({})'.format(job.name, job.next_run, job.schedule.expression))
+        if not self.jobs:
+            log('no jobs scheduled')
+            return
+        while not self.stopping.is_set():
+            self.run_pending(datetime.now())
+            next_run = min(job.next_run for job in self.jobs)
+            self.stopping.wait(min(MAX_SLEEP, max(0, (next_run - datetime.now()).total_seconds())))
+
+
+if __name__ == '__main__':
+    if '--run' in sys.argv:
+        name = sys.argv[sys.argv.index('--run') + 1]
+        with MailDispatcher():
+            succeeded = ScheduledJob(script_names().get(name.lower(), name), '* * * * *').run()
+        sys.exit(0 if succeeded else 1)
+    try:
+        scheduler = Scheduler()
+    except Exception as err:
+        email_Support('SamplePro error in Scheduler', err)
+        raise
+    if '--list' in sys.argv:
+        now = datetime.now()
+        for job in scheduler.jobs:
+            job.plan(now)
+            print('{:40} {:20} next run {:%Y-%m-%d %H:%M}'.format(job.name, job.schedule.expression, job.next_run))
+    else:
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        scheduler.run_forever()
@@ -22,9 +22,8 @@ Date: Mar 2019
 """
 
 import csv
-import time
 import json
-from FreezerPro import freezerpro_post, freezerpro_retrieve, email_Support
+from FreezerPro import freezerpro_retrieve, email_Support, run_job
 import get_config
 from ast import literal_eval
 from os.path import isfile
@@ -40,16 +39,7 @@ def import_samplegroups(task_codes):
         job_id (str): job id of background job started (will have completed by time method returns)
     """
 
-    import_response = freezerpro_post({'method': 'import_sample_groups', 'background_job': 'true', 'json':json.dumps(task_codes)})
-    job_id = import_response['job_id']
-    while(True):
-        time.sleep(1)
-        completed_response = freezerpro_post({'method':'get_job_status', 'job_id':job_id})
-        if completed_response['status'] == 1:
-            raise RuntimeError(completed_response['msg'] )
-        if completed_response['status'] != 3:
-            break
-    return job_id
+    return run_job({'method': 'import_sample_groups', 'json':json.dumps(task_codes)}, 'import_sample_groups')
 
 
 if __name__ == '__main__':
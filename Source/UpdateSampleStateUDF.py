@@ -4,76 +4,309 @@ SampleState = Disposed if ALL vials Disposed
             = Returned if ALL vials ReturnedToSource or Disposed
             = Awaiting Delivery if ALL vials AwaitingDelivery, ReturnedToSource, or Disposed
             = Current if ANY vial not AwaitingDelivery, ReturnedToSource, or Disposed
+
+Each run only checks audits since the last run: the highest audit id processed (and time of the run) is saved in a
+checkpoint file after samples have been updated. Audits are requested from checkpoint_overlap minutes before the last run
+and only those with a higher audit id are checked (audits without a numeric id are all checked again, which only
+updates samples whose SampleState is wrong). Without a checkpoint (first run, or file deleted) a week of audits is checked.
+
+With --all the SampleState of every sample (of sample types with a SampleState field) is checked, see update_all_samples.
+
+Config.ini:
+    System | checkpoint_file: path of checkpoint file (default UpdateSampleStateUDF_checkpoint.json next to config.ini)
+    System | checkpoint_overlap: minutes before the last run from which audits are requested (default 60)
+    FreezerPro | update_workers: number of sample ranges update_all_samples processes at once (default 4)
+    FreezerPro | update_split_size: maximum number of samples in a range (default 2000)
+    FreezerPro | update_chunk_records, update_chunk_bytes: maximum records and bytes of json sent in one update_samples job
+                 (default 1000 and 1000000)
+    FreezerPro | update_chunks_in_flight: number of update_samples jobs running at once (default 2)
+    FreezerPro | update_retries: number of times a failed update_samples job is resubmitted (default 2)
+    FreezerPro | update_retry_delay: seconds before a failed job is first resubmitted, doubled for each retry (default 10)
+
+Usage:
+    python UpdateSampleStateUDF.py          # samples with state changes since last run
+    python UpdateSampleStateUDF.py --all    # all samples
 """
 
 import json
+import os
+import sys
 import time
 import datetime
-from FreezerPro import samples_with_state_changes, get_sample, get_sample_userfields, get_vials, Vial_States, STATE_NAME,\
-     freezerpro_post, email_Support, get_locations_in_state,freezerpro_retrieve, get_sampletypes
+import heapq
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+from FreezerPro import iter_samples_with_state_changes, get_sample, get_sample_userfields, get_vials_bulk, Vial_States,\
+     email_Support, iter_locations_in_state, freezerpro_retrieve, get_sampletypes, RunCache, invalidate_samples,\
+     STATE_ID, JobManager, JOB_FAILED, JOB_TIMED_OUT, get_vial_states_by_sample, vials_by_state, settings
+
+CHECKPOINT_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+FULL_DATE_FLAG = 'week'  # audits checked when there is no checkpoint
+
+
+class AuditCheckpoint:
+    """ High-water mark of audits processed by find_samplestates, kept in a json file
+    {"last_audit_id": id, "checked_at": "yyyy-mm-ddTHH:MM:SS"}
+    Audits are ordered by audit id (audit created_at is not parsed): state changes with an id above last_audit_id
+    are new. checked_at (time of the run that saved the checkpoint, less overlap) sets the first day of audits requested.
+    State changes without a numeric audit id are always new, so the days since checked_at are checked again
+    (a warning is printed); this is safe as samples are only updated where SampleState does not match the vials.
+    The checkpoint is only moved forward by save(), so a failed run is repeated in full by the next run.
+    :param filename: checkpoint file (default checkpoint_file in config.ini)
+    :param overlap: minutes before the last run from which audits are requested (default checkpoint_overlap in config.ini)
+    """
+
+    def __init__(self, filename=None, overlap=None):
+        self.filename = filename or settings.CHECKPOINT_FILE
+        self.overlap = datetime.timedelta(minutes=overlap if overlap is not None else settings.CHECKPOINT_OVERLAP)
+        self.checked_at = None
+        self.last_audit_id = None
+        self.load()
+        self.started = datetime.datetime.now()
+        self.next_audit_id = self.last_audit_id
+        self.without_id = 0  # state changes checked that have no numeric audit id
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            # checkpoints written before audits were ordered by id have last_audit_at instead of checked_at
+            self.checked_at = datetime.datetime.strptime(data.get('checked_at', data.get('last_audit_at')), 
+                                                         CHECKPOINT_DATE_FORMAT)
+            self.last_audit_id = int(data['last_audit_id']) if data.get('last_audit_id') is not None else None
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            print('Ignoring invalid checkpoint {}: {}'.format(self.filename, err))
+            self.checked_at = None
+            self.last_audit_id = None
 
+    def since(self):
+        """ :return: datetime from which audits are requested, None if there is no checkpoint """
+        if self.checked_at is None:
+            return None
+        return self.checked_at - self.overlap
 
-def update_samples(samples_to_update):
+    def date_flag(self):
+        """ :return: audit date_flag covering audits since checkpoint (less overlap) """
+        since = self.since()
+        if since is None:
+            return FULL_DATE_FLAG
+        return '{:%d/%m/%Y},{:%d/%m/%Y}'.format(since, datetime.date.today())
+
+    def is_new(self, state_change):
+        """ :return: True if audit id of state change is above the checkpoint (or there is no checkpoint or audit id) """
+        state_change_id = audit_id(state_change)
+        return self.last_audit_id is None or state_change_id is None or state_change_id > self.last_audit_id
+
+    def advance(self, state_change):
+        """ Record state change as processed (checkpoint is not written until save) """
+        state_change_id = audit_id(state_change)
+        if state_change_id is None:
+            self.without_id += 1
+            if self.without_id == 1:
+                print('Warning: audit has no numeric id ({!r}), state changes since {} are checked again'
+                      .format(state_change.get('audit_id'), self.since() or FULL_DATE_FLAG))
+        elif self.next_audit_id is None or state_change_id > self.next_audit_id:
+            self.next_audit_id = state_change_id
+
+    def save(self):
+        """ Write highest audit id processed and time of this run to checkpoint file """
+        data = {'last_audit_id': self.next_audit_id, 'checked_at': self.started.strftime(CHECKPOINT_DATE_FORMAT)}
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_filename, self.filename)
+        self.checked_at = self.started
+        self.last_audit_id = self.next_audit_id
+
+
+def audit_id(state_change):
+    """ :return: audit id (int) of state change, None if it has no numeric audit id """
+    try:
+        return int(state_change.get('audit_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def chunk_updates(samples_to_update, max_records=None, max_bytes=None):
+    """ Split updates into chunks of no more than max_records records and max_bytes of json
+
+    Parameters:
+        samples_to_update ([{}]): list of dictionaries containing fields to update (plus UID)
+        max_records (int): default update_chunk_records in config.ini
+        max_bytes (int): default update_chunk_bytes in config.ini (a single larger record is sent on its own)
+
+    Returns:
+        iterator of lists of updates
+    """
+    max_records = max_records or settings.UPDATE_CHUNK_RECORDS
+    max_bytes = max_bytes or settings.UPDATE_CHUNK_BYTES
+    chunk = []
+    size = 2  # []
+    for sample in samples_to_update:
+        record_size = len(json.dumps(sample)) + 2  # plus separator
+        if chunk and (len(chunk) >= max_records or size + record_size > max_bytes):
+            yield chunk
+            chunk = []
+            size = 2
+        chunk.append(sample)
+        size += record_size
+    if chunk:
+        yield chunk
+
+
+def update_samples(samples_to_update, max_records=None, max_bytes=None, in_flight=None, retries=None, retry_delay=None):
     """ Update Samples
+    Updates are sent in chunks (see chunk_updates), up to in_flight chunks are running as background jobs at once. 
+    Chunks that fail are submitted again up to retries times, after retry_delay seconds doubled for each attempt 
+    (other chunks are submitted meanwhile); chunks that succeeded are not resent.
 
     Parameters:
         samples_to_update ([{}]): list of dictionaries containing fields to update (plus UID)
+        max_records, max_bytes (int): maximum size of a chunk (default update_chunk_records, update_chunk_bytes in config.ini)
+        in_flight (int): number of chunks running at once (default update_chunks_in_flight in config.ini)
+        retries (int): number of times a failed chunk is resubmitted (default update_retries in config.ini)
+        retry_delay (float): seconds before a failed chunk is first resubmitted (default update_retry_delay in config.ini)
 
     Returns:
-        job_id (str): job id of background job started (will have completed by time method returns)
+        job_ids ([str]): job ids of background jobs completed (all will have completed by time method returns)
+        raises RuntimeError if any chunk still fails after retries (once all other chunks have completed)
     """
 
     if not samples_to_update:
-        return
-    update_response = freezerpro_post({'method': 'update_samples', 'background_job': 'true', 'json':json.dumps(samples_to_update)})
-    job_id = update_response['job_id']
-    while(True):
-        time.sleep(1)
-        completed_response = freezerpro_post({'method':'get_job_status', 'job_id':job_id})
-        if completed_response['status'] == 1:
-            raise RuntimeError(completed_response['msg'])
-        elif completed_response['status'] != 3:
-            break
-    return job_id
-
-
-def find_samplestates(date_flag):
+        return []
+    in_flight = in_flight or settings.UPDATE_CHUNKS_IN_FLIGHT
+    retries = retries if retries is not None else settings.UPDATE_RETRIES
+    retry_delay = retry_delay if retry_delay is not None else settings.UPDATE_RETRY_DELAY
+    started = time.time()
+    # heap of (time chunk may be submitted, order, chunk, attempt)
+    order = itertools.count()
+    queue = [(0, next(order), chunk, 0) for chunk in chunk_updates(samples_to_update, max_records, max_bytes)]
+    chunk_count = len(queue)
+    jobs = JobManager()
+    submitted = {}  # job_id: (chunk, attempt)
+    job_ids = []
+    failures = []
+
+    def chunk_failed(chunk, attempt, error):
+        if attempt < retries:
+            delay = retry_delay * 2 ** attempt
+            print('update_samples: chunk of {} records failed ({}), retrying in {:g}s'.format(len(chunk), error, delay))
+            heapq.heappush(queue, (time.time() + delay, next(order), chunk, attempt + 1))
+        else:
+            failures.append((chunk, error))
+
+    while queue or jobs.pending():
+        while queue and len(jobs.pending()) < in_flight and queue[0][0] <= time.time():
+            (not_before, _, chunk, attempt) = heapq.heappop(queue)
+            try:
+                job = jobs.submit({'method': 'update_samples', 'json':json.dumps(chunk)}, 'update_samples')
+                submitted[job['job_id']] = (chunk, attempt)
+            except Exception as err:
+                chunk_failed(chunk, attempt, err)
+        if queue and not jobs.pending():  # only chunks waiting to be retried
+            time.sleep(max(queue[0][0] - time.time(), 0))
+            continue
+        for job in jobs.wait(max_running=max(len(jobs.pending()) - 1, 0)):
+            (chunk, attempt) = submitted.pop(job['job_id'])
+            if job['status'] in (JOB_FAILED, JOB_TIMED_OUT):
+                chunk_failed(chunk, attempt, job['msg'])
+            else:
+                job_ids.append(job['job_id'])
+    invalidate_samples([sample['UID'] for sample in samples_to_update])
+    seconds = time.time() - started
+    print('update_samples: {} records in {} chunks in {:.1f}s ({:.0f} records/s)'
+          .format(len(samples_to_update), chunk_count, seconds, len(samples_to_update) / seconds if seconds else 0))
+    if failures:
+        raise RuntimeError('update_samples: {} of {} chunks ({} records) failed: {}'
+                           .format(len(failures), chunk_count, sum(len(chunk) for chunk, error in failures), 
+                                   '; '.join(str(error) for chunk, error in failures)))
+    return job_ids
+
+
+# SampleState of a sample is that of its highest ranked vial
+NO_STATE = 0  # state code of vial without a state
+SAMPLESTATE_RANK = {int(Vial_States.AwaitingDelivery): 4,
+                    int(Vial_States.Returned): 3,
+                    int(Vial_States.Disposed): 2,
+                    int(Vial_States.SampleDestroyed): 2,
+                    int(Vial_States.SampleFinished): 2}
+OTHER_STATE_RANK = 1  # any other vial state (including states not in Vial_States)
+SAMPLESTATE_OF_RANK = {4: 'Awaiting Delivery', 3: 'Returned', 2: 'Disposed', 1: 'Current', 0: None}
+
+
+def vial_table(vial_states_of_samples):
+    """ Table of vial states
+    Args:
+        vial_states_of_samples: dict of sample_id: list of vial state_info (as returned by get_vials_bulk)
+    Returns:
+        DataFrame: columns sample_id and state (Vial_States code, NO_STATE if vial has no state, -1 if state not known)
+    """
+    rows = [(sample_id, state_info) for sample_id, vial_states in vial_states_of_samples.items() for state_info in vial_states]
+    vials = pd.DataFrame(rows, columns=['sample_id', 'state_info'])
+    codes = vials['state_info'].map(STATE_ID)
+    has_state = vials['state_info'].notna() & (vials['state_info'] != '')
+    vials['state'] = codes.where(codes.notna(), -1).where(has_state, NO_STATE).astype(int)
+    return vials[['sample_id', 'state']]
+
+
+def classify_samplestates(vials, sample_ids=None):
+    """ SampleState of each sample from the states of its vials (one grouped pass over all vials)
+        Awaiting Delivery if ANY vial AwaitingDelivery
+        Returned if ANY vial Returned
+        Disposed if ANY vial Disposed, SampleDestroyed or SampleFinished
+        Current if ANY vial has some other state
+        None if no vial has a state
+    Args:
+        vials: DataFrame with columns sample_id and state (Vial_States code), see vial_table
+        sample_ids: samples to classify (default all samples in vials)
+    Returns:
+        dict: sample_id: SampleState
+    """
+    ranks = vials['state'].map(SAMPLESTATE_RANK).fillna(OTHER_STATE_RANK).where(vials['state'] != NO_STATE, 0)
+    sample_ranks = ranks.groupby(vials['sample_id'], sort=False).max()
+    if sample_ids is not None:
+        sample_ranks = sample_ranks.reindex(list(sample_ids), fill_value=0)
+    return {sample_id: SAMPLESTATE_OF_RANK[int(rank)] for sample_id, rank in sample_ranks.items()}
+
+
+def find_samplestates(date_flag, checkpoint=None):
     """ Find samples that have SampleState not matching vial states.
     Search audits within defined date range for vial state changes.
     Set sample SampleState and SampleStateDate UDf fields where wrong.
 
     Parameters:
         date_flag (str): range of audits to check. Values include 'today', 'yesterday', 'week', 'month', 'all', 'dd/mm/yyy,dd/mm/yyyy' 
+        checkpoint (AuditCheckpoint): optional, skip state changes with audit id not above checkpoint and advance 
+            checkpoint to the highest audit id checked
 
     Returns:
         ([{}], set): tuple of samples that need updating and a set of sample types that do not have SampleState udf (and state changed)
     """
 
-    samples_to_update = {}
+    last_state_change = {}
     sample_type_missing_udf = set()
-    sample_state_changes = samples_with_state_changes(date_flag)
-    for state_change in sample_state_changes[:]:
-        sampleid = state_change['sample_id']
-        udfs = get_sample_userfields(sampleid)
-        current_state = udfs.get('SampleState', None)
-        vials = get_vials(sampleid)
-        if any(vial['state_info'] == STATE_NAME[Vial_States.AwaitingDelivery] for vial in vials):
-            new_state = 'Awaiting Delivery'
-        elif any(vial['state_info'] == STATE_NAME[Vial_States.Returned] for vial in vials):
-            new_state = 'Returned'
-        elif any(vial['state_info'] == STATE_NAME[Vial_States.Disposed] or \
-                 vial['state_info'] == STATE_NAME[Vial_States.SampleDestroyed] or \
-                 vial['state_info'] == STATE_NAME[Vial_States.SampleFinished] for vial in vials):
-            new_state = 'Disposed'
-        else:
-            new_state = 'Current'
-
-        if current_state != new_state:
-            # print('Update state of sample {} from {} to {}'.format(sampleid, current_state, new_state))
-            samples_to_update[sampleid] = {'UID':sampleid, 
-                                           'SampleState': new_state, 
-                                           'SampleStateDate': state_change['date']}
-    return (list(samples_to_update.values()), sample_type_missing_udf)
+    for state_change in iter_samples_with_state_changes(date_flag):
+        if checkpoint:
+            if not checkpoint.is_new(state_change):
+                continue
+            checkpoint.advance(state_change)
+        last_state_change[state_change['sample_id']] = state_change
+    current_states = {sampleid: get_sample_userfields(sampleid).get('SampleState', None) for sampleid in last_state_change}
+    new_states = classify_samplestates(vial_table(get_vials_bulk(last_state_change)), 
+                                       last_state_change)
+    samples_to_update = []
+    for sampleid, state_change in last_state_change.items():
+        new_state = new_states[sampleid] or 'Current'
+        if current_states[sampleid] != new_state:
+            # print('Update state of sample {} from {} to {}'.format(sampleid, current_states[sampleid], new_state))
+            samples_to_update.append({'UID':sampleid, 
+                                      'SampleState': new_state, 
+                                      'SampleStateDate': state_change['date']})
+    return (samples_to_update, sample_type_missing_udf)
 
 
 def find_SampleStateByVialState(vial_state):
@@ -85,42 +318,28 @@ def find_SampleStateByVialState(vial_state):
     Returns:
         list(dict): dict of sample ids, samplestate, samplestatedate (UID, SampleState, SampleStateDate) that shoudl be updated
     """
-    samples_to_update = {}
-    vials = get_locations_in_state(vial_state)
-    for vial in vials:
-        sampleid = state_change['sample_id']
-        udfs = get_sample_userfields(sampleid)
-        current_state = udfs.get('SampleState', None)
-        sample_vials = get_vials(sampleid)
-        new_state = None
-        if any(vial['state_info'] == STATE_NAME[Vial_States.AwaitingDelivery] for vial in sample_vials):
-            new_state = 'Awaiting Delivery'
-        elif any(vial['state_info'] == STATE_NAME[Vial_States.Returned] for vial in sample_vials):
-            new_state = 'Returned'
-        elif any(vial['state_info'] == STATE_NAME[Vial_States.Disposed] or \
-                 vial['state_info'] == STATE_NAME[Vial_States.SampleDestroyed] or \
-                 vial['state_info'] == STATE_NAME[Vial_States.SampleFinished] for vial in sample_vials):
-            new_state = 'Disposed'
-        elif any(vial['state_info']):  # set to Current if some vial has non-empty state
-            new_state = 'Current'        
-        else:
-            new_state = current_state  # don't change state if no vial has non-empty state
+    sampleids = list(dict.fromkeys(vial['sample_id'] for vial in iter_locations_in_state(vial_state)))
+    current_states = {sampleid: get_sample_userfields(sampleid).get('SampleState', None) for sampleid in sampleids}
+    new_states = classify_samplestates(vial_table(get_vials_bulk(sampleids)), sampleids)
+    samples_to_update = []
+    for sampleid in sampleids:
+        current_state = current_states[sampleid]
+        new_state = new_states[sampleid] or current_state  # don't change state if no vial has non-empty state
         if current_state != new_state:
             print('Update state of sample {} from {} to {}'.format(sampleid, current_state, new_state))
-            samples_to_update[sampleid] = {'UID':sampleid, 
-                                               'SampleState': new_state, 
-                                               'SampleStateDate': datetime.datetime.now().date()}
-    return list(samples_to_update.values())
+            samples_to_update.append({'UID':sampleid, 
+                                      'SampleState': new_state, 
+                                      'SampleStateDate': datetime.datetime.now().date().strftime('%d/%m/%Y')})
+    return samples_to_update
 
 
-def find_SampleStateBySampleType(sampletypes):
-    """ Find SampleStates for samples with specified sample types that need updating
+def get_samples_of_types(sampletypes):
+    """ Samples (id, sample_type_name and SampleState udf) with specified sample types
     Args:
         sampletypes: [list(str)] list of sample types names
     Returns:
-        list(dict): dict of sample ids, samplestate, samplestatedate (UID, SampleState, SampleStateDate) that shoudl be updated
+        list(dict): samples in order of id
     """
-    samples_to_update = {}
     samples = freezerpro_retrieve({'method': 'advanced_search',
                                    'query': [{'type': 'sdf',
                                               'field': 'sample_type_name',
@@ -132,74 +351,162 @@ def find_SampleStateBySampleType(sampletypes):
                                    'udfs': ['SampleState'],
                                   },
                                  'Samples')
+    return sorted({sample['id']: sample for sample in samples}.values(), key=lambda sample: int(sample['id']))
+
+
+def find_SampleStateBySampleType(sampletypes):
+    """ Find SampleStates for samples with specified sample types that need updating
+    Args:
+        sampletypes: [list(str)] list of sample types names
+    Returns:
+        list(dict): dict of sample ids, samplestate, samplestatedate (UID, SampleState, SampleStateDate) that shoudl be updated
+    """
+    samples = get_samples_of_types(sampletypes)
     print('Found {} samples'.format(len(samples)))
+    return find_SampleStateOfSamples(samples)
+
+
+def find_SampleStateOfSamples(samples):
+    """ Find SampleStates that need updating for samples (as returned by get_samples_of_types)
+    Returns:
+        list(dict): dict of sample ids, samplestate, samplestatedate (UID, SampleState, SampleStateDate) that shoudl be updated
+    """
+    new_states = classify_samplestates(vial_table(get_vials_bulk([sample['id'] for sample in samples])), 
+                                       [sample['id'] for sample in samples])
+    samples_to_update = []
     for sample in samples:
         current_state = sample['udfs'].get('SampleState', None)
-        sample_vials = get_vials(sample['id'])
-        #print(state_change['date'], state_change['type'], 'for sample', state_change['sample_id'], 'by', state_change['user_name'])
-        #print(sample)
-        #print(current_state)
-        #print([vial['state_info'] for vial in vials])
-        new_state = None
-        if any(vial['state_info'] == STATE_NAME[Vial_States.AwaitingDelivery] for vial in sample_vials):
-            new_state = 'Awaiting Delivery'
-        elif any(vial['state_info'] == STATE_NAME[Vial_States.Returned] for vial in sample_vials):
-            new_state = 'Returned'
-        elif any(vial['state_info'] == STATE_NAME[Vial_States.Disposed] or \
-                 vial['state_info'] == STATE_NAME[Vial_States.SampleDestroyed] or \
-                 vial['state_info'] == STATE_NAME[Vial_States.SampleFinished] for vial in sample_vials):
-            new_state = 'Disposed'
-        elif any(vial['state_info'] for vial in sample_vials):  # set to Current if some vial has non-empty state
-            new_state = 'Current'
-        else:
-            new_state = current_state  #'Current' # don't change samples where no vial state has been set
+        new_state = new_states[sample['id']] or current_state  #'Current' # don't change samples where no vial state has been set
         if current_state != new_state:
             # print('Update state of sample {} from {} to {}'.format(sample['id'], current_state, new_state))
-            samples_to_update[sample['id']] = {'UID':sample['id'], 
-                                               'SampleState': new_state, 
-                                               'SampleStateDate': datetime.datetime.now().date().strftime('%d/%m/%Y')}
-    return list(samples_to_update.values())
+            samples_to_update.append({'UID':sample['id'], 
+                                      'SampleState': new_state, 
+                                      'SampleStateDate': datetime.datetime.now().date().strftime('%d/%m/%Y')})
+    return samples_to_update
+
+
+def update_sample_range(sampletype, samples):
+    """ Update SampleState of samples (all of sampletype, in order of id)
+    Returns:
+        dict: sampletype, first_id, last_id, samples, updated, seconds
+    """
+    started = time.time()
+    samples_to_update = find_SampleStateOfSamples(samples)
+    if samples_to_update:
+        update_samples(samples_to_update)
+    return {'sampletype': sampletype, 
+            'first_id': samples[0]['id'], 
+            'last_id': samples[-1]['id'], 
+            'samples': len(samples), 
+            'updated': len(samples_to_update), 
+            'seconds': time.time() - started}
 
 
-def update_all_samples():
+def update_all_samples(workers=None, split_size=None):
     """ Update samplestate of all samples where sampletype has field SampleState
+    Sample types, and ranges of split_size samples (by id) of large sample types, are processed concurrently
+    by workers threads.
+    Args:
+        workers: number of sample ranges processed at once (default update_workers in config.ini)
+        split_size: maximum number of samples in a range (default update_split_size in config.ini)
+    Returns:
+        list(dict): failures (sampletype, first_id, last_id, samples, error), empty if all samples were processed
     """
-    bFailure = false
+    workers = workers or settings.UPDATE_WORKERS
+    split_size = split_size or settings.UPDATE_SPLIT_SIZE
+    started = time.time()
+    failures = []
     sampletypes = get_sampletypes()
     sampletypes_with_samplestate = [sampletype['name'] for sampletype in sampletypes if 'SampleState' in sampletype['fieldlist']]
-    for sampletype in sampletypes_with_samplestate:
-        try:
-            print(sampletype)
-            samples_to_update = find_SampleStateBySampleType([sampletype])
-            if samples_to_update:
-                # print(samples_to_update)
-                print(len(samples_to_update))
-                update_samples(samples_to_update)
-                print('Completed Update')
-        except Exception as err:
-            print('Failed to process', err)
-            bFailure = true
-    return bFailure
+    with RunCache(), ThreadPoolExecutor(max_workers=workers) as executor:
+        samples_of_types = {}
+        for sampletype, future in [(sampletype, executor.submit(get_samples_of_types, [sampletype])) 
+                                   for sampletype in sampletypes_with_samplestate]:
+            try:
+                samples_of_types[sampletype] = future.result()
+            except Exception as err:
+                failures.append({'sampletype': sampletype, 'first_id': None, 'last_id': None, 'samples': None, 'error': err})
+        if any(vials_by_state(min(len(samples), split_size)) for samples in samples_of_types.values()):
+            get_vial_states_by_sample()  # vials are retrieved by state once (held by RunCache) for all sample ranges
+        futures = {}
+        for sampletype, samples in samples_of_types.items():
+            print('{}: {} samples'.format(sampletype, len(samples)))
+            for i in range(0, len(samples), split_size):
+                sample_range = samples[i:i + split_size]
+                futures[executor.submit(update_sample_range, sampletype, sample_range)] = \
+                    {'sampletype': sampletype, 'first_id': sample_range[0]['id'], 'last_id': sample_range[-1]['id'], 
+                     'samples': len(sample_range)}
+        remaining = Counter(sample_range['sampletype'] for sample_range in futures.values())
+        updated = Counter()
+        for count, future in enumerate(as_completed(futures), 1):
+            sample_range = futures[future]
+            sampletype = sample_range['sampletype']
+            try:
+                result = future.result()
+                updated[sampletype] += result['updated']
+                print('{} ids {}-{}: {} samples, {} updated in {:.1f}s ({}/{} ranges)'
+                      .format(sampletype, result['first_id'], result['last_id'], result['samples'], result['updated'], 
+                              result['seconds'], count, len(futures)))
+            except Exception as err:
+                failures.append(dict(sample_range, error=err))
+                print('{} ids {}-{}: failed {} ({}/{} ranges)'
+                      .format(sampletype, sample_range['first_id'], sample_range['last_id'], err, count, len(futures)))
+            remaining[sampletype] -= 1
+            if remaining[sampletype] == 0:
+                print('{}: completed, {} updated at {:.1f}s'.format(sampletype, updated[sampletype], time.time() - started))
+    print('Processed {} sample types in {:.1f}s, {} failures'
+          .format(len(sampletypes_with_samplestate), time.time() - started, len(failures)))
+    return failures
 
 
-if __name__ == '__main__':
-    try:
+def failure_report(failures):
+    """ Text describing failures returned by update_all_samples """
+    return '\n'.join('{} ids {}-{} ({} samples): {}'.format(failure['sampletype'], failure['first_id'], failure['last_id'], 
+                                                           failure['samples'], failure['error'])
+                     if failure['samples'] is not None else 
+                     '{}: failed to retrieve samples: {}'.format(failure['sampletype'], failure['error'])
+                     for failure in failures)
+
+
+def main(checkpoint=None):
+    """ Update SampleState of samples with state changes since the checkpoint, then save the checkpoint
+    (not saved if finding or updating samples fails, so the next run checks the same audits again)
+    :param checkpoint: AuditCheckpoint (default checkpoint_file in config.ini)
+    """
+    checkpoint = checkpoint or AuditCheckpoint()
+    with RunCache() as cache:
         #(samples_to_update, sample_type_missing_udf) = find_samplestates('all')
         #(samples_to_update, sample_type_missing_udf) = set_SampleState(Vial_States.SampleFinished)
         #(samples_to_update, sample_type_missing_udf) = set_SampleState(Vial_States.Disposed)
         #(samples_to_update, sample_type_missing_udf) = set_SampleState(Vial_States.Returned)
         #(samples_to_update, sample_type_missing_udf) = set_SampleState(Vial_States.AwaitingDelivery)
-        (samples_to_update, sample_type_missing_udf) = find_samplestates('week')
+        (samples_to_update, sample_type_missing_udf) = find_samplestates(checkpoint.date_flag(), checkpoint)
         #(samples_to_update, sample_type_missing_udf) = find_samplestates('yesterday')
-        if samples_to_update:
-            # print(samples_to_update)
-            print(len(samples_to_update))
-            update_samples(samples_to_update)
-            print('Completed Update')
-        if sample_type_missing_udf:
-            email_Support('SamplePro Sample Types missing SampleState and SampleStateDate UDF', 
-                          'The following sample types do not have user-defined fields "SampleState" and "SampleStateDate"\n'+
-                          '\n'.join(sample_type_missing_udf))
+        print('Cache', cache.stats())
+    if samples_to_update:
+        # print(samples_to_update)
+        print(len(samples_to_update))
+        update_samples(samples_to_update)
+        print('Completed Update')
+    checkpoint.save()
+    if sample_type_missing_udf:
+        email_Support('SamplePro Sample Types missing SampleState and SampleStateDate UDF', 
+                      'The following sample types do not have user-defined fields "SampleState" and "SampleStateDate"\n'+
+                      '\n'.join(sample_type_missing_udf))
+
+
+if __name__ == '__main__':
+    if '--all' in sys.argv:
+        try:
+            failures = update_all_samples()
+            if failures:
+                email_Support('SamplePro error in UpdateSampleStateUDF update_all_samples', 
+                              'Failed to update {} sample ranges\n'.format(len(failures)) + failure_report(failures))
+        except Exception as err:
+            email_Support('SamplePro error in UpdateSampleStateUDF', err )
+        sys.exit()
+    try:
+        main()
     except Exception as err:
         # print(err)
         email_Support('SamplePro error in UpdateSampleStateUDF', err )
\ No newline at end of file
@@ -0,0 +1,74 @@
+#! python3
+""" Benchmark of peak memory when filtering audits with get_audit (list) and iter_audit (generator)
+get_audit holds every audit record before any are filtered, iter_audit only holds the pages being requested.
+freezerpro_post is replaced by a function returning pages of generated audits (no api calls are made),
+peak memory is traced with tracemalloc for serial (1) and concurrent (4) page requests.
+
+Usage:
+    python benchmark_audit_memory.py [number of audits]   # default 50000
+"""
+
+import sys
+import time
+import tracemalloc
+import FreezerPro
+from FreezerPro import get_audit, iter_audit, settings, STATE_NAME, PAGE_LIMIT
+
+STATE_NAMES = list(STATE_NAME.values())
+
+
+def make_audit(i):
+    """ generated audit record i (about 1% are not vial state changes) """
+    state = STATE_NAMES[i % len(STATE_NAMES)]
+    if i % 97 == 0:
+        message = 'Sample <u>"S{}"</u> updated'.format(i)
+    else:
+        message = 'State for vial <u>"Box {}"</u> in box ID: <u>{}</u> changed from "\'{}\'" to "\'{}\'"'.format(
+            i % 81, 1000 + i % 5000, STATE_NAMES[(i + 1) % len(STATE_NAMES)], state)
+    return {'id': i + 1, 'obj_name': state, 'created_at': '01/01/2020 10:00:00', 'user_name': 'User',
+            'message': message, 'comments': ''}
+
+
+def audit_pages(count, latency):
+    """ :return: replacement for freezerpro_post serving count audits a page at a time """
+    def post(params):
+        time.sleep(latency)
+        start = params.get('start', 0)
+        end = min(start + params.get('limit', PAGE_LIMIT), count)
+        return {'Total': count, 'AuditRec': [make_audit(i) for i in range(start, end)]}
+    return post
+
+
+def filter_list(state):
+    return sum(1 for audit in get_audit('all') if audit['obj_name'] == state)
+
+
+def filter_iter(state):
+    return sum(1 for audit in iter_audit('all') if audit['obj_name'] == state)
+
+
+def peak_memory(function, *args):
+    """ :return: (result, peak traced memory in MB) """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        return (result, tracemalloc.get_traced_memory()[1] / 1e6)
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(count=50000, latency=0.001):
+    FreezerPro.freezerpro_post = audit_pages(count, latency)
+    state = STATE_NAMES[0]
+    print('{} audits'.format(count))
+    for function, name in ((filter_list, "get_audit('all')"), (filter_iter, "iter_audit('all')")):
+        peaks = []
+        for workers in (1, 4):
+            settings.RETRIEVE_WORKERS = workers
+            (found, peak) = peak_memory(function, state)
+            peaks.append('workers={}: {:6.1f} MB'.format(workers, peak))
+        print('{:18} {} ({} {})'.format(name, '   '.join(peaks), found, state))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,84 @@
+#! python3
+""" Microbenchmark of parse_state_changes (audit messages -> state changes)
+Compares the page at a time parser with the previous per message re.match loop, using generated audits
+(no api calls are made). Best of 3 runs is reported.
+
+Usage:
+    python benchmark_audit_parser.py [number of audits]   # default 100000
+"""
+
+import re
+import sys
+import time
+from FreezerPro import parse_state_changes, STATE_NAME, PAGE_LIMIT
+
+
+def make_audits(count):
+    """ generate count audits, about 1% of which are not vial state changes """
+    state_names = list(STATE_NAME.values())
+    audits = []
+    for i in range(count):
+        state = state_names[i % len(state_names)]
+        if i % 97 == 0:
+            message = 'Sample <u>"S{}"</u> updated'.format(i)
+        else:
+            message = 'State for vial <u>"Box {}"</u> in box ID: <u>{}</u> changed from "\'{}\'" to "\'{}\'"'.format(
+                i % 81, 1000 + i % 5000, state_names[(i + 1) % len(state_names)], state)
+        audits.append({'id': i + 1, 'obj_name': state, 'created_at': '01/01/2020 10:00:00', 'user_name': 'User',
+                       'message': message, 'comments': ''})
+    return audits
+
+
+def parse_loop(audits):
+    """ one re.match per message (as previously done by samples_with_state_changes) """
+    pattern = 'State for vial <u>"(.*?)"<\/u>(?:.*?) ID: <u>(\d+)<\/u> changed from "(.*?)" to "(.*?)"'
+    state_changes = []
+    for audit in audits:
+        match = re.match(pattern, audit['message'])
+        if not match:
+            continue
+        state_changes.append({'type': audit['obj_name'],
+                              'date': audit['created_at'],
+                              'user_name': audit['user_name'],
+                              'message': audit['message'],
+                              'comments': audit['comments'],
+                              'vial_location': match.groups()[0],
+                              'sample_id': match.groups()[1],
+                              'from_state': match.groups()[2],
+                              'to_state': match.groups()[3]})
+    return state_changes
+
+
+def parse_pages(audits):
+    state_changes = []
+    unmatched = []
+    for i in range(0, len(audits), PAGE_LIMIT):
+        (page_state_changes, page_unmatched) = parse_state_changes(audits[i:i + PAGE_LIMIT])
+        state_changes.extend(page_state_changes)
+        unmatched.extend(page_unmatched)
+    return (state_changes, unmatched)
+
+
+def best_time(function, audits, repeat=3):
+    """ :return: (result, shortest run time in seconds) """
+    seconds = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        result = function(audits)
+        seconds.append(time.perf_counter() - started)
+    return (result, min(seconds))
+
+
+def benchmark(count):
+    audits = make_audits(count)
+    (loop_state_changes, loop_seconds) = best_time(parse_loop, audits)
+    ((state_changes, unmatched), pages_seconds) = best_time(parse_pages, audits)
+    if [state_change['sample_id'] for state_change in state_changes] != [state_change['sample_id'] for state_change in loop_state_changes]:
+        raise RuntimeError('parse_state_changes results differ from loop')
+    print('{} audits, {} state changes, {} not recognised'.format(count, len(state_changes), len(unmatched)))
+    print('re.match loop:        {:8.3f}s {:10.0f} records/s'.format(loop_seconds, count / loop_seconds))
+    print('parse_state_changes:  {:8.3f}s {:10.0f} records/s'.format(pages_seconds, count / pages_seconds))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,73 @@
+#! python3
+""" Benchmark of dict_to_html against the pandas DataFrame.to_html version it replaced
+Reports the time to import pandas (no longer needed by the email scripts) and the time to render tables of
+typical sizes, and checks the html matches pandas for tables of strings and integers.
+
+Usage:
+    python benchmark_dict_to_html.py
+"""
+
+import subprocess
+import sys
+import time
+from FreezerPro import dict_to_html
+
+KEYS = ['id', 'Review Date', 'location']
+HEADERS = ['Sample Id', 'Review Date', 'Location']
+
+
+def pandas_dict_to_html(data, keys, headers):
+    """ previous dict_to_html """
+    import pandas as pd
+    pd.set_option('display.max_colwidth', 999)
+    df = pd.DataFrame(data)[keys]
+    df.columns = headers
+    return df.to_html(escape=False, index=False)
+
+
+def make_rows(count):
+    return [{'id': 1000 + i, 'Review Date': '{:02d}/10/2026'.format(1 + i % 28),
+             'location': 'Freezer {} &rarr; Rack {} &rarr; <b>Box {}</b>'.format(i % 7, i % 13, i)}
+            for i in range(count)]
+
+
+def import_seconds(statement, repeat=3):
+    """ shortest time to run python -c statement in a new interpreter """
+    seconds = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True)
+        seconds.append(time.perf_counter() - started)
+    return min(seconds)
+
+
+def render_seconds(function, rows, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        function(rows, KEYS, HEADERS)
+    return (time.perf_counter() - started) / repeat
+
+
+def benchmark():
+    try:
+        import pandas  # noqa: F401 (only needed for comparison)
+    except ImportError:
+        print('pandas not installed, only dict_to_html is timed')
+        pandas = None
+    baseline = import_seconds('pass')
+    print('python startup:            {:8.1f} ms'.format(baseline * 1000))
+    if pandas:
+        print('import pandas:           + {:8.1f} ms'.format((import_seconds('import pandas') - baseline) * 1000))
+    for count in (5, 50, 500):
+        rows = make_rows(count)
+        repeat = max(10, 5000 // count)
+        line = '{:4} rows  dict_to_html {:8.3f} ms'.format(count, render_seconds(dict_to_html, rows, repeat) * 1000)
+        if pandas:
+            if dict_to_html(rows, KEYS, HEADERS) != pandas_dict_to_html(rows, KEYS, HEADERS):
+                raise RuntimeError('dict_to_html output differs from pandas for {} rows'.format(count))
+            line += '  pandas {:8.3f} ms'.format(render_seconds(pandas_dict_to_html, rows, repeat) * 1000)
+        print(line)
+
+
+if __name__ == '__main__':
+    benchmark()
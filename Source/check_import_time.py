@@ -0,0 +1,56 @@
+#! python3
+""" Check that importing FreezerPro (and the scripts run by Scheduler.py that build on it) stays fast
+Runs python -X importtime -c "import FreezerPro" in a new interpreter for each of CHECKED_MODULES and fails (exit code 1)
+when an import takes longer than the budget, or when a module that is only needed to call the api or send email 
+(requests, keyring, smtplib, email.mime, pandas) is imported by it.
+Config.ini is not read when FreezerPro is imported, so the check does not need config.ini or a password.
+
+Usage:
+    python check_import_time.py [budget in ms]   # default 150
+"""
+
+import os
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = 150
+DEFERRED_MODULES = ['requests', 'urllib3', 'keyring', 'smtplib', 'email.mime', 'pandas']
+CHECKED_MODULES = ['FreezerPro', 'Scheduler', 'MailOutbox', 'SampleMirror', 'EmailOwnersReviewDates', 'EmailOwnersSamplesNearingReviewDate', 
+                   'EmailOwnersSamplesReviewDateOverdue']
+
+
+def import_times(module='FreezerPro'):
+    """ :return: dictionary of module name: cumulative import time in microseconds, for python -X importtime """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError('import {} failed:\n{}'.format(module, result.stderr))
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        (self_us, cumulative_us, name) = line[len('import time:'):].split('|')
+        if cumulative_us.strip().isdigit():
+            times[name.strip()] = int(cumulative_us)
+    return times
+
+
+def check(budget_ms=DEFAULT_BUDGET_MS, module='FreezerPro'):
+    """ :return: True if import module is within budget_ms and imports none of DEFERRED_MODULES """
+    times = import_times(module)
+    total_ms = times[module] / 1000
+    deferred = [deferred_module for deferred_module in DEFERRED_MODULES
+                if any(name == deferred_module or name.startswith(deferred_module + '.') for name in times)]
+    print('import {}: {:.1f} ms (budget {} ms)'.format(module, total_ms, budget_ms))
+    for (name, us) in sorted(times.items(), key=lambda item: -item[1])[1:6]:
+        print('    {:30} {:8.1f} ms'.format(name, us / 1000))
+    if deferred:
+        print('imported by {} but should be imported when first needed: {}'.format(module, ', '.join(deferred)))
+    return total_ms <= budget_ms and not deferred
+
+
+if __name__ == '__main__':
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    sys.exit(0 if all([check(budget_ms, module) for module in CHECKED_MODULES]) else 1)
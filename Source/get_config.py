@@ -14,9 +14,46 @@ Checks that config.ini exists and has required fields
     support_email = 
 
 Optional field:
+    [FreezerPro]
+    pool_connections = # number of connection pools to cache (default 1)
+    pool_maxsize = # maximum number of connections kept open for reuse (default 10)
+    keep_alive = True | False  # if false connections are closed after every api call (default True)
+    retrieve_workers = # number of pages of results requested at once (default 1, keep <= pool_maxsize)
+    user_directory_ttl = # seconds before list of users is downloaded again (default 3600)
+    run_cache_size = # maximum number of api results held by RunCache (default 10000)
+    bulk_search_ids = # number of sample ids looked up per advanced_search by get_samples_bulk (default 500)
+    vials_bulk_threshold = # number of samples from which get_vials_bulk checks the size of the inventory to retrieve vials by state instead of per sample (default 500)
+    async_concurrency = # number of api calls AsyncFreezerPro makes at once (default 8, keep <= pool_maxsize)
+    token_lifetime = # seconds authorization token remains valid after last use (default 600)
+    token_refresh_margin = # seconds before expiry that token is renewed (default 60)
+    token_cache_file = # file used to share token between processes (default SamplePro_token.json in temp folder)
+    job_timeout = # seconds a background job may run before it is reported as failed (default 3600)
+    job_poll_max = # maximum seconds between checks of a running background job (default 10)
+    update_workers = # number of sample ranges UpdateSampleStateUDF.py --all processes at once (default 4, keep <= pool_maxsize)
+    update_split_size = # maximum number of samples in a range processed by UpdateSampleStateUDF.py --all (default 2000)
+    update_chunk_records = # maximum number of records sent in one update_samples job (default 1000)
+    update_chunk_bytes = # maximum bytes of json sent in one update_samples job (default 1000000)
+    update_chunks_in_flight = # number of update_samples jobs running at once (default 2)
+    update_retries = # number of times a failed update_samples job is resubmitted (default 2)
+    update_retry_delay = # seconds before a failed update_samples job is first resubmitted, doubled for each retry (default 10)
+
+    [MailServer]
+    smtp_connections = # number of SMTP connections MailDispatcher keeps open (default 1)
+    outbox_dir = # when set, emails are written to this folder and sent by MailOutbox.py
+    outbox_workers = # number of emails MailOutbox.py sends at once (default 4)
+    outbox_max_attempts = # attempts to send an email before it is moved to outbox_dir\failed (default 10)
+    outbox_retry_delay = # seconds before first retry of an email, doubled after each attempt (default 60)
+
     [System]
     email_support_only = True | False  # if true will only send emails to support_email address (default False)
     send_email_from = # default 'SamplePro <donotreply@scionresearch.com>'
+    mirror_file = # path of SQLite mirror of samples (SampleMirror.py), review date reports use it when set
+    mirror_max_age = # seconds after which mirror is refreshed before use (default 3600)
+    checkpoint_file = # file where UpdateSampleStateUDF.py keeps id of last audit processed (default next to config.ini)
+    checkpoint_overlap = # minutes before the last run from which UpdateSampleStateUDF.py requests audits (default 60)
+
+    [Schedule]
+    ScriptName = # cron schedule (minute hour day month weekday) of script run by Scheduler.py e.g. 0 8-15 * * *
 
 
 Author: Wayne Schou
@@ -0,0 +1,85 @@
+""" Tests of AsyncFreezerPro against StubFreezerPro (a local FreezerPro api)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+from unittest import mock
+from stub_servers import StubFreezerPro, use_settings, PASSWORD
+import AsyncFreezerPro
+from AsyncFreezerPro import fetch_many
+
+
+def make_samples(count):
+    samples = {sample_id: {'id': sample_id, 'name': 'S{}'.format(sample_id), 'location': 'Box {}'.format(sample_id % 5),
+                           'udfs': {'Approval Contact': 'User {}'.format(sample_id % 3)}}
+               for sample_id in range(1000, 1000 + count)}
+    del samples[1000]['udfs']['Approval Contact']
+    return samples
+
+
+def make_vials(sample_ids):
+    return [{'id': vial_id, 'sample_id': sample_id, 'state_id': 3 if vial_id % 2 else 9,
+             'state_info': 'Stored' if vial_id % 2 else 'Disposed'}
+            for vial_id, sample_id in enumerate(sample_ids, 1)]
+
+
+class AsyncFreezerProTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('keyring.get_password', return_value=PASSWORD)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, **kwargs):
+        server = StubFreezerPro(**kwargs).__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+        use_settings(api_url=server.url)
+        return server
+
+    def test_fetch_many_returns_results_in_order(self):
+        samples = make_samples(30)
+        server = self.serve(samples=samples)
+        sample_ids = list(reversed(list(samples)))
+        results = fetch_many('get_sample', sample_ids)
+        self.assertEqual([result['id'] for result in results], sample_ids)
+        self.assertEqual(server.calls['sample_info'], len(sample_ids))
+
+    def test_concurrency_is_bounded(self):
+        samples = make_samples(24)
+        server = self.serve(samples=samples, latency=0.05)
+        fetch_many('get_sample_userfields', list(samples), concurrency=4)
+        self.assertGreater(server.max_in_flight, 1)
+        self.assertLessEqual(server.max_in_flight, 4)
+
+    def test_retrieve_requests_all_pages(self):
+        samples = make_samples(10)
+        server = self.serve(samples=samples, vials=make_vials(list(samples) * 2), page_size=3)
+        client = AsyncFreezerPro.AsyncFreezerPro()
+        locations = AsyncFreezerPro.run(client.get_locations_in_state(3))
+        client.close()
+        self.assertEqual(sorted(location['id'] for location in locations), list(range(1, 21, 2)))
+        self.assertEqual(server.calls['vials_sample'], 4)
+
+    def test_locations_in_state_udfs_retrieved_in_bulk(self):
+        samples = make_samples(12)
+        server = self.serve(samples=samples, vials=make_vials(list(samples)))
+        client = AsyncFreezerPro.AsyncFreezerPro()
+        for state in (3, 9):
+            locations = AsyncFreezerPro.run(client.get_locations_in_state(state, ['Approval Contact']))
+            self.assertEqual(len(locations), 6)
+            for location in locations:  # None where sample does not have udf (sample 1000)
+                self.assertEqual(location['Approval Contact'], samples[location['sample_id']]['udfs'].get('Approval Contact'))
+        client.close()
+        self.assertEqual(server.calls['sample_userfields'], 0)
+        self.assertEqual(server.calls['advanced_search'], 2)
+
+    def test_results_are_same_as_sync_functions(self):
+        import FreezerPro
+        samples = make_samples(5)
+        self.serve(samples=samples, vials=make_vials(list(samples) * 3))
+        self.assertEqual(fetch_many('get_vials', list(samples)), [FreezerPro.get_vials(sample_id) for sample_id in samples])
+        self.assertEqual(fetch_many('get_sample', list(samples)), [FreezerPro.get_sample(sample_id) for sample_id in samples])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+""" Tests of parse_state_changes (audit messages -> vial state changes, no api calls are made)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+import stub_servers  # noqa: F401 (puts Source on the path)
+from FreezerPro import parse_state_changes
+
+STATE_CHANGE = 'State for vial <u>"{}"</u> in box ID: <u>{}</u> changed from "\'{}\'" to "\'{}\'"'
+
+
+def audit(audit_id, message, obj_name='Disposed'):
+    return {'id': audit_id, 'obj_name': obj_name, 'created_at': '02/03/2026 10:15:00', 'user_name': 'User',
+            'message': message, 'comments': 'comment {}'.format(audit_id)}
+
+
+class ParseStateChangesTests(unittest.TestCase):
+
+    def test_state_change_fields(self):
+        message = STATE_CHANGE.format('Freezer 1 &rarr; Box 2', 1234, 'Stored', 'Disposed')
+        (state_changes, unmatched) = parse_state_changes([audit(7, message)])
+        self.assertEqual(unmatched, [])
+        self.assertEqual(state_changes, [{'type': 'Disposed', 'audit_id': 7, 'date': '02/03/2026 10:15:00',
+                                          'user_name': 'User', 'message': message, 'comments': 'comment 7',
+                                          'vial_location': 'Freezer 1 &rarr; Box 2', 'sample_id': '1234',
+                                          'from_state': "'Stored'", 'to_state': "'Disposed'"}])
+
+    def test_other_messages_are_returned_unmatched(self):
+        audits = [audit(1, STATE_CHANGE.format('Box 1', 1001, 'Stored', 'Disposed')),
+                  audit(2, 'Sample <u>"S2"</u> updated'),
+                  audit(3, None),
+                  audit(4, STATE_CHANGE.format('Box 4', 1004, 'Stored', 'Disposed'))]
+        (state_changes, unmatched) = parse_state_changes(audits)
+        self.assertEqual([state_change['sample_id'] for state_change in state_changes], ['1001', '1004'])
+        self.assertEqual([unmatched_audit['id'] for unmatched_audit in unmatched], [2, 3])
+
+    def test_only_states_asked_for(self):
+        audits = [audit(1, STATE_CHANGE.format('Box 1', 1001, 'Stored', 'Disposed'), 'Disposed'),
+                  audit(2, STATE_CHANGE.format('Box 2', 1002, 'Disposed', 'Stored'), 'Stored'),
+                  audit(3, 'Sample <u>"S3"</u> updated', 'Sample')]
+        (state_changes, unmatched) = parse_state_changes(audits, ['Stored'])
+        self.assertEqual([state_change['audit_id'] for state_change in state_changes], [2])
+        self.assertEqual(unmatched, [])
+
+    def test_no_audits(self):
+        self.assertEqual(parse_state_changes([]), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
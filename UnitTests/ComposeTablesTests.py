@@ -0,0 +1,63 @@
+""" Tests of group_rows and compose_tables (per-recipient email tables, no api calls are made)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+import stub_servers  # noqa: F401 (puts Source on the path)
+from FreezerPro import group_rows, compose_tables, dict_to_html
+
+KEYS = ['id', 'location']
+HEADERS = ['Sample Id', 'Location']
+ROWS = [{'id': 5, 'owner_id': 2, 'location': 'Box 5'},
+        {'id': 3, 'owner_id': 1, 'location': 'Box 3'},
+        {'id': 4, 'owner_id': 2, 'location': None},
+        {'id': 1, 'owner_id': 1, 'location': 'Box 1'}]
+
+
+def ids(groups):
+    return {recipient: [row['id'] for row in rows] for recipient, rows in groups.items()}
+
+
+class GroupRowsTests(unittest.TestCase):
+
+    def test_rows_keep_order_without_sort_key(self):
+        groups = group_rows(ROWS, 'owner_id')
+        self.assertEqual(list(groups), [2, 1])
+        self.assertEqual(ids(groups), {2: [5, 4], 1: [3, 1]})
+
+    def test_rows_sorted_before_grouping(self):
+        groups = group_rows(ROWS, 'owner_id', lambda row: row['id'])
+        self.assertEqual(list(groups), [1, 2])
+        self.assertEqual(ids(groups), {1: [1, 3], 2: [4, 5]})
+
+    def test_rows_are_not_changed(self):
+        rows = list(ROWS)
+        group_rows(rows, 'owner_id', lambda row: row['id'])
+        self.assertEqual(rows, ROWS)
+
+    def test_no_rows(self):
+        self.assertEqual(group_rows([], 'owner_id'), {})
+
+
+class ComposeTablesTests(unittest.TestCase):
+
+    def test_table_of_each_recipient(self):
+        tables = compose_tables(ROWS, 'owner_id', KEYS, HEADERS, lambda row: row['id'])
+        self.assertEqual(list(tables), [1, 2])
+        self.assertEqual(tables[1], dict_to_html([ROWS[3], ROWS[1]], KEYS, HEADERS))
+        self.assertEqual(tables[2], dict_to_html([ROWS[2], ROWS[0]], KEYS, HEADERS))
+
+    def test_table_matches_scanning_rows_for_each_recipient(self):
+        tables = compose_tables(ROWS, 'owner_id', KEYS, HEADERS)
+        for recipient in (1, 2):
+            self.assertEqual(tables[recipient], dict_to_html([row for row in ROWS if row['owner_id'] == recipient], KEYS, HEADERS))
+
+    def test_table_html(self):
+        html = compose_tables(ROWS[2:3], 'owner_id', KEYS, HEADERS)[2]
+        self.assertEqual(html, '<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n'
+                               '      <th>Sample Id</th>\n      <th>Location</th>\n    </tr>\n  </thead>\n  <tbody>\n'
+                               '    <tr>\n      <td>4</td>\n      <td></td>\n    </tr>\n  </tbody>\n</table>')
+
+
+if __name__ == '__main__':
+    unittest.main()
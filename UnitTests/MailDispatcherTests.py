@@ -0,0 +1,81 @@
+""" Tests of MailDispatcher and deliver against StubSMTPServer (a local SMTP server)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+from stub_servers import StubSMTPServer, use_settings
+import FreezerPro
+from FreezerPro import MailDispatcher, deliver, send_html
+
+SUPPORT = 'support@example.com'
+
+
+def message(number):
+    return 'Subject: Test {}\r\n\r\nMessage {}\r\n'.format(number, number)
+
+
+class MailDispatcherTests(unittest.TestCase):
+
+    def serve(self, **kwargs):
+        server = StubSMTPServer(**kwargs).__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+        use_settings(smtp_port=server.port)
+        return server
+
+    def test_connection_is_reused(self):
+        server = self.serve()
+        with MailDispatcher() as dispatcher:
+            for number in range(5):
+                dispatcher.sendmail('from@example.com', ['user{}@example.com'.format(number)], message(number))
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(dispatcher.opened, 1)
+        self.assertEqual([recipients for from_addr, recipients, text in server.messages],
+                         [['user{}@example.com'.format(number)] for number in range(5)])
+
+    def test_send_html_uses_active_dispatcher(self):
+        server = self.serve()
+        with MailDispatcher():
+            for number in range(3):
+                send_html('User', ['user@example.com'], 'Test {}'.format(number), '<p>Message {}</p>'.format(number))
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(len(server.messages), 3)
+        self.assertIsNone(FreezerPro.mail_dispatcher)
+
+    def test_reconnects_when_server_drops_connection(self):
+        server = self.serve(drop_after=2)
+        with MailDispatcher() as dispatcher:
+            for number in range(5):
+                dispatcher.sendmail('from@example.com', ['user@example.com'], message(number))
+        self.assertEqual(server.connections, 3)
+        self.assertEqual(dispatcher.opened, 3)
+        self.assertEqual([text.splitlines()[-1] for from_addr, recipients, text in server.messages],
+                         ['Message {}'.format(number) for number in range(5)])
+
+
+class DeliverTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubSMTPServer().__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    def deliver(self, **settings):
+        use_settings(smtp_port=self.server.port, **settings)
+        deliver('from@example.com', ['a@example.com', 'b@example.com'], message(1))
+        return [(from_addr, recipients) for from_addr, recipients, text in self.server.messages]
+
+    def test_sent_to_addresses(self):
+        self.assertEqual(self.deliver(), [('from@example.com', ['a@example.com', 'b@example.com'])])
+
+    def test_support_only(self):
+        self.assertEqual(self.deliver(EMAIL_SUPPORT_ONLY=True), [('from@example.com', [SUPPORT])])
+
+    def test_support_also(self):
+        self.assertEqual(self.deliver(EMAIL_SUPPORT_ALSO=True),
+                         [('from@example.com', ['a@example.com', 'b@example.com']), ('donotreply@scionresearch.com', [SUPPORT])])
+
+    def test_support_only_overrides_support_also(self):
+        self.assertEqual(self.deliver(EMAIL_SUPPORT_ONLY=True, EMAIL_SUPPORT_ALSO=True), [('from@example.com', [SUPPORT])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+""" Tests of MailOutbox claims against StubSMTPServer (a local SMTP server)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from stub_servers import StubSMTPServer, use_settings
+import MailOutbox
+from MailOutbox import MailOutbox as Outbox, STALE_CLAIM
+
+
+class MailOutboxTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubSMTPServer().__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        use_settings(smtp_port=self.server.port, OUTBOX_DIR=folder.name)
+        self.outbox = Outbox()
+
+    def age(self, path, seconds):
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+    def test_claim_of_old_message_is_not_stale(self):
+        name = self.outbox.enqueue('from@example.com', ['user@example.com'], 'Subject: Test\r\n\r\nMessage\r\n')
+        self.age(os.path.join(self.outbox.directory, name), 2 * STALE_CLAIM)
+        sending_path = self.outbox._claim(name)
+        self.outbox.reclaim_stale()
+        self.assertTrue(os.path.exists(sending_path))
+        self.assertEqual(self.outbox.waiting(), [])
+
+    def test_stale_claim_is_returned_to_outbox(self):
+        name = self.outbox.enqueue('from@example.com', ['user@example.com'], 'Subject: Test\r\n\r\nMessage\r\n')
+        sending_path = self.outbox._claim(name)
+        self.age(sending_path, STALE_CLAIM + 60)
+        self.outbox.reclaim_stale()
+        self.assertEqual(self.outbox.waiting(), [name])
+
+    def test_reclaim_ignores_claim_removed_meanwhile(self):
+        name = self.outbox.enqueue('from@example.com', ['user@example.com'], 'Subject: Test\r\n\r\nMessage\r\n')
+        sending_path = self.outbox._claim(name)
+        getmtime = os.path.getmtime
+
+        def removed_first(path):
+            os.remove(sending_path)
+            return getmtime(path)
+        with mock.patch.object(MailOutbox.os.path, 'getmtime', removed_first):
+            self.outbox.reclaim_stale()
+        self.assertEqual(self.outbox.waiting(), [])
+
+    def test_flush_sends_each_message_once(self):
+        for number in range(3):
+            self.outbox.enqueue('from@example.com', ['user{}@example.com'.format(number)],
+                                'Subject: Test\r\n\r\nMessage {}\r\n'.format(number))
+        counts = self.outbox.flush(workers=2)
+        self.assertEqual((counts['sent'], counts['failed']), (3, 0))
+        self.assertEqual(self.outbox.flush()['sent'], 0)
+        self.assertEqual(sorted(recipients for from_addr, recipients, text in self.server.messages),
+                         [['user{}@example.com'.format(number)] for number in range(3)])
+        self.assertEqual(os.listdir(self.outbox.directory), ['failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+""" Tests of classify_review_dates of ReviewDates (no api calls are made)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+from datetime import date
+from stub_servers import use_settings
+from ReviewDates import classify_review_dates, parse_date, BUCKETS
+
+TODAY = date(2026, 3, 2)
+
+
+def sample(sample_id, review_date, created_at='01/01/2020'):
+    return {'id': sample_id, 'Review Date': review_date, 'created_at': created_at}
+
+
+class ClassifyReviewDatesTests(unittest.TestCase):
+
+    def classify(self, samples, **kwargs):
+        buckets = classify_review_dates(samples, TODAY, **dict({'days_long': 30, 'days_short': 7, 'short_term': 90}, **kwargs))
+        return {bucket: [sample['id'] for sample in buckets[bucket]] for bucket in BUCKETS}
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('2/3/2026'), date(2026, 3, 2))
+        self.assertEqual(parse_date('02/03/2026'), date(2026, 3, 2))
+        for text in (None, '', '2026-03-02', '31/02/2026', '1/2', 'a/b/c'):
+            self.assertIsNone(parse_date(text), text)
+
+    def test_overdue(self):
+        samples = [sample(1, '01/03/2026'), sample(2, '02/03/2026'), sample(3, '01/01/2000', '01/12/1999')]
+        self.assertEqual(self.classify(samples)['overdue'], [1, 3])
+
+    def test_long_term_samples_near_review(self):
+        samples = [sample(1, '02/03/2026'), sample(2, '01/04/2026'), sample(3, '02/04/2026')]
+        self.assertEqual(self.classify(samples), {'overdue': [], 'near_short': [], 'near_long': [1, 2]})
+
+    def test_short_term_samples_near_review(self):
+        # review date within short_term days of created_at
+        samples = [sample(1, '09/03/2026', '01/02/2026'), sample(2, '10/03/2026', '01/02/2026'),
+                   sample(3, '20/03/2026', '20/12/2025')]
+        self.assertEqual(self.classify(samples), {'overdue': [], 'near_short': [1], 'near_long': []})
+        self.assertEqual(self.classify(samples, days_short=30)['near_short'], [1, 2, 3])
+
+    def test_sample_without_created_at_is_long_term(self):
+        samples = [sample(1, '20/03/2026', None), sample(2, '20/03/2026', 'unknown')]
+        self.assertEqual(self.classify(samples)['near_long'], [1, 2])
+
+    def test_samples_without_review_date_are_ignored(self):
+        samples = [sample(1, None), sample(2, ''), sample(3, '2026-03-01'), sample(4, '01/03/2026')]
+        self.assertEqual(self.classify(samples), {'overdue': [4], 'near_short': [], 'near_long': []})
+
+    def test_defaults_from_settings(self):
+        use_settings(DAYS_TO_REVIEW_NORMAL=10, DAYS_TO_REVIEW_SHORT=3, SHORT_REVIEW_REMINDER=90)
+        samples = [sample(1, '12/03/2026'), sample(2, '13/03/2026'), sample(3, '05/03/2026', '01/02/2026')]
+        buckets = classify_review_dates(samples, TODAY)
+        self.assertEqual({bucket: [sample['id'] for sample in buckets[bucket]] for bucket in BUCKETS},
+                         {'overdue': [], 'near_short': [3], 'near_long': [1]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+""" Tests of get_samples_bulk and hydrate_samples against StubFreezerPro (a local FreezerPro api)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+from unittest import mock
+from stub_servers import StubFreezerPro, use_settings, PASSWORD
+from FreezerPro import get_samples_bulk, hydrate_samples
+
+
+def make_samples(count):
+    samples = {sample_id: {'id': sample_id, 'owner': 'user{}'.format(sample_id % 3), 'owner_username': 'user{}'.format(sample_id % 3),
+                           'sample_type': 'Type {}'.format(sample_id % 2), 'udfs': {'Approval Contact': 'Contact {}'.format(sample_id)}}
+               for sample_id in range(2000, 2000 + count)}
+    del samples[2000]['udfs']['Approval Contact']
+    return samples
+
+
+def expected(samples, sample_ids):
+    return {str(sample_id): {'owner': samples[sample_id]['owner'], 'sample_type': samples[sample_id]['sample_type'],
+                             'Approval Contact': samples[sample_id]['udfs'].get('Approval Contact')}
+            for sample_id in sample_ids}
+
+
+class SamplesBulkTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('keyring.get_password', return_value=PASSWORD)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.samples = make_samples(12)
+        self.sample_ids = [2003, 2000, 2011, 2003, 2005]
+
+    def serve(self, **kwargs):
+        server = StubFreezerPro(samples=self.samples, **kwargs).__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+        use_settings(api_url=server.url, BULK_SEARCH_IDS=2)
+        return server
+
+    def bulk(self):
+        return get_samples_bulk(self.sample_ids, ['owner', 'sample_type'], ['Approval Contact'])
+
+    def test_samples_found_by_search(self):
+        server = self.serve()
+        self.assertEqual(self.bulk(), expected(self.samples, self.sample_ids))
+        self.assertEqual(server.calls['advanced_search'], 2)
+        self.assertEqual(server.calls['sample_info'] + server.calls['sample_userfields'], 0)
+
+    def test_samples_not_asked_for_are_ignored(self):
+        server = self.serve(ignore_id_query=True)
+        self.assertEqual(self.bulk(), expected(self.samples, self.sample_ids))
+        self.assertEqual(server.calls['sample_info'], 0)
+
+    def test_samples_missing_a_field_are_retrieved_one_at_a_time(self):
+        server = self.serve(omit_sdfs=['owner_username'])
+        self.assertEqual(self.bulk(), expected(self.samples, self.sample_ids))
+        self.assertEqual(server.calls['sample_info'], 4)
+        self.assertEqual(server.calls['sample_userfields'], 4)
+
+    def test_no_fallback_leaves_out_missing_samples(self):
+        self.serve(omit_sdfs=['locations_count'])
+        self.assertEqual(get_samples_bulk(self.sample_ids, ['locations_count'], fallback=False), {})
+
+    def test_hydrate_samples_adds_fields_to_rows(self):
+        self.serve(omit_sdfs=['owner_username'])
+        rows = hydrate_samples([{'sample_id': sample_id} for sample_id in self.sample_ids] + [{'sample_id': None}],
+                               ['owner', 'sample_type'], ['Approval Contact'])
+        self.assertEqual([row['owner'] for row in rows], [self.samples[sample_id]['owner'] for sample_id in self.sample_ids] + [None])
+
+    def test_sample_that_cannot_be_retrieved_raises(self):
+        self.serve()
+        with self.assertRaises(RuntimeError):
+            hydrate_samples([{'sample_id': 9999}], ['owner'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+""" Tests of CronSchedule of Scheduler.py (no jobs are run)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import unittest
+from datetime import datetime
+import stub_servers  # noqa: F401 (puts Source on the path)
+from Scheduler import CronSchedule
+
+
+class CronScheduleTests(unittest.TestCase):
+
+    def test_parse_field(self):
+        self.assertEqual(CronSchedule.parse_field('*', 'hour', 0, 23), set(range(24)))
+        self.assertEqual(CronSchedule.parse_field('8-15', 'hour', 0, 23), set(range(8, 16)))
+        self.assertEqual(CronSchedule.parse_field('0,30', 'minute', 0, 59), {0, 30})
+        self.assertEqual(CronSchedule.parse_field('*/15', 'minute', 0, 59), {0, 15, 30, 45})
+        self.assertEqual(CronSchedule.parse_field('8-16/2', 'hour', 0, 23), {8, 10, 12, 14, 16})
+        self.assertEqual(CronSchedule.parse_field('5/20', 'minute', 0, 59), {5, 25, 45})
+
+    def test_invalid_schedules(self):
+        for expression in ('0 8-15 * *', '60 * * * *', '0 24 * * *', '0 0 0 * *', '0 15-8 * * *', '*/0 * * * *',
+                           'x * * * *', '0 0 * 13 *'):
+            with self.assertRaises(RuntimeError, msg=expression):
+                CronSchedule(expression)
+
+    def test_next_run_within_hours(self):
+        schedule = CronSchedule('25 8-15 * * *')
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 2, 7, 59, 30)), datetime(2026, 3, 2, 8, 25))
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 2, 8, 25)), datetime(2026, 3, 2, 9, 25))
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 2, 15, 25)), datetime(2026, 3, 3, 8, 25))
+
+    def test_next_run_is_whole_minute_after(self):
+        schedule = CronSchedule('*/5 * * * *')
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 2, 10, 4, 59, 999)), datetime(2026, 3, 2, 10, 5))
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 2, 23, 55, 1)), datetime(2026, 3, 3, 0, 0))
+
+    def test_next_run_across_month_and_year(self):
+        self.assertEqual(CronSchedule('0 6 1 * *').next_after(datetime(2026, 1, 31, 7)), datetime(2026, 2, 1, 6))
+        self.assertEqual(CronSchedule('0 0 29 2 *').next_after(datetime(2026, 3, 1)), datetime(2028, 2, 29))
+        self.assertEqual(CronSchedule('30 9 * 1 *').next_after(datetime(2026, 12, 31, 12)), datetime(2027, 1, 1, 9, 30))
+
+    def test_weekdays(self):
+        # 2026-03-01 is a Sunday
+        weekdays = CronSchedule('0 9 * * 1-5')
+        self.assertEqual(weekdays.next_after(datetime(2026, 2, 27, 10)), datetime(2026, 3, 2, 9))
+        self.assertEqual(CronSchedule('0 9 * * 7').next_after(datetime(2026, 2, 27)), datetime(2026, 3, 1, 9))
+        self.assertEqual(CronSchedule('0 9 * * 0').next_after(datetime(2026, 2, 27)), datetime(2026, 3, 1, 9))
+
+    def test_day_or_weekday(self):
+        # as for cron, when both day and weekday are given either can match
+        schedule = CronSchedule('0 9 15 * 1')
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 10, 10)), datetime(2026, 3, 15, 9))
+        self.assertEqual(schedule.next_after(datetime(2026, 3, 15, 10)), datetime(2026, 3, 16, 9))
+
+    def test_schedule_that_never_matches(self):
+        with self.assertRaises(RuntimeError):
+            CronSchedule('0 0 31 2 *').next_after(datetime(2026, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+""" Tests of AuditCheckpoint and chunk_updates of UpdateSampleStateUDF (no api calls are made)
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from stub_servers import use_settings
+import UpdateSampleStateUDF
+from UpdateSampleStateUDF import AuditCheckpoint, CHECKPOINT_DATE_FORMAT, FULL_DATE_FLAG, chunk_updates, update_samples
+
+
+def state_change(audit_id, sample_id=1):
+    return {'audit_id': audit_id, 'sample_id': sample_id, 'date': '01/02/2026 10:00:00'}
+
+
+class AuditCheckpointTests(unittest.TestCase):
+
+    def setUp(self):
+        use_settings()
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.filename = os.path.join(folder.name, 'checkpoint.json')
+
+    def write(self, data):
+        with open(self.filename, 'w') as f:
+            f.write(data if isinstance(data, str) else json.dumps(data))
+
+    def read(self):
+        with open(self.filename) as f:
+            return json.load(f)
+
+    def test_missing_file_checks_a_week(self):
+        checkpoint = AuditCheckpoint(self.filename, overlap=60)
+        self.assertIsNone(checkpoint.since())
+        self.assertEqual(checkpoint.date_flag(), FULL_DATE_FLAG)
+        self.assertTrue(checkpoint.is_new(state_change(1)))
+
+    def test_corrupt_file_is_ignored(self):
+        for data in ('{not json', {'checked_at': 'yesterday', 'last_audit_id': 5}, {'last_audit_id': 'x'}):
+            self.write(data)
+            checkpoint = AuditCheckpoint(self.filename, overlap=60)
+            self.assertEqual((checkpoint.checked_at, checkpoint.last_audit_id), (None, None))
+            self.assertEqual(checkpoint.date_flag(), FULL_DATE_FLAG)
+
+    def test_audits_requested_from_overlap_before_last_run(self):
+        checked_at = datetime.datetime(2026, 3, 2, 0, 20)
+        self.write({'last_audit_id': 10, 'checked_at': checked_at.strftime(CHECKPOINT_DATE_FORMAT)})
+        checkpoint = AuditCheckpoint(self.filename, overlap=30)
+        self.assertEqual(checkpoint.since(), datetime.datetime(2026, 3, 1, 23, 50))
+        self.assertEqual(checkpoint.date_flag(), '01/03/2026,{:%d/%m/%Y}'.format(datetime.date.today()))
+
+    def test_only_audits_above_checkpoint_are_new(self):
+        self.write({'last_audit_id': 10, 'checked_at': '2026-03-02T00:20:00'})
+        checkpoint = AuditCheckpoint(self.filename, overlap=60)
+        self.assertEqual([checkpoint.is_new(state_change(audit_id)) for audit_id in (9, 10, 11, '12')],
+                         [False, False, True, True])
+        for audit_id in (12, 11):
+            checkpoint.advance(state_change(audit_id))
+        checkpoint.save()
+        self.assertEqual(self.read()['last_audit_id'], 12)
+        self.assertEqual(AuditCheckpoint(self.filename).last_audit_id, 12)
+
+    def test_old_checkpoint_key_is_read(self):
+        self.write({'last_audit_id': 3, 'last_audit_at': '2026-03-02T00:20:00'})
+        checkpoint = AuditCheckpoint(self.filename, overlap=0)
+        self.assertEqual(checkpoint.since(), datetime.datetime(2026, 3, 2, 0, 20))
+
+    def test_audits_without_id_are_checked_again(self):
+        self.write({'last_audit_id': 10, 'checked_at': '2026-03-02T00:20:00'})
+        checkpoint = AuditCheckpoint(self.filename, overlap=60)
+        for audit_id in (None, '', 'x'):
+            self.assertTrue(checkpoint.is_new(state_change(audit_id)))
+            checkpoint.advance(state_change(audit_id))
+        self.assertEqual(checkpoint.without_id, 3)
+        checkpoint.save()
+        self.assertEqual(self.read()['last_audit_id'], 10)
+
+    def test_not_saved_when_update_fails(self):
+        self.write({'last_audit_id': 10, 'checked_at': '2026-03-02T00:20:00'})
+        checkpoint = AuditCheckpoint(self.filename, overlap=60)
+
+        def find_samplestates(date_flag, checkpoint):
+            checkpoint.advance(state_change(20))
+            return ([{'UID': 1, 'SampleState': 'Disposed', 'SampleStateDate': '01/02/2026'}], set())
+        with mock.patch.object(UpdateSampleStateUDF, 'find_samplestates', find_samplestates), \
+                mock.patch.object(UpdateSampleStateUDF, 'update_samples', side_effect=RuntimeError('update failed')):
+            with self.assertRaises(RuntimeError):
+                UpdateSampleStateUDF.main(checkpoint)
+        self.assertEqual(self.read(), {'last_audit_id': 10, 'checked_at': '2026-03-02T00:20:00'})
+        with mock.patch.object(UpdateSampleStateUDF, 'find_samplestates', find_samplestates), \
+                mock.patch.object(UpdateSampleStateUDF, 'update_samples', return_value=['job']):
+            UpdateSampleStateUDF.main(checkpoint)
+        self.assertEqual(self.read()['last_audit_id'], 20)
+
+
+def update(sample_id, state='Disposed'):
+    return {'UID': sample_id, 'SampleState': state, 'SampleStateDate': '01/02/2026'}
+
+
+class ChunkUpdatesTests(unittest.TestCase):
+
+    def setUp(self):
+        use_settings()
+
+    def test_chunks_limited_by_records(self):
+        updates = [update(sample_id) for sample_id in range(25)]
+        chunks = list(chunk_updates(updates, max_records=10, max_bytes=10 ** 6))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual([sample for chunk in chunks for sample in chunk], updates)
+
+    def test_chunks_limited_by_json_size(self):
+        updates = [update(sample_id, 'Current' if sample_id % 2 else 'Awaiting Delivery') for sample_id in range(40)]
+        chunks = list(chunk_updates(updates, max_records=1000, max_bytes=500))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(json.dumps(chunk)), 500)
+        self.assertEqual([sample for chunk in chunks for sample in chunk], updates)
+
+    def test_record_larger_than_max_bytes_is_sent_on_its_own(self):
+        updates = [update(1), dict(update(2), Comments='x' * 200), update(3)]
+        self.assertEqual([len(chunk) for chunk in chunk_updates(updates, max_records=10, max_bytes=150)], [1, 1, 1])
+
+    def test_defaults_from_settings(self):
+        use_settings(UPDATE_CHUNK_RECORDS=4)
+        self.assertEqual([len(chunk) for chunk in chunk_updates([update(sample_id) for sample_id in range(9)])], [4, 4, 1])
+
+    def test_no_updates(self):
+        self.assertEqual(list(chunk_updates([])), [])
+        self.assertEqual(update_samples([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
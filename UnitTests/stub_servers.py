@@ -0,0 +1,236 @@
+""" Local stand-ins for the servers SamplePro talks to, for the tests in this folder
+StubFreezerPro serves the FreezerPro api calls used by the tests from in-memory samples and vials.
+StubSMTPServer accepts emails and records the connections and messages.
+use_settings points FreezerPro.settings at the stand-ins instead of reading config.ini.
+
+Run the tests from the repository folder:
+    python -m unittest discover -s UnitTests -p "*Tests.py"
+"""
+
+import configparser
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Source')
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+import FreezerPro  # noqa: E402 (Source must be on the path first)
+
+PASSWORD = 'password'  # tests patch keyring.get_password to return this
+
+
+def use_settings(api_url='http://127.0.0.1:1/api', smtp_port=25, **overrides):
+    """ Set every FreezerPro setting from a test config (config.ini is not read)
+    :param api_url: url of StubFreezerPro
+    :param smtp_port: port of local SMTP server
+    :param overrides: settings to change e.g. EMAIL_SUPPORT_ONLY=True
+    """
+    config = configparser.ConfigParser()
+    config.read_dict({'FreezerPro': {'username': 'tester', 'api_url': api_url,
+                                     'token_cache_file': os.path.join(tempfile.gettempdir(), 'SamplePro_test_token.json')},
+                      'MailServer': {'smtpserver': '127.0.0.1', 'smtpport': str(smtp_port)},
+                      'System': {'support_email': 'support@example.com'}})
+    for name, read in FreezerPro.SETTINGS.items():
+        setattr(FreezerPro.settings, name, read(config))
+    FreezerPro.settings.config = config
+    for name, value in overrides.items():
+        setattr(FreezerPro.settings, name, value)
+    FreezerPro.token_manager = FreezerPro.TokenManager()
+    FreezerPro.api_calls.clear()
+
+
+class StubFreezerPro:
+    """ FreezerPro api on a local port
+    with StubFreezerPro(samples, vials) as server:
+        use_settings(api_url=server.url)
+    Serves gen_token, sample_info, sample_userfields, vials_sample (by sample_id or vial_state_type_id) and
+    advanced_search (of sample ids), with results in pages of at most page_size.
+    :param samples: dictionary of sample id: sample_info fields (udfs under 'udfs')
+    :param vials: list of vials (id, sample_id, state_id, state_info)
+    :param latency: seconds taken by each call
+    :param page_size: maximum results returned by one call
+    :param ignore_id_query: advanced_search returns every sample (as a server that does not search by a list of ids)
+    :param omit_sdfs: system fields advanced_search does not return
+    calls counts calls by method, max_in_flight is the most calls in progress at once.
+    """
+    METHODS = ('sample_info', 'sample_userfields', 'vials_sample', 'advanced_search')
+
+    def __init__(self, samples=None, vials=None, latency=0, page_size=1000, ignore_id_query=False, omit_sdfs=()):
+        self.samples = samples or {}
+        self.ignore_id_query = ignore_id_query
+        self.omit_sdfs = omit_sdfs
+        self.vials = vials or []
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.httpd = None
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body)
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body).items()}
+                result = json.dumps(stub.call(params)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(result)))
+                self.end_headers()
+                self.wfile.write(result)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/api'.format(self.httpd.server_address[1])
+
+    def call(self, params):
+        method = params.get('method')
+        with self.lock:
+            self.calls[method] += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            if method == 'gen_token':
+                return {'auth_token': 'token'}
+            if params.get('auth_token') != 'token':
+                return {'error': True, 'message': 'Invalid authentication token'}
+            if method not in self.METHODS:
+                return {'error': True, 'message': 'Unknown method {}'.format(method)}
+            try:
+                return getattr(self, method)(params)
+            except KeyError as err:
+                return {'error': True, 'message': 'Not found {}'.format(err)}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def page(self, results, params, name):
+        start = int(params.get('start') or 0)
+        limit = min(int(params.get('limit') or self.page_size), self.page_size)
+        return {'Total': len(results), name: results[start:start + limit]}
+
+    def sample_info(self, params):
+        sample = self.samples[int(params['id'])]
+        return {key: value for key, value in sample.items() if key != 'udfs'}
+
+    def sample_userfields(self, params):
+        return dict(self.samples[int(params['id'])].get('udfs', {}))
+
+    def vials_sample(self, params):
+        if 'sample_id' in params:
+            vials = [vial for vial in self.vials if vial['sample_id'] == int(params['sample_id'])]
+        else:
+            vials = [vial for vial in self.vials if vial['state_id'] == int(params['vial_state_type_id'])]
+        return self.page(vials, params, 'Locations')
+
+    def advanced_search(self, params):
+        ids = [int(sample_id) for query in params['query'] if query['field'] == 'id' for sample_id in query['value']]
+        if self.ignore_id_query:
+            ids = list(self.samples)
+        samples = []
+        for sample_id in sorted(set(ids) & set(self.samples)):
+            sample = self.samples[sample_id]
+            found = {sdf: sample.get(sdf) for sdf in params.get('sdfs', []) if sdf not in self.omit_sdfs}
+            found['udfs'] = {udf: sample.get('udfs', {})[udf] for udf in params.get('udfs', []) if udf in sample.get('udfs', {})}
+            samples.append(found)
+        return self.page(samples, params, 'Samples')
+
+
+class StubSMTPServer:
+    """ SMTP server on a local port
+    with StubSMTPServer() as server:
+        use_settings(smtp_port=server.port)
+    messages is a list of (from_addr, [recipients], message) received, connections counts connections opened.
+    :param drop_after: close each connection (without a reply) after this many messages, as a server closing
+                       idle connections does
+    """
+
+    def __init__(self, drop_after=None):
+        self.drop_after = drop_after
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.tcpd = None
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write((line + '\r\n').encode())
+
+            def handle(self):
+                with stub.lock:
+                    stub.connections += 1
+                self.reply('220 stub')
+                (from_addr, recipients, received) = (None, [], 0)
+                for line in self.rfile:
+                    command = line.decode().strip()
+                    verb = command[:4].upper()
+                    if verb in ('EHLO', 'HELO'):
+                        self.reply('250 stub')
+                    elif verb == 'MAIL':
+                        if stub.drop_after is not None and received >= stub.drop_after:
+                            return
+                        (from_addr, recipients) = (command.split(':', 1)[1].strip(' <>'), [])
+                        self.reply('250 OK')
+                    elif verb == 'RCPT':
+                        recipients.append(command.split(':', 1)[1].strip(' <>'))
+                        self.reply('250 OK')
+                    elif verb == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        lines = []
+                        for data in self.rfile:
+                            if data.rstrip(b'\r\n') == b'.':
+                                break
+                            lines.append(data.decode())
+                        with stub.lock:
+                            stub.messages.append((from_addr, recipients, ''.join(lines)))
+                        received += 1
+                        self.reply('250 OK')
+                    elif verb == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:  # RSET, NOOP
+                        self.reply('250 OK')
+
+        self.tcpd = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.tcpd.daemon_threads = True
+        threading.Thread(target=self.tcpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tcpd.shutdown()
+        self.tcpd.server_close()
+
+    @property
+    def port(self):
+        return self.tcpd.server_address[1]